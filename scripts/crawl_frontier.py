@@ -0,0 +1,240 @@
+"""
+Persistent crawl frontier for the crawlers.
+
+Every discovered article is recorded in SQLite with its DOI and state
+(discovered → pdf_found → downloaded, or failed), and every search year with
+the next result page to read. A crawl that crashes or is interrupted resumes
+from there, an article already seen under another year or in another run is
+never fetched again, and PDFs are named by DOI.
+
+Several crawler processes can share one frontier: years and articles are
+claimed with a lease inside an IMMEDIATE transaction, so two processes never
+work on the same item, and the claims of a crashed process expire.
+"""
+import os
+import re
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import unquote, urlparse
+
+STATES = ('discovered', 'pdf_found', 'downloaded', 'failed')
+
+# nature.com/articles/<suffix> → DOI 10.1038/<suffix>; doi.org/<doi> → <doi>
+NATURE_ARTICLE = re.compile(r'^/articles/([^/?#]+)')
+DOI_PATTERN = re.compile(r'(10\.\d{4,9}/[^\s?#]+)')
+
+
+def doi_from_url(url):
+    """
+    Derive the DOI of an article URL.
+
+    Args:
+        url (str): Article URL (nature.com article page or a doi.org link)
+
+    Returns:
+        str or None: Lower-cased DOI, or None if the URL does not identify one
+    """
+    parsed = urlparse(url)
+    match = NATURE_ARTICLE.match(parsed.path)
+    if parsed.netloc.endswith('nature.com') and match:
+        return f"10.1038/{match.group(1)}".lower()
+    match = DOI_PATTERN.search(unquote(parsed.path))
+    return match.group(1).lower() if match else None
+
+
+def doi_file_name(doi):
+    """File name for a DOI, e.g. '10.1038/s41467-019-1' → '10.1038_s41467-019-1.pdf'."""
+    return re.sub(r'[^\w.-]', '_', doi) + '.pdf'
+
+
+class CrawlFrontier:
+    """
+    SQLite-backed frontier of search years and articles.
+
+    Args:
+        path (str): Database file
+        worker_id (str or None): Name of this crawler in claims (default: '<host>-<pid>')
+        lease (float): Seconds after which a claim of an unresponsive crawler can be taken over
+        max_attempts (int): Failed articles are retried in later runs until they failed this often
+    """
+
+    def __init__(self, path, worker_id=None, lease=1800, max_attempts=3):
+        self.path = path
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.started = time.time()
+        # Download threads report results through the same connection
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS years (
+                year INTEGER PRIMARY KEY,
+                next_page INTEGER NOT NULL DEFAULT 1,
+                total INTEGER,
+                done INTEGER NOT NULL DEFAULT 0,
+                claimed_by TEXT,
+                claimed_at REAL,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS articles (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL UNIQUE,
+                doi TEXT,
+                year INTEGER,
+                state TEXT NOT NULL,
+                pdf_url TEXT,
+                file TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                claimed_by TEXT,
+                claimed_at REAL,
+                updated REAL NOT NULL
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS articles_doi ON articles(doi) WHERE doi IS NOT NULL;
+            CREATE INDEX IF NOT EXISTS articles_state ON articles(year, state);
+        ''')
+
+    def close(self):
+        self.release()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _transaction(self, fn):
+        """Run `fn(conn)` in an IMMEDIATE transaction (write lock taken up front, so claims cannot race)."""
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = fn(self.conn)
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+            return result
+
+    # === Search years ===
+    def claim_year(self, year):
+        """
+        Claim the search listing of `year`.
+
+        Returns:
+            int or None: Result page to continue from, or None if the listing is complete
+                or another live crawler holds it
+        """
+        def claim(conn):
+            now = time.time()
+            conn.execute('INSERT OR IGNORE INTO years (year, updated) VALUES (?, ?)', (year, now))
+            row = conn.execute('SELECT next_page FROM years WHERE year = ? AND done = 0 '
+                               'AND (claimed_by IS NULL OR claimed_by = ? OR claimed_at < ?)',
+                               (year, self.worker_id, now - self.lease)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE years SET claimed_by = ?, claimed_at = ? WHERE year = ?', (self.worker_id, now, year))
+            return row[0]
+        return self._transaction(claim)
+
+    def set_total(self, year, total):
+        with self._lock:
+            self.conn.execute('UPDATE years SET total = ?, updated = ? WHERE year = ?', (total, time.time(), year))
+
+    def page_done(self, year, page, last=False):
+        """Record that result page `page` of `year` is listed (and whether it was the last one); renews the claim."""
+        now = time.time()
+        with self._lock:
+            self.conn.execute('UPDATE years SET next_page = ?, done = ?, claimed_at = ?, updated = ? WHERE year = ?',
+                              (page + 1, int(last), now, now, year))
+
+    # === Articles ===
+    def add(self, urls, year):
+        """
+        Record discovered article URLs. URLs or DOIs already in the frontier (from any
+        year or run) are ignored.
+
+        Returns:
+            int: Number of new articles
+        """
+        def insert(conn):
+            now = time.time()
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO articles (url, doi, year, state, updated) VALUES (?, ?, ?, 'discovered', ?)",
+                             [(url, doi_from_url(url), year, now) for url in urls])
+            return conn.total_changes - before
+        return self._transaction(insert)
+
+    def claim_article(self, year=None):
+        """
+        Claim the next article that still needs work: discovered, PDF link found but not
+        downloaded, or failed in an earlier run fewer than `max_attempts` times.
+
+        Args:
+            year (int or None): Only claim articles of this year
+
+        Returns:
+            dict or None: {'url', 'doi', 'year', 'state', 'pdf_url'}, or None if nothing is left
+        """
+        def claim(conn):
+            now = time.time()
+            # Articles failed during this run are left for the next one
+            query = ("SELECT id, url, doi, year, state, pdf_url FROM articles "
+                     "WHERE (state IN ('discovered', 'pdf_found') "
+                     "       OR (state = 'failed' AND attempts < ? AND updated < ?)) "
+                     "AND (claimed_by IS NULL OR claimed_at < ?)")
+            params = [self.max_attempts, self.started, now - self.lease]
+            if year is not None:
+                query += ' AND year = ?'
+                params.append(year)
+            row = conn.execute(query + ' ORDER BY id LIMIT 1', params).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE articles SET claimed_by = ?, claimed_at = ? WHERE id = ?', (self.worker_id, now, row[0]))
+            return dict(zip(('url', 'doi', 'year', 'state', 'pdf_url'), row[1:]))
+        return self._transaction(claim)
+
+    def _update(self, url, sql, params):
+        with self._lock:
+            self.conn.execute(f'UPDATE articles SET {sql}, updated = ? WHERE url = ?', (*params, time.time(), url))
+
+    def mark_pdf_found(self, url, pdf_url):
+        """Store the PDF link; the article stays claimed until its download finishes."""
+        self._update(url, "state = 'pdf_found', pdf_url = ?, claimed_at = ?", (pdf_url, time.time()))
+
+    def mark_downloaded(self, url, file):
+        self._update(url, "state = 'downloaded', file = ?, error = NULL, claimed_by = NULL", (file,))
+
+    def mark_failed(self, url, error):
+        self._update(url, "state = 'failed', attempts = attempts + 1, error = ?, claimed_by = NULL", (error,))
+
+    def release_article(self, url):
+        """
+        Hand back this crawler's claim on an article without counting an attempt, e.g. when
+        the engine working on it was blocked; it can be claimed again at once (also by this crawler).
+        """
+        with self._lock:
+            self.conn.execute('UPDATE articles SET claimed_by = NULL, updated = ? WHERE url = ? AND claimed_by = ?',
+                              (time.time(), url, self.worker_id))
+
+    def count(self, year=None, state=None):
+        """Number of articles, optionally of one year and/or state."""
+        query, params = 'SELECT COUNT(*) FROM articles WHERE 1', []
+        if year is not None:
+            query += ' AND year = ?'
+            params.append(year)
+        if state is not None:
+            query += ' AND state = ?'
+            params.append(state)
+        with self._lock:
+            return self.conn.execute(query, params).fetchone()[0]
+
+    def release(self):
+        """Give up this crawler's claims (unfinished items are picked up by the next run)."""
+        with self._lock:
+            self.conn.execute('UPDATE articles SET claimed_by = NULL WHERE claimed_by = ?', (self.worker_id,))
+            self.conn.execute('UPDATE years SET claimed_by = NULL WHERE claimed_by = ?', (self.worker_id,))
@@ -0,0 +1,247 @@
+"""
+Browserless search-results harvesting for NatureCrawler.
+
+Search pages and article pages are fetched with a pooled `requests.Session`
+and parsed with the standard-library HTML parser; no browser is started.
+The harvester exposes the same page methods as the Selenium crawler
+(`navigate_to_nature`, `get_total_results`, `list_articles`,
+`go_to_next_page`, `find_pdf_url`), so the crawl loop drives either engine.
+Article pages are fetched by several threads, spaced by the shared per-host
+`RateLimiter`. When the site answers with something that is not a results
+page (bot check, JavaScript wall) or refuses an article page (HTTP 403),
+`HarvestBlocked` tells the crawler to fall back to Selenium.
+"""
+import logging
+import random
+import re
+import time
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pdf_downloader import RETRY_STATUS, USER_AGENT
+
+NATURE_URL = 'https://www.nature.com'
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+
+
+def search_url(year, page=1, base_url=NATURE_URL):
+    """Nature search URL for TEM research articles of `year`."""
+    url = (
+        f"{base_url}/search?"
+        f"q=transmission%2Belectron%2Bmicroscopy&"
+        f"article_type=research&"
+        f"order=relevance&"
+        f"date_range={year}-{year}"
+    )
+    if page > 1:
+        url += f"&page={page}"
+    return url
+
+
+class HarvestBlocked(Exception):
+    """The site did not serve a usable page over plain HTTP; the browser engine is needed."""
+
+
+class PageParser(HTMLParser):
+    """
+    Collect the links, meta tags and result counter of a page.
+
+    Every link keeps its ancestors as (tag, attributes) pairs, so the selectors
+    of the Selenium engine can be applied after parsing.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links = []           # {'href', 'text', 'ancestors'}
+        self.meta = {}            # name → content
+        self.results_text = []    # Text of each <span> inside span[data-test='results-data']
+        self.has_result_list = False
+        self._stack = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'meta' and attrs.get('name'):
+            self.meta[attrs['name']] = attrs.get('content')
+        if attrs.get('id') == 'search-article-list':
+            self.has_result_list = True
+        if tag in VOID_TAGS:
+            return
+        if tag == 'span' and _has_ancestor(self._stack, 'span', **{'data-test': 'results-data'}):
+            self.results_text.append('')
+        self._stack.append((tag, attrs))
+        if tag == 'a':
+            self.links.append({'href': attrs.get('href'), 'text': '', 'ancestors': self._stack[:-1]})
+
+    def handle_endtag(self, tag):
+        # Tolerate unclosed elements: pop up to the matching open tag, if any
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i][0] == tag:
+                del self._stack[i:]
+                return
+
+    def handle_data(self, data):
+        if any(tag == 'a' for tag, _ in self._stack):
+            self.links[-1]['text'] += data
+        if self.results_text and _has_ancestor(self._stack, 'span', **{'data-test': 'results-data'}):
+            self.results_text[-1] += data
+
+
+def _has_ancestor(ancestors, tag=None, **attrs):
+    """Whether an ancestor matches `tag` (any tag if None) and all attribute values in `attrs`."""
+    return any((tag is None or t == tag) and all(a.get(k) == v for k, v in attrs.items()) for t, a in ancestors)
+
+
+def parse_html(html):
+    parser = PageParser()
+    parser.feed(html)
+    parser.close()
+    return parser
+
+
+class HttpHarvester:
+    """
+    Plain-HTTP engine for search results and article pages.
+
+    Args:
+        rate_limiter (RateLimiter or None): Shared per-host limiter (default: no spacing)
+        workers (int): Article pages fetched concurrently
+        base_url (str): Site root (a local stand-in server for offline tests)
+        timeout (float): Request timeout in seconds
+        max_retries (int): Retries of a page after transient errors (429, 5xx, connection errors)
+        backoff (float): Base delay in seconds; retry n waits backoff * 2**n (plus jitter)
+    """
+
+    def __init__(self, rate_limiter=None, workers=4, base_url=NATURE_URL, timeout=30, max_retries=3, backoff=1.0):
+        self.rate_limiter = rate_limiter
+        self.workers = workers
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.logger = logging.getLogger(__name__)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = USER_AGENT
+
+        self._url = None
+        self._page = None
+
+    def fetch(self, url):
+        """
+        GET a page with rate limiting and retries.
+
+        Returns:
+            str: Page HTML
+
+        Raises:
+            requests.RequestException: If the page could not be fetched
+        """
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.wait(url)
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    return response.text
+                error = requests.HTTPError(f"HTTP {response.status_code}", response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if attempt == self.max_retries:
+                raise error
+            delay = self.backoff * 2 ** attempt + random.uniform(0, self.backoff)
+            self.logger.warning(f"Fetching {url} failed ({error}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    def _open(self, url):
+        try:
+            page = parse_html(self.fetch(url))
+        except requests.RequestException as e:
+            raise HarvestBlocked(f"{url}: {e}") from e
+        if not page.has_result_list and not page.results_text:
+            raise HarvestBlocked(f"{url} is not a search results page")
+        self._url, self._page = url, page
+
+    # === Same page methods as the Selenium engine ===
+    def navigate_to_nature(self, year, page=1):
+        """
+        Load a search results page.
+
+        Raises:
+            HarvestBlocked: If the page cannot be fetched or parsed over plain HTTP
+        """
+        self._open(search_url(year, page, self.base_url))
+        self.logger.info(f"Fetched {year} search page {page}")
+        return True
+
+    def get_total_results(self):
+        """Total number of search results shown on the current page (0 if none)"""
+        texts = [text.strip() for text in self._page.results_text if text.strip()]
+        if not texts:
+            return 0
+        match = re.match(r'[\d,]+', texts[-1])
+        return int(match.group(0).replace(',', '')) if match else 0
+
+    def list_articles(self):
+        """Return the article URLs listed on the current search results page"""
+        return [urljoin(self._url, link['href']) for link in self._page.links
+                if link['href'] and _has_ancestor(link['ancestors'], 'h3')
+                and _has_ancestor(link['ancestors'], id='search-article-list')]
+
+    def go_to_next_page(self):
+        """
+        Load the next results page.
+
+        Returns:
+            bool: False if the current page is the last one
+
+        Raises:
+            HarvestBlocked: If the next page cannot be fetched or parsed over plain HTTP
+        """
+        for link in self._page.links:
+            if link['href'] and _has_ancestor(link['ancestors'], 'li', **{'data-page': 'next'}):
+                self._open(urljoin(self._url, link['href']))
+                return True
+        self.logger.info("No more pages available")
+        return False
+
+    def find_pdf_url(self, article_url):
+        """
+        Fetch an article page and return its PDF link (None if not found or the page failed).
+
+        Raises:
+            HarvestBlocked: If the site refuses the article page (HTTP 403, e.g. a bot check)
+        """
+        try:
+            page = parse_html(self.fetch(article_url))
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 403:
+                raise HarvestBlocked(f"{article_url}: {e}") from e
+            self.logger.error(f"Error processing article {article_url}: {e}")
+            return None
+        except requests.RequestException as e:
+            self.logger.error(f"Error processing article {article_url}: {e}")
+            return None
+
+        # Same preference order as the Selenium engine, after the citation metadata
+        candidates = [page.meta.get('citation_pdf_url')]
+        candidates += [link['href'] for link in page.links if _has_ancestor(link['ancestors'], id='entitlement-box-right-column')]
+        candidates += [link['href'] for link in page.links
+                       if _has_ancestor(link['ancestors'], 'aside') and _has_ancestor(link['ancestors'], id='content')]
+        candidates += [link['href'] for link in page.links if link['href'] and '.pdf' in link['href']]
+        candidates += [link['href'] for link in page.links if 'Download PDF' in link['text']]
+        for href in candidates:
+            if href and href.endswith('.pdf'):
+                return urljoin(article_url, href)
+
+        self.logger.warning("No PDF download link found")
+        return None
+
+    def close(self):
+        self.session.close()
@@ -1,19 +1,26 @@
 import csv
 import os
+import sys
 import logging
-import time
-import random
-import requests
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.action_chains import ActionChains
+from crawl_frontier import CrawlFrontier, doi_file_name
+from http_harvester import NATURE_URL, HarvestBlocked, HttpHarvester, search_url
+from pdf_downloader import PdfDownloader, RateLimiter
+
+# Shared tracing/metrics layer of the extraction pipeline (src/project_function/telemetry.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from project_function import telemetry
+
+ARTICLE_LINKS_XPATH = "//*[@id='search-article-list']/div/ul/li/div/article/div[1]/div[2]/h3/a"
 
 class NatureCrawler:
     """
@@ -22,13 +29,26 @@ class NatureCrawler:
     Please comply with Nature's terms of use and copyright regulations.
     """
     
-    def __init__(self, download_path="./downloads", start_year=2010, max_articles=1000):
+    def __init__(self, download_path="./downloads", start_year=2010, max_articles=1000,
+                 download_workers=4, min_delay=2, max_delay=4, frontier_path=None,
+                 engine='http', http_workers=4, base_url=NATURE_URL):
         self.download_path = download_path
         self.start_year = start_year
         self.max_articles = max_articles
+        self.engine = engine
+        self.base_url = base_url
         self.driver = None
         self.setup_logging()
         self.setup_download_directory()
+        # One limiter for the browser and all download threads: politeness per host, not per thread
+        self.rate_limiter = RateLimiter(min_interval=min_delay, jitter=max_delay - min_delay)
+        self.downloader = PdfDownloader(download_path, workers=download_workers, rate_limiter=self.rate_limiter)
+        # Discovered articles and search progress survive restarts and can be shared by several crawlers
+        self.frontier = CrawlFrontier(frontier_path or os.path.join(download_path, 'frontier.sqlite'))
+        # Plain-HTTP engine; the browser is only started if it is blocked (or with engine='selenium')
+        self.harvester = None
+        if engine == 'http':
+            self.harvester = HttpHarvester(self.rate_limiter, workers=http_workers, base_url=base_url)
     
     def setup_logging(self):
         """Setup logging system"""
@@ -74,19 +94,14 @@ class NatureCrawler:
             self.logger.error(f"Browser initialization failed: {e}")
             return False
     
-    def navigate_to_nature(self, year):
+    def navigate_to_nature(self, year, page=1):
         """Navigate to Nature search page"""
-        search_url = (
-            f"https://www.nature.com/search?"
-            f"q=transmission%2Belectron%2Bmicroscopy&"
-            f"article_type=research&"
-            f"order=relevance&"
-            f"date_range={year}-{year}"
-        )
+        url = search_url(year, page, self.base_url)
         
         try:
-            self.driver.get(search_url)
-            self.logger.info(f"Navigated to {year} search page")
+            self.rate_limiter.wait(url)
+            self.driver.get(url)
+            self.logger.info(f"Navigated to {year} search page {page}")
             
             # Handle cookie consent popup
             self.handle_cookie_consent()
@@ -121,69 +136,59 @@ class NatureCrawler:
             self.logger.error(f"Cannot get total results: {e}")
             return 0
     
-    def respectful_delay(self, min_delay=2, max_delay=4):
-        """Add respectful delay to avoid overwhelming the server"""
-        delay = random.uniform(min_delay, max_delay)
-        time.sleep(delay)
+    def download_pdf(self, article, pdf_url):
+        """Queue the PDF download of a frontier article, named by its DOI; returns the download Future"""
+        file_name = doi_file_name(article['doi'] or article['url'].rstrip('/').rsplit('/', 1)[-1])
+        self.logger.info(f"Queued PDF download: {file_name}")
+        
+        # Recorded before the future resolves, so finished downloads are always counted in the frontier
+        def record(success):
+            telemetry.count('downloads', outcome='downloaded' if success else 'failed')
+            if success:
+                self.frontier.mark_downloaded(article['url'], file_name)
+            else:
+                self.frontier.mark_failed(article['url'], f"Download failed: {pdf_url}")
+        return self.downloader.submit(pdf_url, file_name, callback=record)
     
-    def download_pdf(self, pdf_url, file_name):
-        """Download PDF file"""
-        try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            
-            response = requests.get(pdf_url, headers=headers, timeout=30)
-            response.raise_for_status()
-            
-            file_path = os.path.join(self.download_path, file_name)
-            with open(file_path, "wb") as f:
-                f.write(response.content)
-            
-            self.logger.info(f"PDF downloaded successfully: {file_name}")
+    def count_downloads(self, year, downloads, block=False):
+        """Count downloaded articles of `year` (this and earlier runs); pending ones count as successful unless `block` waits for them"""
+        if block:
+            wait(downloads)
+        return self.frontier.count(year, 'downloaded') + sum(1 for future in downloads if not future.done())
+    
+    def has_capacity(self, year, downloads, reserved=0):
+        """Whether the year still needs articles besides `reserved` ones in progress; waits for pending downloads before deciding the limit is reached"""
+        if self.count_downloads(year, downloads) + reserved < self.max_articles:
             return True
-            
-        except requests.RequestException as e:
-            self.logger.error(f"Download failed for {file_name}: {e}")
-            return False
+        return self.count_downloads(year, downloads, block=True) + reserved < self.max_articles
     
-    def process_article(self, article_index, year, global_count):
-        """Process a single article"""
+    def list_articles(self):
+        """Return the article URLs listed on the current search results page"""
         try:
-            # Locate article link
-            article_xpath = f"//*[@id='search-article-list']/div/ul/li[{article_index}]/div/article/div[1]/div[2]/h3/a"
-            article = WebDriverWait(self.driver, 5).until(
-                EC.presence_of_element_located((By.XPATH, article_xpath))
+            links = WebDriverWait(self.driver, 5).until(
+                EC.presence_of_all_elements_located((By.XPATH, ARTICLE_LINKS_XPATH))
             )
-            
-            # Open article in new tab
-            ActionChains(self.driver).key_down(Keys.CONTROL).click(article).key_up(Keys.CONTROL).perform()
-            
-            # Switch to new tab
-            self.driver.switch_to.window(self.driver.window_handles[-1])
-            
-            # Find and download PDF
-            download_success = self.find_and_download_pdf(year, global_count)
-            
-            # Close current tab and return to main page
-            self.driver.close()
-            self.driver.switch_to.window(self.driver.window_handles[0])
-            
-            # Respectful delay
-            self.respectful_delay()
-            
-            return download_success
-            
-        except Exception as e:
-            self.logger.error(f"Error processing article {article_index}: {e}")
-            # Ensure return to main window
-            if len(self.driver.window_handles) > 1:
-                self.driver.close()
-                self.driver.switch_to.window(self.driver.window_handles[0])
-            return False
+        except Exception:
+            self.logger.warning("No articles found on the results page")
+            return []
+        return [url for url in (link.get_attribute("href") for link in links) if url]
+    
+    def process_article(self, article, engine):
+        """Find the PDF link of a frontier article with `engine` (unless already known) and queue its download"""
+        pdf_url = article['pdf_url']
+        if pdf_url is None:
+            with telemetry.span('article', url=article['url']) as span:
+                pdf_url = engine.find_pdf_url(article['url'])
+                span.set(found=pdf_url is not None)
+            telemetry.count('pdf_links', outcome='found' if pdf_url is not None else 'missing')
+            if pdf_url is None:
+                self.frontier.mark_failed(article['url'], "No PDF download link found")
+                return None
+            self.frontier.mark_pdf_found(article['url'], pdf_url)
+        return self.download_pdf(article, pdf_url)
     
-    def find_and_download_pdf(self, year, count):
-        """Find and download PDF"""
+    def find_pdf_url(self, article_url):
+        """Open an article in a new tab and return its PDF link (None if not found)"""
         download_xpaths = [
             '//*[@id="entitlement-box-right-column"]/div/a',
             '//*[@id="content"]/aside/div[1]/div/a',
@@ -191,22 +196,75 @@ class NatureCrawler:
             '//a[contains(text(), "Download PDF")]'
         ]
         
-        for xpath in download_xpaths:
-            try:
-                downloader = WebDriverWait(self.driver, 3).until(
-                    EC.element_to_be_clickable((By.XPATH, xpath))
-                )
-                
-                pdf_url = downloader.get_attribute("href")
-                if pdf_url and pdf_url.endswith('.pdf'):
-                    file_name = f"nature_{year}_{count:04d}.pdf"
-                    return self.download_pdf(pdf_url, file_name)
+        try:
+            # Wait for our turn on the host (shared with the download threads)
+            self.rate_limiter.wait(article_url)
+            self.driver.switch_to.new_window('tab')
+            self.driver.get(article_url)
+            
+            for xpath in download_xpaths:
+                try:
+                    downloader = WebDriverWait(self.driver, 3).until(
+                        EC.element_to_be_clickable((By.XPATH, xpath))
+                    )
                     
-            except:
-                continue
+                    pdf_url = downloader.get_attribute("href")
+                    if pdf_url and pdf_url.endswith('.pdf'):
+                        return pdf_url
+                        
+                except:
+                    continue
+            
+            self.logger.warning("No PDF download link found")
+            return None
+            
+        except Exception as e:
+            self.logger.error(f"Error processing article {article_url}: {e}")
+            return None
+        finally:
+            # Close the article tab and return to the results page
+            if len(self.driver.window_handles) > 1:
+                self.driver.close()
+            self.driver.switch_to.window(self.driver.window_handles[0])
+    
+    def process_pending(self, year, downloads, engine):
+        """Work through the frontier articles of `year` that still need their PDF, several at a time over HTTP"""
+        lock = threading.Lock()
+        in_progress = [0]  # Claimed articles whose download is not queued yet
+        stopped = threading.Event()  # Set when the engine gives up (e.g. HarvestBlocked)
+        
+        def work():
+            while not stopped.is_set():
+                # Capacity check and claim together, so concurrent workers never exceed max_articles
+                with lock:
+                    if not self.has_capacity(year, downloads, reserved=in_progress[0]):
+                        return
+                    article = self.frontier.claim_article(year)
+                    if article is None:
+                        return
+                    in_progress[0] += 1
+                try:
+                    self.logger.info(f"Processing article {article['doi'] or article['url']} of year {year}")
+                    download = self.process_article(article, engine)
+                    if download is not None:
+                        downloads.append(download)
+                except BaseException:
+                    # Hand the article back at once, so the browser fallback (or another crawler) can take it
+                    stopped.set()
+                    self.frontier.release_article(article['url'])
+                    raise
+                finally:
+                    with lock:
+                        in_progress[0] -= 1
         
-        self.logger.warning("No PDF download link found")
-        return False
+        # The browser has a single tab to work with
+        workers = engine.workers if engine is self.harvester else 1
+        if workers == 1:
+            work()
+            return
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='article') as pool:
+            for future in [pool.submit(work) for _ in range(workers)]:
+                future.result()
     
     def go_to_next_page(self):
         """Go to next page"""
@@ -214,54 +272,78 @@ class NatureCrawler:
             next_button = WebDriverWait(self.driver, 5).until(
                 EC.element_to_be_clickable((By.XPATH, "//li[@data-page='next']"))
             )
+            self.rate_limiter.wait(self.driver.current_url)
             next_button.click()
             self.logger.info("Switched to next page")
-            self.respectful_delay()
             return True
         except:
             self.logger.info("No more pages available")
             return False
     
     def crawl_year(self, year):
-        """Crawl articles for specified year"""
-        if not self.navigate_to_nature(year):
-            return False
-        
-        total_results = self.get_total_results()
-        if total_results == 0:
-            return False
-        
-        downloaded_count = 0
-        processed_count = 0
-        
-        self.logger.info(f"Starting to crawl {year} data, total {total_results} articles")
+        """Crawl articles for specified year over plain HTTP, falling back to the browser if that is blocked"""
+        # Shared by both engines: downloads queued before a fallback still count towards max_articles
+        downloads = []
+        if self.harvester is not None:
+            try:
+                with telemetry.span('year', year=year, engine='http'):
+                    return self.crawl_results(year, self.harvester, downloads)
+            except HarvestBlocked as e:
+                self.logger.warning(f"HTTP harvesting blocked ({e}), falling back to the browser")
+                telemetry.count('harvest_blocked')
+                if self.driver is None and not self.initialize_driver():
+                    return False
+        with telemetry.span('year', year=year, engine='selenium'):
+            return self.crawl_results(year, self, downloads)
+    
+    def crawl_results(self, year, engine, downloads):
+        """
+        Crawl the search results of specified year with `engine` (this browser or the HTTP harvester), resuming from the frontier;
+        download futures are added to `downloads` (browsing continues while they run)
+        """
+        page = self.frontier.claim_year(year)
         
-        while downloaded_count < self.max_articles and processed_count < total_results:
-            # Process articles on current page (usually 50 articles per page)
-            for i in range(1, 51):  # 1-50
-                if downloaded_count >= self.max_articles:
+        if page is None:
+            self.logger.info(f"Search results of {year} already listed or being listed by another crawler")
+        elif self.has_capacity(year, downloads):
+            if not engine.navigate_to_nature(year, page):
+                return False
+            
+            total_results = engine.get_total_results()
+            if total_results == 0:
+                return False
+            self.frontier.set_total(year, total_results)
+            
+            self.logger.info(f"Starting to crawl {year} data from page {page}, total {total_results} articles")
+            
+            while True:
+                with telemetry.span('search_page', year=year, page=page) as span:
+                    # Record the page's articles (usually 50) before visiting any, so none is lost on a crash
+                    added = self.frontier.add(engine.list_articles(), year)
+                    span.set(new_articles=added)
+                telemetry.count('articles_discovered', added)
+                self.logger.info(f"Page {page} of year {year}: {added} new articles")
+                self.process_pending(year, downloads, engine)
+                if not self.has_capacity(year, downloads):
                     break
                 
-                processed_count += 1
-                self.logger.info(f"Processing article {processed_count} of year {year}")
-                
-                success = self.process_article(i, year, downloaded_count + 1)
-                if success:
-                    downloaded_count += 1
-                
-                if processed_count >= total_results:
+                # Try to go to next page
+                last_page = not engine.go_to_next_page()
+                self.frontier.page_done(year, page, last=last_page)
+                if last_page:
                     break
-            
-            # Try to go to next page
-            if not self.go_to_next_page():
-                break
+                page += 1
+        
+        # Articles discovered earlier (previous runs or a crawler that stopped) that still need their PDF
+        self.process_pending(year, downloads, engine)
         
-        self.logger.info(f"Year {year} crawling completed, successfully downloaded {downloaded_count} articles")
+        downloaded_count = self.count_downloads(year, downloads, block=True)
+        self.logger.info(f"Year {year} crawling completed, {downloaded_count} articles downloaded")
         return True
     
     def run(self):
         """Main execution function"""
-        if not self.initialize_driver():
+        if self.harvester is None and not self.initialize_driver():
             return False
         
         try:
@@ -291,6 +373,15 @@ class NatureCrawler:
         if self.driver:
             self.driver.quit()
             self.logger.info("Browser closed")
+        if self.harvester is not None:
+            self.harvester.close()
+        # Pending downloads finish and are recorded before the frontier closes
+        self.downloader.close()
+        self.logger.info(f"Downloads: {self.downloader.stats()}")
+        self.frontier.close()
+        if telemetry.enabled():
+            telemetry.write_metrics()
+            telemetry.stop_server()
 
 
 def parse_arguments():
@@ -299,6 +390,16 @@ def parse_arguments():
     parser.add_argument('--year', type=int, default=2010, help='Starting year (default: 2021)')
     parser.add_argument('--max-articles', type=int, default=1000, help='Maximum articles per year (default: 1000)')
     parser.add_argument('--output-dir', default='./downloads', help='Download directory (default: ./downloads)')
+    parser.add_argument('--download-workers', type=int, default=4, help='Concurrent PDF downloads (default: 4)')
+    parser.add_argument('--min-delay', type=float, default=2, help='Minimum seconds between requests to one host (default: 2)')
+    parser.add_argument('--max-delay', type=float, default=4, help='Maximum seconds between requests to one host (default: 4)')
+    parser.add_argument('--engine', choices=('http', 'selenium'), default='http',
+                        help='Fetch pages over plain HTTP (browser only as fallback) or always with Selenium (default: http)')
+    parser.add_argument('--http-workers', type=int, default=4, help='Article pages fetched concurrently by the HTTP engine (default: 4)')
+    parser.add_argument('--base-url', default=NATURE_URL, help=f'Site root, e.g. a local stand-in server (default: {NATURE_URL})')
+    parser.add_argument('--frontier', default=None, help='Crawl frontier database, shareable by several crawlers (default: <output-dir>/frontier.sqlite)')
+    parser.add_argument('--trace', default=None, metavar='FILE', help='Append year/page/article spans and a metrics snapshot to this JSONL file')
+    parser.add_argument('--metrics-port', type=int, default=None, metavar='PORT', help='Serve live Prometheus metrics on http://127.0.0.1:PORT/metrics')
     return parser.parse_args()
 
 
@@ -316,12 +417,26 @@ def main():
     print(f"  Starting year: {args.year}")
     print(f"  Max articles per year: {args.max_articles}")
     print(f"  Output directory: {args.output_dir}")
+    print(f"  Engine: {args.engine}")
     print("=" * 50)
     
+    if args.trace or args.metrics_port is not None:
+        telemetry.enable(args.trace)
+        if args.metrics_port is not None:
+            telemetry.serve(args.metrics_port)
+            print(f"  Metrics: http://127.0.0.1:{args.metrics_port}/metrics")
+    
     crawler = NatureCrawler(
         download_path=args.output_dir,
         start_year=args.year,
-        max_articles=args.max_articles
+        max_articles=args.max_articles,
+        download_workers=args.download_workers,
+        min_delay=args.min_delay,
+        max_delay=args.max_delay,
+        frontier_path=args.frontier,
+        engine=args.engine,
+        http_workers=args.http_workers,
+        base_url=args.base_url
     )
     
     crawler.run()
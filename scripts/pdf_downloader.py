@@ -0,0 +1,267 @@
+"""
+Concurrent, resumable PDF downloads for the crawlers.
+
+A pooled `requests.Session` is shared by a bounded thread pool. Each file is
+streamed to `<name>.part` in chunks and renamed once its size and PDF magic
+bytes are verified, so an interrupted download is resumed with an HTTP Range
+request on the next attempt (or the next run) instead of starting over.
+Politeness is enforced by a per-host `RateLimiter` shared by every thread and
+by the browser, rather than by sleeping between articles.
+"""
+import logging
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+PDF_MAGIC = b'%PDF-'
+RETRY_STATUS = (408, 425, 429, 500, 502, 503, 504)
+
+
+class RateLimiter:
+    """
+    Per-host request spacing shared by all threads.
+
+    Every call to `wait` reserves the next free slot for the host, so concurrent
+    callers queue up behind each other instead of all firing after the same sleep.
+    Requests to different hosts do not wait on each other.
+
+    Args:
+        min_interval (float): Minimum seconds between two requests to the same host
+        jitter (float): Random extra seconds (0 to `jitter`) added to every interval
+    """
+
+    def __init__(self, min_interval=2.0, jitter=2.0):
+        self.min_interval = min_interval
+        self.jitter = jitter
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        """Block until a request to the host of `url` (or to host `url`) is allowed."""
+        host = urlparse(url).netloc or url
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, 0.0))
+            self._next[host] = slot + self.min_interval + random.uniform(0, self.jitter)
+        if slot > now:
+            time.sleep(slot - now)
+
+    def defer(self, url, seconds):
+        """Push back every request to the host of `url` by `seconds` (e.g., after a 429 Retry-After)."""
+        host = urlparse(url).netloc or url
+        with self._lock:
+            self._next[host] = max(self._next.get(host, 0.0), time.monotonic() + seconds)
+
+
+class DownloadError(Exception):
+    """A download failed in a way that retrying cannot fix (e.g., 404, not a PDF)."""
+
+
+class PdfDownloader:
+    """
+    Download PDFs in the background with resume, verification and retries.
+
+    Args:
+        download_path (str): Target directory
+        workers (int): Concurrent downloads (also the connection pool size)
+        rate_limiter (RateLimiter or None): Shared per-host limiter (default: no spacing)
+        max_retries (int): Attempts after the first one for transient errors
+        backoff (float): Base delay in seconds; attempt n waits backoff * 2**n (plus jitter)
+        timeout (float): Connect/read timeout in seconds
+        chunk_size (int): Bytes written per chunk while streaming
+        session (requests.Session or None): Session to use (default: a new pooled session)
+    """
+
+    def __init__(self, download_path, workers=4, rate_limiter=None, max_retries=5, backoff=1.0,
+                 timeout=30, chunk_size=1 << 16, session=None):
+        self.download_path = download_path
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.logger = logging.getLogger(__name__)
+        os.makedirs(download_path, exist_ok=True)
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['User-Agent'] = USER_AGENT
+        self.session = session
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pdf-download')
+        self._lock = threading.Lock()
+        self._counters = {'downloaded': 0, 'resumed': 0, 'skipped': 0, 'failed': 0, 'retries': 0, 'bytes': 0}
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self._counters[key] += value
+
+    def submit(self, pdf_url, file_name, callback=None):
+        """
+        Queue a download.
+
+        Args:
+            pdf_url (str): PDF URL
+            file_name (str): Target file name inside `download_path`
+            callback (Callable[[bool], None] or None): Called with the result in the download
+                thread before the future resolves (e.g., to record it in the crawl frontier)
+
+        Returns:
+            concurrent.futures.Future: Resolves to True if the PDF is on disk, False if it failed
+        """
+        def task():
+            success = self.download(pdf_url, file_name)
+            if callback is not None:
+                callback(success)
+            return success
+        return self._pool.submit(task)
+
+    def download(self, pdf_url, file_name):
+        """
+        Download `pdf_url` to `<download_path>/<file_name>` in the calling thread.
+
+        Returns:
+            bool: True if the verified PDF is on disk (downloaded now or already present)
+        """
+        file_path = os.path.join(self.download_path, file_name)
+        if os.path.isfile(file_path) and _has_pdf_magic(file_path):
+            self._count('skipped')
+            return True
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._fetch(pdf_url, file_path)
+                self._count('downloaded')
+                self.logger.info(f"PDF downloaded successfully: {file_name}")
+                return True
+            except DownloadError as e:
+                self.logger.error(f"Download failed for {file_name}: {e}")
+                break
+            except (requests.RequestException, OSError) as e:
+                if attempt == self.max_retries:
+                    self.logger.error(f"Download failed for {file_name} after {attempt + 1} attempts: {e}")
+                    break
+                delay = self.backoff * 2 ** attempt + random.uniform(0, self.backoff)
+                retry_after = getattr(e, 'retry_after', None)
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+                    if self.rate_limiter is not None:
+                        self.rate_limiter.defer(pdf_url, retry_after)
+                self.logger.warning(f"Download of {file_name} failed ({e}), retrying in {delay:.1f}s")
+                self._count('retries')
+                time.sleep(delay)
+
+        self._count('failed')
+        return False
+
+    def _fetch(self, pdf_url, file_path):
+        """One attempt: resume or start `<file_path>.part`, verify it, then move it into place."""
+        part_path = file_path + '.part'
+        offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait(pdf_url)
+        with self.session.get(pdf_url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 416:
+                # Nothing left to send: the part file is complete if it has the advertised size
+                total = _content_range_total(response.headers.get('Content-Range'))
+                if total is None or total != offset:
+                    os.remove(part_path)
+                    raise requests.RequestException("Range not satisfiable, restarting from scratch")
+                return self._finish(part_path, file_path, total)
+
+            if response.status_code in RETRY_STATUS:
+                error = requests.HTTPError(f"HTTP {response.status_code}", response=response)
+                error.retry_after = _retry_after(response.headers.get('Retry-After'))
+                raise error
+            if response.status_code >= 400:
+                raise DownloadError(f"HTTP {response.status_code}")
+
+            if response.status_code == 206 and offset:
+                start = _content_range_start(response.headers.get('Content-Range'))
+                if start != offset:
+                    os.remove(part_path)
+                    raise requests.RequestException(f"Server resumed at byte {start}, expected {offset}")
+                expected = _content_range_total(response.headers.get('Content-Range'))
+                mode = 'ab'
+                self._count('resumed')
+            else:
+                # Server ignored the Range header (or there was nothing to resume)
+                offset = 0
+                length = response.headers.get('Content-Length')
+                expected = int(length) if length is not None and 'Content-Encoding' not in response.headers else None
+                mode = 'wb'
+
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    if offset == 0 and f.tell() == 0 and not chunk.startswith(PDF_MAGIC[:len(chunk)]):
+                        # Paywall and login pages are served as HTML with status 200
+                        f.close()
+                        os.remove(part_path)
+                        raise DownloadError(f"Not a PDF (Content-Type: {response.headers.get('Content-Type')})")
+                    f.write(chunk)
+                    self._count('bytes', len(chunk))
+
+        return self._finish(part_path, file_path, expected)
+
+    def _finish(self, part_path, file_path, expected):
+        size = os.path.getsize(part_path)
+        if expected is not None and size != expected:
+            if size > expected:
+                os.remove(part_path)
+            # A short file is kept and resumed on the next attempt
+            raise requests.RequestException(f"Size mismatch: got {size} bytes, expected {expected}")
+        if not _has_pdf_magic(part_path):
+            os.remove(part_path)
+            raise DownloadError("Downloaded file is not a PDF")
+        os.replace(part_path, file_path)
+
+    def stats(self):
+        """Counters: 'downloaded', 'resumed', 'skipped' (already on disk), 'failed', 'retries' and 'bytes'."""
+        with self._lock:
+            return dict(self._counters)
+
+    def close(self):
+        """Wait for queued downloads and release the connections."""
+        self._pool.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _has_pdf_magic(path):
+    with open(path, 'rb') as f:
+        return f.read(len(PDF_MAGIC)) == PDF_MAGIC
+
+
+def _content_range_start(value):
+    match = re.match(r'bytes (\d+)-\d+/', value or '')
+    return int(match.group(1)) if match else None
+
+
+def _content_range_total(value):
+    match = re.search(r'/(\d+)$', value or '')
+    return int(match.group(1)) if match else None
+
+
+def _retry_after(value):
+    """Seconds from a Retry-After header (only the delta-seconds form is honored)."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
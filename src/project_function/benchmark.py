@@ -0,0 +1,681 @@
+"""
+Reproducible CPU benchmark of the extraction stages on synthetic data.
+
+`make_corpus` writes seeded synthetic PDFs: text pages and figure pages with a
+mix of page counts, figures per page, sub-panels per figure and embedded
+raster sizes. `use_stub_models` registers small deterministic stand-ins for
+the three YOLO detectors and the two ResNet-18 classifiers under their
+`vision_crop.registry` names. The stand-ins take and return the same types as
+the real models, so no (non-redistributable) weights are needed.
+
+`run_benchmark` times every stage on its own: rendering, the 'crop',
+'description' and 'tem' detectors, `TEM_classifier_batch` and image writing.
+It then times the whole `pipeline.process_pdf` chain and reports pages/s,
+crops/s and peak RSS. Results are stored as JSON. `compare` flags metrics
+that got worse between two result files (e.g., two commits).
+
+The stand-in networks are tiny, so model stages mostly measure our own
+pre- and post-processing, batching and cropping; numbers are comparable
+between commits on the same machine, not with real-weight runs.
+
+Run from the `src` directory:
+
+    python -m project_function.benchmark run --out base.json
+    python -m project_function.benchmark run --out new.json
+    python -m project_function.benchmark compare base.json new.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+import torch
+
+from project_function import config, image_writer, pipeline, vision_crop
+from project_function.model_server import _Result
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+SCHEMA_VERSION = 1
+STAGES = ('render', 'crop', 'description', 'tem', 'classify', 'write')
+
+# Corpus profiles: ranges are inclusive, raster sizes are the long side of an embedded image in pixels
+PROFILES = {
+    'small': {'pdfs': 4, 'pages': (2, 5), 'figures_per_page': (0, 2), 'panels': (1, 4),
+              'raster_sizes': (256, 512, 1024)},
+    'default': {'pdfs': 12, 'pages': (2, 16), 'figures_per_page': (0, 2), 'panels': (1, 6),
+                'raster_sizes': (256, 512, 1024, 2048)},
+}
+
+PAGE_SIZE = (595, 842)        # A4 in points
+PANEL_FILL = (0.93,) * 3      # Figure panel background (gray 237)
+WORDS = ('transmission', 'electron', 'microscopy', 'lattice', 'nanoparticle', 'grain', 'boundary', 'sample',
+         'diffraction', 'pattern', 'contrast', 'defect', 'interface', 'crystal', 'phase', 'scale', 'bar')
+
+
+# === Synthetic corpus ===
+def _micrograph(rng, height, width):
+    """Gray texture with dark particles; never white, so panel gutters stay the only white lines."""
+    sigma = rng.choice((0.6, 1.0, 2.0, 4.0, 8.0))
+    noise = cv2.GaussianBlur(rng.standard_normal((height, width)).astype(np.float32), (0, 0), float(sigma))
+    image = 128 + rng.uniform(15, 70) * noise / (noise.std() + 1e-6)
+    for _ in range(int(rng.integers(3, 12))):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        cv2.circle(image, center, int(rng.integers(2, max(3, min(height, width) // 6))), float(rng.uniform(20, 80)), -1)
+    return cv2.cvtColor(np.clip(image, 20, 235).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+
+
+def _plot(rng, height, width):
+    """Colored chart panel (a typical 'None' sub-image): tinted background, axes and curves."""
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:] = ((170, 210, 250), (200, 170, 240), (160, 230, 190))[int(rng.integers(0, 3))]
+    x0, y1 = width // 8, height - height // 8
+    cv2.line(image, (x0, height // 10), (x0, y1), (0, 0, 0), max(1, width // 200))
+    cv2.line(image, (x0, y1), (width - width // 10, y1), (0, 0, 0), max(1, width // 200))
+    xs = np.linspace(x0, width - width // 10, 50)
+    for color in ((200, 40, 40), (40, 40, 200))[:int(rng.integers(1, 3))]:
+        ys = y1 - (y1 - height // 10) * (0.5 + 0.4 * np.sin(xs / width * rng.uniform(3, 12) + rng.uniform(0, 6)))
+        cv2.polylines(image, [np.stack([xs, ys], axis=1).astype(np.int32)], False, color, max(1, width // 150))
+    return image
+
+
+def _figure_raster(rng, width, height, panels):
+    """Grid of `panels` sub-images separated by white gutters, `width`×`height` pixels."""
+    cols = min(panels, 3)
+    rows = math.ceil(panels / cols)
+    gutter = max(4, int(0.03 * max(width, height)))
+    raster = np.full((height, width, 3), 255, dtype=np.uint8)
+    cell_w = (width - gutter * (cols + 1)) // cols
+    cell_h = (height - gutter * (rows + 1)) // rows
+    for i in range(panels):
+        r, c = divmod(i, cols)
+        y, x = gutter + r * (cell_h + gutter), gutter + c * (cell_w + gutter)
+        make = _micrograph if rng.random() < 0.75 else _plot
+        raster[y:y + cell_h, x:x + cell_w] = make(rng, cell_h, cell_w)
+    return raster
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS, size=words))
+
+
+def _text_lines(page, rng, top, bottom):
+    """Body text: 8 pt lines every 16 pt (thin enough for the stand-in figure detector to ignore)."""
+    y = top + 12
+    while y < bottom:
+        page.insert_text((60, y), _sentence(rng, int(rng.integers(6, 11))), fontsize=8)
+        y += 16
+
+
+def _insert_figure(page, rng, rect, number, profile):
+    """Draw one figure panel (raster image and caption) into `rect`; returns the number of sub-panels."""
+    page.draw_rect(rect, color=None, fill=PANEL_FILL)
+    image_rect = fitz.Rect(rect.x0 + 12, rect.y0 + 12, rect.x1 - 12, rect.y1 - 46)
+    caption_rect = fitz.Rect(rect.x0 + 12, rect.y1 - 40, rect.x1 - 12, rect.y1 - 6)
+
+    long_side = int(rng.choice(profile['raster_sizes']))
+    scale = long_side / max(image_rect.width, image_rect.height)
+    panels = int(rng.integers(profile['panels'][0], profile['panels'][1] + 1))
+    raster = _figure_raster(rng, int(image_rect.width * scale), int(image_rect.height * scale), panels)
+    page.insert_image(image_rect, stream=cv2.imencode('.png', raster)[1].tobytes())
+    page.insert_textbox(caption_rect, f"Figure {number}. " + _sentence(rng, 18), fontsize=8)
+    return panels
+
+
+def make_pdf(path, rng, profile):
+    """
+    Write one synthetic PDF.
+
+    Returns:
+        dict: 'pages', 'figures' and 'panels' of the document
+    """
+    counts = {'pages': 0, 'figures': 0, 'panels': 0}
+    doc = fitz.open()
+    for _ in range(int(rng.integers(profile['pages'][0], profile['pages'][1] + 1))):
+        page = doc.new_page(width=PAGE_SIZE[0], height=PAGE_SIZE[1])
+        figures = int(rng.integers(profile['figures_per_page'][0], profile['figures_per_page'][1] + 1))
+        top, bottom = 50, PAGE_SIZE[1] - 50
+        if figures:
+            # Figures stacked from the top; a single figure leaves room for text below
+            slot = (bottom - top) / figures if figures > 1 else rng.uniform(250, 450)
+            for i in range(figures):
+                rect = fitz.Rect(50, top + i * slot + 4, PAGE_SIZE[0] - 50, top + (i + 1) * slot - 4)
+                counts['panels'] += _insert_figure(page, rng, rect, counts['figures'] + 1, profile)
+                counts['figures'] += 1
+            top += figures * slot
+        if bottom - top > 30:
+            _text_lines(page, rng, top, bottom)
+        counts['pages'] += 1
+    doc.save(path, deflate=True)
+    doc.close()
+    return counts
+
+
+def make_corpus(out_dir, profile='default', seed=0):
+    """
+    Write the synthetic PDFs of `profile` into `out_dir`; the same profile and seed
+    always give the same documents.
+
+    Args:
+        out_dir (str): Target directory
+        profile (str or dict): Name in PROFILES, or a dict with the same keys
+        seed (int): Random seed
+
+    Returns:
+        dict: 'files' (PDF names) and the corpus totals 'pages', 'figures', 'panels' and 'bytes'
+    """
+    profile = PROFILES[profile] if isinstance(profile, str) else profile
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    corpus = {'files': [], 'pages': 0, 'figures': 0, 'panels': 0, 'bytes': 0}
+    for i in range(profile['pdfs']):
+        name = f"synthetic_{i:03d}.pdf"
+        counts = make_pdf(os.path.join(out_dir, name), rng, profile)
+        corpus['files'].append(name)
+        for key, value in counts.items():
+            corpus[key] += value
+        corpus['bytes'] += os.path.getsize(os.path.join(out_dir, name))
+    return corpus
+
+
+# === Deterministic stand-in models ===
+def _seeded(module, seed):
+    """Fill the parameters of `module` from `seed` without touching the global torch RNG."""
+    generator = torch.Generator().manual_seed(seed)
+    with torch.no_grad():
+        for param in module.parameters():
+            param.copy_(torch.randn(param.shape, generator=generator) * 0.1)
+    return module.eval()
+
+
+def _tiny_backbone(seed):
+    return _seeded(torch.nn.Sequential(
+        torch.nn.Conv2d(3, 16, 3, stride=2, padding=1), torch.nn.ReLU(),
+        torch.nn.Conv2d(16, 32, 3, stride=2, padding=1), torch.nn.ReLU(),
+        torch.nn.Conv2d(32, 64, 3, stride=2, padding=1), torch.nn.ReLU(),
+        torch.nn.AdaptiveAvgPool2d(1), torch.nn.Flatten()), seed)
+
+
+def _runs(mask, gap=0):
+    """(start, stop) of every run of True values in a 1-D boolean array; runs at most `gap` apart are merged."""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    runs = []
+    for start, stop in zip(edges[::2], edges[1::2]):
+        if runs and start - runs[-1][1] <= gap:
+            runs[-1] = (runs[-1][0], stop)
+        else:
+            runs.append((start, stop))
+    return runs
+
+
+def _figure_rule(gray):
+    """Figure panels: the gray panel background around each figure, once an opening has removed text edges."""
+    mask = ((gray >= 228) & (gray <= 246)).astype(np.uint8)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((5, 5), np.uint8))
+    count, _, blobs, _ = cv2.connectedComponentsWithStats(mask)
+    boxes = []
+    for x, y, w, h, area in blobs[1:count]:
+        if w >= 16 and h >= 16 and w * h >= 0.01 * gray.size:
+            boxes.append(((x, y, x + w, y + h), 0.9 + 0.09 * min(1.0, 4 * area / (w * h)), 0))
+    return boxes
+
+
+def _description_rule(gray):
+    """Largest block of mostly non-background rows and columns is the image (class 0); text below it is the caption (class 1)."""
+    # Background: most common value of a thin border strip (a loose crop may add a few page pixels)
+    t = max(1, min(gray.shape) // 30)
+    border = np.concatenate((gray[:t].ravel(), gray[-t:].ravel(), gray[:, :t].ravel(), gray[:, -t:].ravel()))
+    diff = np.abs(gray.astype(np.int16) - int(np.bincount(border).argmax())) > 8
+    # Anti-aliased panel edges can match the background; bridge gaps of a few pixels
+    bands = _runs(diff.mean(axis=1) > 0.5, gap=3)
+    if not bands:
+        return []
+    y1, y2 = max(bands, key=lambda band: band[1] - band[0])
+    x1, x2 = max(_runs(diff[y1:y2].mean(axis=0) > 0.5, gap=3), key=lambda run: run[1] - run[0])
+    boxes = [((x1, y1, x2, y2), 0.95, 0)]
+    text_rows = np.flatnonzero(diff[y2:].mean(axis=1) > 0.01)
+    if len(text_rows):
+        ty1, ty2 = y2 + text_rows[0], y2 + text_rows[-1] + 1
+        boxes.append(((x1, ty1, x2, ty2), 0.9, 1))
+    return boxes
+
+
+def _tem_rule(gray):
+    """Sub-panels: cells between the all-white gutter rows and columns."""
+    ink = gray < 245
+    # Anti-aliased crop edges would join every cell into one
+    ink[:2], ink[-2:], ink[:, :2], ink[:, -2:] = False, False, False, False
+    boxes = []
+    for y1, y2 in _runs(ink.any(axis=1)):
+        if y2 - y1 < 4:
+            continue
+        for x1, x2 in _runs(ink[y1:y2].any(axis=0)):
+            if x2 - x1 >= 4:
+                boxes.append(((x1, y1, x2, y2), 0.9, 0))
+    return boxes
+
+
+class StubDetector:
+    """
+    Deterministic stand-in for an ultralytics YOLO model (`model(images, verbose=False)`).
+
+    Like YOLO, every image is letterboxed to `imgsz` and the batch goes through a
+    (tiny, seeded) CNN. The boxes come from layout rules for the synthetic corpus,
+    applied to the letterboxed image and scaled back to input pixels.
+
+    Args:
+        name (str): Registry name: 'crop', 'description' or 'tem'
+        imgsz (int): Letterbox size
+        seed (int): Backbone weight seed
+    """
+
+    RULES = {'crop': _figure_rule, 'description': _description_rule, 'tem': _tem_rule}
+
+    def __init__(self, name, imgsz=640, seed=0):
+        self.rule = self.RULES[name]
+        self.imgsz = imgsz
+        self.backbone = _tiny_backbone(seed)
+
+    def __call__(self, source, verbose=False, **kwargs):
+        images = source if isinstance(source, list) else [source]
+        batch = np.full((len(images), self.imgsz, self.imgsz, 3), 114, dtype=np.uint8)
+        scales = []
+        for i, image in enumerate(images):
+            scale = self.imgsz / max(image.shape[:2])
+            h, w = max(1, round(image.shape[0] * scale)), max(1, round(image.shape[1] * scale))
+            batch[i, :h, :w] = cv2.resize(image, (w, h), interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+            scales.append((scale, h, w))
+        with torch.no_grad():
+            self.backbone(torch.from_numpy(batch).permute(0, 3, 1, 2).float().div_(255))
+
+        results = []
+        for i, (image, (scale, h, w)) in enumerate(zip(images, scales)):
+            detections = self.rule(cv2.cvtColor(batch[i, :h, :w], cv2.COLOR_BGR2GRAY))
+            xyxy = np.array([box for box, _, _ in detections], dtype=np.float32).reshape(-1, 4) / scale
+            xyxy[:, 0::2] = xyxy[:, 0::2].clip(0, image.shape[1])
+            xyxy[:, 1::2] = xyxy[:, 1::2].clip(0, image.shape[0])
+            results.append(_Result(torch.from_numpy(xyxy),
+                                   torch.tensor([score for _, score, _ in detections], dtype=torch.float32),
+                                   torch.tensor([cls for _, _, cls in detections], dtype=torch.float32)))
+        return results
+
+
+class StubClassifier(torch.nn.Module):
+    """
+    Deterministic stand-in for the ResNet-18 classifiers (N×3×224×224 tensor in, logits out).
+
+    Colorful inputs (charts) score 'None' in the binary model; the five-class
+    model buckets gray images by contrast. A tiny seeded CNN adds a small term,
+    so the forward pass cannot be skipped.
+
+    Args:
+        num_classes (int): 2 (binary) or 5 (five-class)
+        seed (int): Weight seed
+    """
+
+    def __init__(self, num_classes, seed=0):
+        super().__init__()
+        self.num_classes = num_classes
+        self.backbone = _tiny_backbone(seed)
+        self.head = _seeded(torch.nn.Linear(64, num_classes), seed + 1)
+
+    def forward(self, x):
+        learned = 0.01 * self.head(self.backbone(x))
+        if self.num_classes == 2:
+            color = (x.amax(dim=1) - x.amin(dim=1)).mean(dim=(1, 2))
+            return learned + torch.stack([color - 0.1, 0.1 - color], dim=1) * 50
+        centers = torch.linspace(0.1, 0.5, self.num_classes, device=x.device)
+        return learned - 50 * (x.std(dim=(1, 2, 3))[:, None] - centers).abs()
+
+
+def use_stub_models(seed=0):
+    """
+    Register the stand-in models in `vision_crop.registry` (replacing the real loaders
+    in this process) and pin the classifiers to the CPU.
+
+    Returns:
+        dict: Load time in seconds per model
+    """
+    for i, name in enumerate(('crop', 'description', 'tem')):
+        vision_crop.registry.register(name, lambda name=name, i=i: StubDetector(name, seed=seed + i))
+    vision_crop.registry.register('binary_classifier', lambda: StubClassifier(2, seed + 10))
+    vision_crop.registry.register('five_class_classifier', lambda: StubClassifier(5, seed + 20))
+    vision_crop._load_classifiers()
+    vision_crop.TEM_classifier.device = torch.device('cpu')
+    return vision_crop.registry.warmup()
+
+
+# === Measurements ===
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB (None where `resource` is unavailable)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB elsewhere
+    return round(peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def time_stages(pdf_dir, files, out_dir, zoom_factor=5, batch_size=16, image_format=None):
+    """
+    Run `pipeline.process_page` over every page and time each stage on its own.
+
+    Images are encoded in the calling thread, so 'write' includes encoding.
+
+    Args:
+        pdf_dir (str): Corpus directory
+        files (List[str]): PDFs to process
+        out_dir (str): Folder for the written images
+        zoom_factor (float): Rendering zoom
+        batch_size (int): Batch size of the detector and classifier calls
+        image_format (str or None): Output format (default: config.IMAGE_FORMAT)
+
+    Returns:
+        Tuple[dict, dict]: ({stage: seconds}, counts: 'pages', 'figures', 'tems', 'crops',
+            'labels' ({label: count}), 'rows', 'images', 'bytes')
+    """
+    timings = dict.fromkeys(STAGES, 0.0)
+    counts = {'pages': 0, 'figures': 0, 'tems': 0, 'crops': 0, 'labels': {}, 'rows': 0}
+    output_dirs = {kind: os.path.join(out_dir, kind) for kind in ('pdf_image', 'tem_image', 'description')}
+    for path in output_dirs.values():
+        os.makedirs(path, exist_ok=True)
+    writer = image_writer.ImageWriter(0, image_format)
+
+    for file in files:
+        # The page steps of sequential `pipeline.process_pdf`, without dedup, shards or pre-filters
+        settings = pipeline.PipelineSettings(pdf_path=pdf_dir, output_dirs=output_dirs, zoom_factor=zoom_factor,
+                                             batch_size=batch_size, output_mode='files')
+        doc = pipeline.open_document(file, settings, captions=[], writer=writer)
+        pages = pipeline.iter_pages(doc)
+        while True:
+            start = time.perf_counter()
+            item = next(pages, None)
+            timings['render'] += time.perf_counter() - start
+            if item is None:
+                break
+
+            plan = pipeline.process_page(*item, doc, timings=timings)
+            counts['pages'] += 1
+            for tem, _, subs, labels in (plan['figures'] if plan is not None else []):
+                counts['figures'] += 1
+                counts['tems'] += tem is not None
+                counts['crops'] += len(subs)
+                for label in labels:
+                    counts['labels'][label] = counts['labels'].get(label, 0) + 1
+        counts['rows'] += len(doc.rows)
+
+    written = writer.stats()
+    writer.close()
+    counts['images'], counts['bytes'] = written['images'], written['bytes']
+    return timings, counts
+
+
+def time_end_to_end(pdf_dir, files, out_dir, zoom_factor=5, batch_size=16, image_format=None, pipelined=False):
+    """
+    Time `pipeline.process_pdf` over every file (default writer threads, like a worker process).
+
+    Returns:
+        Tuple[float, dict]: (seconds, counts: 'pages', 'rows', 'images', 'bytes')
+    """
+    output_dirs = {kind: os.path.join(out_dir, kind) for kind in ('pdf_image', 'tem_image', 'description')}
+    for path in output_dirs.values():
+        os.makedirs(path, exist_ok=True)
+    counts = {'pages': 0, 'rows': 0, 'images': 0, 'bytes': 0}
+    start = time.perf_counter()
+    for file in files:
+        stats = {}
+        settings = pipeline.PipelineSettings(pdf_path=pdf_dir, output_dirs=output_dirs, zoom_factor=zoom_factor,
+                                             batch_size=batch_size, pipelined=pipelined, output_mode='files',
+                                             image_format=image_format)
+        rows = pipeline.process_pdf(file, settings, stats=stats, captions=[])
+        counts['pages'] += stats.get('pages', 0)
+        counts['rows'] += len(rows)
+        counts['images'] += stats.get('images_written', 0)
+        counts['bytes'] += stats.get('bytes_written', 0)
+    return time.perf_counter() - start, counts
+
+
+def _git_commit():
+    """(short commit hash, dirty) of the checkout, or (None, None) outside git."""
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=cwd, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=cwd,
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+def _machine():
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'opencv': cv2.__version__,
+        'pymupdf': fitz.VersionBind,
+        'numpy': np.__version__,
+    }
+
+
+def run_benchmark(profile='default', seed=0, corpus_dir=None, repeat=3, zoom_factor=5, batch_size=16,
+                  threads=1, image_format=None, pipelined=False):
+    """
+    Generate the corpus, load the stand-in models and time every stage, then the whole chain.
+
+    Stage times are the median of `repeat` runs, after one untimed warm-up document.
+
+    Args:
+        profile (str): Corpus profile in PROFILES
+        seed (int): Corpus and model seed
+        corpus_dir (str or None): Keep the PDFs here (default: a temporary directory)
+        repeat (int): Timed runs per stage
+        zoom_factor (float): Rendering zoom
+        batch_size (int): Detector and classifier batch size
+        threads (int): torch and OpenCV threads
+        image_format (str or None): Output format (default: config.IMAGE_FORMAT)
+        pipelined (bool): Use the pipelined executor in the end-to-end run
+
+    Returns:
+        dict: JSON-serializable results
+    """
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(threads)
+    image_format = image_format or config.IMAGE_FORMAT
+    commit, dirty = _git_commit()
+    result = {
+        'schema': SCHEMA_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'dirty': dirty,
+        'machine': _machine(),
+        'settings': {'profile': profile, 'seed': seed, 'repeat': repeat, 'zoom_factor': zoom_factor,
+                     'batch_size': batch_size, 'threads': threads, 'image_format': image_format,
+                     'pipelined': pipelined},
+    }
+
+    with tempfile.TemporaryDirectory(prefix='tem-benchmark-') as work_dir:
+        pdf_dir = corpus_dir or os.path.join(work_dir, 'pdfs')
+        start = time.perf_counter()
+        corpus = make_corpus(pdf_dir, profile, seed)
+        files = corpus.pop('files')
+        result['corpus'] = {'pdfs': len(files), **corpus, 'generate_seconds': time.perf_counter() - start}
+        result['model_load_seconds'] = use_stub_models(seed)
+        result['peak_rss_mb'] = {'models_loaded': peak_rss_mb()}
+
+        # Warm-up: first-call costs (kernel selection, allocator growth) stay out of the timed runs
+        time_stages(pdf_dir, files[:1], os.path.join(work_dir, 'warmup'), zoom_factor, batch_size, image_format)
+
+        runs = []
+        for i in range(repeat):
+            runs.append(time_stages(pdf_dir, files, os.path.join(work_dir, f"stages_{i}"), zoom_factor, batch_size,
+                                    image_format))
+        result['peak_rss_mb']['stages'] = peak_rss_mb()
+        counts = runs[0][1]
+        if any(run_counts != counts for _, run_counts in runs[1:]):
+            raise RuntimeError("Benchmark runs produced different outputs; the stand-in models are not deterministic")
+
+        items = {'render': counts['pages'], 'crop': counts['pages'], 'description': counts['figures'],
+                 'tem': counts['tems'], 'classify': counts['crops'], 'write': counts['images']}
+        result['stages'] = {}
+        for stage in STAGES:
+            seconds = [timings[stage] for timings, _ in runs]
+            median = statistics.median(seconds)
+            result['stages'][stage] = {'seconds': median, 'runs': seconds, 'items': items[stage],
+                                       'items_per_second': items[stage] / median if median else None}
+        result['counts'] = counts
+        total = sum(stage['seconds'] for stage in result['stages'].values())
+        result['throughput'] = {'seconds': total, 'pages_per_second': counts['pages'] / total,
+                                'crops_per_second': counts['crops'] / total,
+                                'mb_written_per_second': counts['bytes'] / (1 << 20) / result['stages']['write']['seconds']}
+
+        seconds, e2e_counts = time_end_to_end(pdf_dir, files, os.path.join(work_dir, 'end_to_end'), zoom_factor,
+                                              batch_size, image_format, pipelined)
+        result['end_to_end'] = {'seconds': seconds, 'pages_per_second': e2e_counts['pages'] / seconds,
+                                'crops_per_second': counts['crops'] / seconds, **e2e_counts}
+        result['peak_rss_mb']['end_to_end'] = peak_rss_mb()
+    return result
+
+
+# === Comparison ===
+def _metrics(result):
+    """{metric: (value, higher_is_better)} of one result file."""
+    metrics = {f"{stage}.seconds": (entry['seconds'], False) for stage, entry in result['stages'].items()}
+    metrics['pages_per_second'] = (result['throughput']['pages_per_second'], True)
+    metrics['crops_per_second'] = (result['throughput']['crops_per_second'], True)
+    metrics['end_to_end.seconds'] = (result['end_to_end']['seconds'], False)
+    metrics['end_to_end.pages_per_second'] = (result['end_to_end']['pages_per_second'], True)
+    if result['peak_rss_mb'].get('end_to_end') is not None:
+        metrics['peak_rss_mb'] = (result['peak_rss_mb']['end_to_end'], False)
+    return metrics
+
+
+def compare(base, new, threshold=0.10):
+    """
+    Compare two benchmark results.
+
+    Args:
+        base (dict): Reference result (e.g., from the parent commit)
+        new (dict): Candidate result
+        threshold (float): Relative change beyond which a metric counts as a regression
+
+    Returns:
+        dict: 'metrics' ({metric: {'base', 'new', 'change', 'regressed'}}), 'warnings'
+            (reasons the results may not be comparable) and 'regressions' (metric names)
+    """
+    warnings = []
+    if base.get('schema') != new.get('schema'):
+        warnings.append(f"schema {base.get('schema')} vs {new.get('schema')}")
+    for key in sorted(set(base['settings']) | set(new['settings'])):
+        if key != 'repeat' and base['settings'].get(key) != new['settings'].get(key):
+            warnings.append(f"setting '{key}': {base['settings'].get(key)} vs {new['settings'].get(key)}")
+    if base['machine'] != new['machine']:
+        warnings.append("different machine or library versions")
+    if base['counts'] != new['counts']:
+        warnings.append("pipeline output changed (counts differ)")
+
+    report = {}
+    new_metrics = _metrics(new)
+    for metric, (base_value, higher_is_better) in _metrics(base).items():
+        if metric not in new_metrics or not base_value:
+            continue
+        new_value = new_metrics[metric][0]
+        change = new_value / base_value - 1
+        report[metric] = {'base': base_value, 'new': new_value, 'change': change,
+                          'regressed': (-change if higher_is_better else change) > threshold}
+    return {'metrics': report, 'warnings': warnings,
+            'regressions': [metric for metric, entry in report.items() if entry['regressed']]}
+
+
+# === Command line ===
+def _print_result(result):
+    print(f"Commit {result['commit']}{' (dirty)' if result['dirty'] else ''}, "
+          f"{result['corpus']['pdfs']} PDFs, {result['counts']['pages']} pages, {result['counts']['crops']} crops")
+    print(f"{'stage':<12} {'seconds':>8} {'items/s':>9}")
+    for stage, entry in result['stages'].items():
+        rate = f"{entry['items_per_second']:.1f}" if entry['items_per_second'] else '-'
+        print(f"{stage:<12} {entry['seconds']:>8.3f} {rate:>9}")
+    throughput, e2e = result['throughput'], result['end_to_end']
+    print(f"Stages:     {throughput['pages_per_second']:.2f} pages/s, {throughput['crops_per_second']:.2f} crops/s")
+    print(f"End to end: {e2e['pages_per_second']:.2f} pages/s, {e2e['crops_per_second']:.2f} crops/s")
+    print(f"Peak RSS:   {result['peak_rss_mb']['end_to_end']} MiB")
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Benchmark the extraction stages on synthetic PDFs')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = subparsers.add_parser('generate', help='Only write the synthetic corpus')
+    generate_parser.add_argument('--out', required=True, help='Target directory')
+    generate_parser.add_argument('--profile', choices=tuple(PROFILES), default='default')
+    generate_parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+
+    run_parser = subparsers.add_parser('run', help='Run the benchmark and write a JSON result')
+    run_parser.add_argument('--out', default='benchmark.json', help='Result file (default: benchmark.json)')
+    run_parser.add_argument('--profile', choices=tuple(PROFILES), default='default')
+    run_parser.add_argument('--seed', type=int, default=0, help='Corpus and model seed (default: 0)')
+    run_parser.add_argument('--corpus', help='Keep the synthetic PDFs in this directory')
+    run_parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage (default: 3)')
+    run_parser.add_argument('--zoom', type=float, default=5, help='Rendering zoom (default: 5)')
+    run_parser.add_argument('--batch-size', type=int, default=16, help='Batch size (default: 16)')
+    run_parser.add_argument('--threads', type=int, default=1, help='torch/OpenCV threads (default: 1)')
+    run_parser.add_argument('--image-format', choices=tuple(image_writer.IMAGE_FORMATS),
+                            help='Output image format (default: config.IMAGE_FORMAT)')
+    run_parser.add_argument('--pipelined', action='store_true', help='Pipelined executor in the end-to-end run')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare two result files')
+    compare_parser.add_argument('base', help='Reference result')
+    compare_parser.add_argument('new', help='Candidate result')
+    compare_parser.add_argument('--threshold', type=float, default=0.10,
+                                help='Relative change counted as a regression (default: 0.10)')
+    return parser.parse_args()
+
+
+def main():
+    """Main program entry point"""
+    args = parse_arguments()
+    if args.command == 'generate':
+        corpus = make_corpus(args.out, args.profile, args.seed)
+        print(f"[✓] {len(corpus['files'])} PDFs, {corpus['pages']} pages, {corpus['figures']} figures → {args.out}")
+        return
+
+    if args.command == 'run':
+        result = run_benchmark(args.profile, args.seed, args.corpus, args.repeat, args.zoom, args.batch_size,
+                               args.threads, args.image_format, args.pipelined)
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        _print_result(result)
+        print(f"[✓] Results written to {args.out}")
+        return
+
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.new, encoding='utf-8') as f:
+        new = json.load(f)
+    report = compare(base, new, args.threshold)
+    for warning in report['warnings']:
+        print(f"[!] Not directly comparable: {warning}")
+    print(f"{'metric':<28} {'base':>10} {'new':>10} {'change':>8}")
+    for metric, entry in report['metrics'].items():
+        flag = '  REGRESSION' if entry['regressed'] else ''
+        print(f"{metric:<28} {entry['base']:>10.3f} {entry['new']:>10.3f} {entry['change']:>+8.1%}{flag}")
+    sys.exit(1 if report['regressions'] else 0)
+
+
+if __name__ == '__main__':
+    main()
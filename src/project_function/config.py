@@ -10,6 +10,17 @@ PDF_IMAGE_PATH = os.path.join(current_dir, "../../TEM_DATAS/LLaVA Dataset/PDF_im
 TEM_IMAGE_PATH = os.path.join(current_dir, "../../TEM_DATAS/LLaVA Dataset/TEM_images")  # Cropped TEM sub-images
 DESCRIPTION_PATH = os.path.join(current_dir, "../../TEM_DATAS/LLaVA Dataset/TEM_descriptions")  # Cropped captions
 
+# === Output Format ===
+OUTPUT_MODE = 'files'  # 'files': one PNG per image in the folders above; 'shards': tar shards in SHARD_PATH
+SHARD_PATH = os.path.join(current_dir, "../../TEM_DATAS/LLaVA Dataset/shards")  # Tar shards + Parquet index
+SHARD_MAX_BYTES = 1 << 30  # Start a new shard after 1 GiB
+SHARD_MAX_SAMPLES = 10000  # ... or after this many images
+
+# === Image Encoding ===
+IMAGE_FORMAT = 'png'  # 'png', 'webp' (lossless) or 'jpeg' (lossy, previews only)
+IMAGE_QUALITY = None  # PNG compression 0-9, WebP quality (> 100 = lossless), JPEG quality; None = format default
+IMAGE_WRITER_THREADS = 4  # Background encoding threads per worker process (0 = encode inline)
+
 # === YOLO Model Weights ===
 CROP_IMAGES = os.path.join(current_dir, "vision_model", "crop_images.pt")             # For detecting main panels
 IMAGE_DESCRIPTION = os.path.join(current_dir, "vision_model", "image_description.pt") # For splitting TEM vs caption
@@ -19,9 +30,33 @@ TEM_IMAGE_CROP = os.path.join(current_dir, "vision_model", "TEM_image_crop.pt")
 BINARY_CLASSIFIER = os.path.join(current_dir, "vision_model", "binary_classifier.pth")    # None vs NotNone classifier
 FIVE_CLASS_CLASSIFIER = os.path.join(current_dir, "vision_model", "five_class_classifier.pth")  # 5-way TEM classifier
 
+# === Inference Backend ===
+INFERENCE_BACKEND = 'eager'  # 'eager', 'compile', 'torchscript' or 'onnx' (export with project_function.inference_backends)
+QUANTIZE_INT8 = False  # Dynamic int8 quantization (TorchScript/ONNX files must be exported with --int8)
+EXPORT_DIR = os.path.join(current_dir, "vision_model", "exported")  # Exported TorchScript/ONNX models
+
 
 # === CSV Output Path ===
 CSV_PATH = os.path.join(current_dir, "../tem_images_description.csv")  # Metadata logging
+CAPTION_TEXT_PATH = os.path.join(current_dir, "../tem_caption_text.csv")  # Caption text from the PDF text layer
+
+# === Incremental Processing ===
+MANIFEST_PATH = os.path.join(current_dir, "../extraction_manifest.sqlite")  # Per-PDF content hash, stage keys and results
+DETECTIONS_PATH = os.path.join(current_dir, "../extraction_detections")  # Stored detector outputs per PDF and detection key
+PHASH_INDEX_PATH = os.path.join(current_dir, "../tem_phash_index.sqlite")  # Near-duplicate index of TEM sub-images
+
+# === Classifier Pre-filter ===
+STAT_PREFILTER_THRESHOLD = 0.8  # Reject score (0-1) at which sub-images skip the ResNet and become 'None'
+
+# === VQA Distillation ===
+DISTILL_MODEL = 'gpt-4o'  # Chat model generating the QA pairs
+DISTILL_OUTPUT_PATH = os.path.join(current_dir, "../distilled_llava_vqa.jsonl")  # LLaVA-format JSONL checkpoint
+DISTILL_CACHE_PATH = os.path.join(current_dir, "../distill_cache.sqlite")  # Model replies keyed by image hashes + prompt + model
+
+# === Evaluation ===
+BERTSCORE_MODEL = 'microsoft/deberta-xlarge-mnli'  # BERTScore backbone (layer chosen by bert_score)
+SBERT_MODEL = 'sentence-transformers/all-mpnet-base-v2'  # Sentence embeddings for the SBERT cosine
+EVAL_EMBEDDING_CACHE_PATH = os.path.join(current_dir, "../eval_embeddings.sqlite")  # Embeddings keyed by model + text hash
 
 if __name__ == '__main__':
     print(current_dir)
\ No newline at end of file
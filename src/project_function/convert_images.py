@@ -1,6 +1,176 @@
 import fitz  # PyMuPDF
 import os
 import glob
+import math
+
+import numpy as np
+
+from project_function import telemetry
+
+
+# === Open a PDF and reject files that MuPDF complains about ===
+def _open_pdf(pdf_path: str, pdf_filename: str):
+    """
+    Open a PDF with PyMuPDF and fail on any MuPDF warning (e.g., corrupted file).
+
+    Args:
+        pdf_path (str): Directory containing the PDF
+        pdf_filename (str): PDF file name (e.g., 'paper123.pdf')
+
+    Returns:
+        fitz.Document: Opened document (caller is responsible for closing it)
+    """
+    # Clear previous MuPDF warning buffer
+    fitz.TOOLS.mupdf_warnings()
+
+    # Open PDF document
+    pdf_file = os.path.join(pdf_path, pdf_filename)
+    doc = fitz.open(pdf_file)
+
+    # Check for any MuPDF warnings (e.g., corrupted file)
+    warnings = fitz.TOOLS.mupdf_warnings()
+    if warnings:
+        doc.close()
+        print(f"Warning(s) when opening {pdf_filename}:\n{warnings}")
+        raise RuntimeError("MuPDF raised warnings when loading the document.")
+
+    return doc
+
+
+# === Resolve which page indices to render ===
+def _select_pages(page_count: int, page_range=None):
+    """
+    Turn a page-range option into a list of valid 0-based page indices.
+
+    Args:
+        page_range (tuple or iterable or None): None for all pages, a (start, stop) tuple
+            with Python slice semantics, or an explicit iterable of page indices
+
+    Returns:
+        List[int]: Page indices within [0, page_count)
+    """
+    if page_range is None:
+        return list(range(page_count))
+    if isinstance(page_range, tuple) and len(page_range) == 2:
+        start, stop = page_range
+        return list(range(page_count))[slice(start, stop)]
+    return [p for p in page_range if 0 <= p < page_count]
+
+
+# === Zoom matrix for a page, shrunk to fit a pixel budget ===
+def _page_matrix(page, zoom_factor: float, max_pixels=None):
+    """
+    Build the render matrix for a page, lowering the zoom if the output
+    would exceed `max_pixels` (width * height).
+
+    Args:
+        page (fitz.Page): Page to render
+        zoom_factor (float): Requested zoom level
+        max_pixels (int or None): Upper bound on rendered pixels per page
+
+    Returns:
+        fitz.Matrix: Render matrix for the page
+    """
+    zoom = zoom_factor
+    if max_pixels:
+        rect = page.rect
+        area = rect.width * rect.height
+        if area > 0 and area * zoom * zoom > max_pixels:
+            zoom = math.sqrt(max_pixels / area)
+    return fitz.Matrix(zoom, zoom)
+
+
+# === Cheap page pre-filter: skip pages that cannot hold a figure ===
+# Thresholds per mode: minimum fraction of the page covered by raster images,
+# and minimum number of vector drawing commands together with the fraction of the page they span
+PAGE_FILTER_THRESHOLDS = {
+    'default': {'image_fraction': 0.02, 'min_path_items': 30, 'path_fraction': 0.05},
+    'conservative': {'image_fraction': 0.0, 'min_path_items': 10, 'path_fraction': 0.0},
+}
+
+
+def page_may_have_figure(page, conservative: bool = False) -> bool:
+    """
+    Decide from the page structure alone (no rasterization) whether a page can contain a figure.
+
+    A page is kept if its embedded images cover enough of the page, or if it
+    has enough vector drawing commands spread over a large enough area (vector plots).
+    Conservative mode keeps every page with any image or more than a few paths.
+
+    Args:
+        page (fitz.Page): Page to inspect
+        conservative (bool): Only skip pages that are clearly text-only
+
+    Returns:
+        bool: False if the page can safely be skipped
+    """
+    thresholds = PAGE_FILTER_THRESHOLDS['conservative' if conservative else 'default']
+    page_rect = page.rect
+    page_area = abs(page_rect) or 1.0
+
+    # Raster images: total on-page area of their bounding boxes
+    image_area = 0.0
+    for info in page.get_image_info():
+        image_area += abs(fitz.Rect(info['bbox']) & page_rect)
+    if image_area > 0 and image_area / page_area >= thresholds['image_fraction']:
+        return True
+
+    # Vector graphics: number of drawing commands (lines, curves, rects) and the area they span
+    paths = page.get_cdrawings()
+    if sum(len(path['items']) for path in paths) >= thresholds['min_path_items']:
+        # Union by hand: lines have zero-height rects, which Rect union ignores
+        rects = [path['rect'] for path in paths]
+        bounds = fitz.Rect(min(r[0] for r in rects), min(r[1] for r in rects),
+                           max(r[2] for r in rects), max(r[3] for r in rects))
+        if abs(bounds & page_rect) / page_area >= thresholds['path_fraction']:
+            return True
+
+    return False
+
+
+def _keep_page(page, prefilter, conservative, stats):
+    """Apply the optional pre-filter and count pages in `stats` (if given)."""
+    keep = page_may_have_figure(page, conservative) if prefilter else True
+    if not keep:
+        telemetry.count('pages_skipped')
+    if stats is not None:
+        stats['pages'] = stats.get('pages', 0) + 1
+        stats['skipped'] = stats.get('skipped', 0) + (0 if keep else 1)
+    return keep
+
+
+# === Wrap a Pixmap's sample buffer as a NumPy array (no copy) ===
+class _PixmapBuffer:
+    """Exposes a Pixmap's samples through the NumPy array interface and keeps the Pixmap alive."""
+    __slots__ = ('pix', '__array_interface__')
+
+    def __init__(self, pix):
+        self.pix = pix
+        self.__array_interface__ = {
+            'shape': (pix.height, pix.width, pix.n),
+            'typestr': '|u1',
+            'strides': (pix.stride, pix.n, 1),
+            'data': (pix.samples_ptr, False),
+            'version': 3,
+        }
+
+
+def pixmap_to_array(pix) -> np.ndarray:
+    """
+    View the samples of a Pixmap as an (H, W, C) uint8 array without copying.
+
+    The array shares memory with `pix` and owns a reference to it (through its
+    `base`), so the buffer stays valid for as long as the array or any view of
+    it is alive, even after the caller drops the Pixmap.
+
+    Args:
+        pix (fitz.Pixmap): Rendered page
+
+    Returns:
+        np.ndarray: RGB (or RGBA / gray) image backed by the Pixmap buffer
+    """
+    return np.asarray(_PixmapBuffer(pix))
+
 
 def convert_pdf_to_image(pdf_path: str, pdf_filename: str, zoom_factor: float):
     """
@@ -17,26 +187,16 @@ def convert_pdf_to_image(pdf_path: str, pdf_filename: str, zoom_factor: float):
     images = []
 
     try:
-        # Clear previous MuPDF warning buffer
-        fitz.TOOLS.mupdf_warnings()  
-
-        # Open PDF document
-        pdf_file = os.path.join(pdf_path, pdf_filename)
-        doc = fitz.open(pdf_file)
-
-        # Check for any MuPDF warnings (e.g., corrupted file)
-        warnings = fitz.TOOLS.mupdf_warnings()
-        if warnings:
-            print(f"Warning(s) when opening {pdf_filename}:\n{warnings}")
-            raise RuntimeError("MuPDF raised warnings when loading the document.")
-
         # Define zoom factor for resolution scaling
         zoom_matrix = fitz.Matrix(zoom_factor, zoom_factor)
 
-        # Convert each page to image (Pixmap)
-        for page_num, page in enumerate(doc):
-            pix = page.get_pixmap(matrix=zoom_matrix)
-            images.append(pix)
+        with _open_pdf(pdf_path, pdf_filename) as doc:
+            # Convert each page to image (Pixmap)
+            for page_num, page in enumerate(doc):
+                with telemetry.span('render', page=page_num):
+                    pix = page.get_pixmap(matrix=zoom_matrix)
+                telemetry.count('pages_rendered')
+                images.append(pix)
 
         print(f"[✓] PDF '{pdf_filename}' converted successfully with {len(images)} pages.")
         return images
@@ -46,5 +206,294 @@ def convert_pdf_to_image(pdf_path: str, pdf_filename: str, zoom_factor: float):
         return None
 
 
+# === Streaming variant: one page in memory at a time ===
+def iter_pdf_to_image(pdf_path: str, pdf_filename: str, zoom_factor: float,
+                      page_range=None, max_pixels=None, prefilter=False, conservative=False, stats=None):
+    """
+    Render the pages of a PDF one at a time, yielding each as a NumPy array.
+
+    Only the current page is held in memory, so peak usage does not grow with
+    the page count as long as the caller drops each array before the next one.
+    Each yielded array is a zero-copy view that keeps its Pixmap alive, so it is
+    safe to keep (e.g., `list(iter_pdf_to_image(...))`), at the cost of holding
+    every kept page. The document is closed when the generator is exhausted or closed.
+
+    Args:
+        pdf_path (str): Directory containing the PDF
+        pdf_filename (str): PDF file name (e.g., 'paper123.pdf')
+        zoom_factor (float): Zoom level for rendering (1.0 = 72dpi, 2.0 = 144dpi, etc.)
+        page_range (tuple or iterable or None): (start, stop) slice or explicit page indices
+        max_pixels (int or None): Per-page pixel budget; pages that would exceed it
+            are rendered at a lower zoom
+        prefilter (bool): Skip pages that `page_may_have_figure` rejects without rendering them
+        conservative (bool): Use the conservative pre-filter thresholds
+        stats (dict or None): Filled with 'pages' (inspected) and 'skipped' counts
+
+    Yields:
+        Tuple[int, np.ndarray]: (page number, RGB image of shape (H, W, 3))
+    """
+    try:
+        doc = _open_pdf(pdf_path, pdf_filename)
+    except Exception as e:
+        print(f"[✗] Error when processing PDF '{pdf_filename}': {e}")
+        return
+
+    rendered = 0
+    try:
+        for page_num in _select_pages(doc.page_count, page_range):
+            page = doc.load_page(page_num)
+            if not _keep_page(page, prefilter, conservative, stats):
+                continue
+
+            with telemetry.span('render', page=page_num):
+                pix = page.get_pixmap(matrix=_page_matrix(page, zoom_factor, max_pixels), alpha=False)
+            telemetry.count('pages_rendered')
+            yield page_num, pixmap_to_array(pix)
+
+            # Drop references before rendering the next page
+            del pix, page
+            rendered += 1
+
+        print(f"[✓] PDF '{pdf_filename}' streamed successfully with {rendered} pages.")
+
+    except Exception as e:
+        print(f"[✗] Error when processing PDF '{pdf_filename}': {e}")
+
+    finally:
+        doc.close()
+
+
+# === Map a pixel box on a rendered page back to PDF coordinates ===
+def pixel_box_to_rect(page, box, zoom_factor: float, padding: float = 0):
+    """
+    Convert an (x1, y1, x2, y2) box on a page rendered at `zoom_factor`
+    into a `fitz.Rect` in page coordinates, clipped to the page.
+
+    Args:
+        page (fitz.Page): Page the box was detected on
+        box (tuple): Pixel coordinates on the rendered image
+        zoom_factor (float): Zoom the page was rendered with
+        padding (float): Margin in PDF points added on every side to absorb
+            low-resolution rounding
+
+    Returns:
+        fitz.Rect: Region in page coordinates
+    """
+    x1, y1, x2, y2 = box
+    origin = page.rect.tl
+    rect = fitz.Rect(x1 / zoom_factor, y1 / zoom_factor, x2 / zoom_factor, y2 / zoom_factor) + (
+        origin.x - padding, origin.y - padding, origin.x + padding, origin.y + padding)
+    return rect & page.rect
+
+
+# === Two-pass rendering: detect at low zoom, re-render detections at high zoom ===
+def iter_pdf_regions(pdf_path: str, pdf_filename: str, detect_boxes, detect_zoom: float = 1.5,
+                     output_zoom: float = 5, page_range=None, padding: float = 2,
+                     prefilter=False, conservative=False, stats=None):
+    """
+    Render each page at a cheap `detect_zoom`, run `detect_boxes` on it, and
+    re-render only the detected regions at `output_zoom` via `get_pixmap(clip=...)`.
+
+    Full pages are never rasterized at the output zoom, so rendering cost and
+    memory scale with figure area instead of page area. The yielded arrays are
+    zero-copy views that keep their Pixmaps alive, so they remain valid after
+    the next page is requested.
+
+    Args:
+        pdf_path (str): Directory containing the PDF
+        pdf_filename (str): PDF file name (e.g., 'paper123.pdf')
+        detect_boxes (Callable[[np.ndarray], List[tuple]]): Returns (x1, y1, x2, y2)
+            pixel boxes for an RGB page image (e.g., `vision_crop.figure_boxes`)
+        detect_zoom (float): Zoom used for the detection pass
+        output_zoom (float): Zoom used to re-render detected regions
+        page_range (tuple or iterable or None): (start, stop) slice or explicit page indices
+        padding (float): Margin in PDF points added around each detected box
+        prefilter (bool): Skip pages that `page_may_have_figure` rejects without rendering them
+        conservative (bool): Use the conservative pre-filter thresholds
+        stats (dict or None): Filled with 'pages' (inspected) and 'skipped' counts
+
+    Yields:
+        Tuple[int, List[Tuple[fitz.Rect, np.ndarray]]]: (page number, [(region in
+            page coordinates, RGB region image), ...]) for pages with detections
+    """
+    try:
+        doc = _open_pdf(pdf_path, pdf_filename)
+    except Exception as e:
+        print(f"[✗] Error when processing PDF '{pdf_filename}': {e}")
+        return
+
+    detect_matrix = fitz.Matrix(detect_zoom, detect_zoom)
+    output_matrix = fitz.Matrix(output_zoom, output_zoom)
+    region_count = 0
+    try:
+        for page_num in _select_pages(doc.page_count, page_range):
+            page = doc.load_page(page_num)
+            if not _keep_page(page, prefilter, conservative, stats):
+                continue
+
+            # Pass 1: cheap render for detection only
+            with telemetry.span('render', page=page_num, zoom=detect_zoom):
+                low_pix = page.get_pixmap(matrix=detect_matrix, alpha=False)
+            telemetry.count('pages_rendered')
+            boxes = detect_boxes(pixmap_to_array(low_pix))
+            del low_pix
+            if not boxes:
+                continue
+
+            # Pass 2: high-zoom render of the detected clips
+            pixmaps = []
+            regions = []
+            with telemetry.span('render_regions', page=page_num, zoom=output_zoom, regions=len(boxes)):
+                for box in boxes:
+                    rect = pixel_box_to_rect(page, box, detect_zoom, padding)
+                    if rect.is_empty:
+                        continue
+                    pix = page.get_pixmap(matrix=output_matrix, clip=rect, alpha=False)
+                    pixmaps.append(pix)
+                    regions.append((rect, pixmap_to_array(pix)))
+            telemetry.count('regions_rendered', len(regions))
+
+            if regions:
+                region_count += len(regions)
+                yield page_num, regions
+
+            # Drop references before rendering the next page
+            del pixmaps, regions, page
+
+        print(f"[✓] PDF '{pdf_filename}' two-pass rendered successfully with {region_count} regions.")
+
+    except Exception as e:
+        print(f"[✗] Error when processing PDF '{pdf_filename}': {e}")
+
+    finally:
+        doc.close()
+
+
+# === Caption text straight from the PDF text layer ===
+def open_text_layer(pdf_path: str, pdf_filename: str):
+    """
+    Open a PDF for text extraction only (no rendering).
+
+    Args:
+        pdf_path (str): Directory containing the PDF
+        pdf_filename (str): PDF file name (e.g., 'paper123.pdf')
+
+    Returns:
+        fitz.Document: Usable as a context manager so it is closed deterministically
+    """
+    return fitz.open(os.path.join(pdf_path, pdf_filename))
+
+
+def region_to_rect(origin, box, zoom_factor: float, padding: float = 1):
+    """
+    Map a pixel box inside a rendered region back to page coordinates.
+
+    Args:
+        origin (Tuple[float, float]): Page coordinates of the region's top-left pixel
+        box (tuple): (x1, y1, x2, y2) pixel box inside the region
+        zoom_factor (float): Zoom the region was rendered with
+        padding (float): Margin in PDF points added on every side
+
+    Returns:
+        fitz.Rect: Box in page coordinates
+    """
+    x0, y0 = origin
+    x1, y1, x2, y2 = box
+    return fitz.Rect(x0 + x1 / zoom_factor - padding, y0 + y1 / zoom_factor - padding,
+                     x0 + x2 / zoom_factor + padding, y0 + y2 / zoom_factor + padding)
+
+
+def _text_layer_usable(text: str, min_chars: int = 20) -> bool:
+    """
+    Heuristic check that extracted text is real text rather than a missing or
+    garbled layer (unmapped glyphs, '(cid:NN)' codes, replacement characters).
+    """
+    stripped = ''.join(text.split())
+    if len(stripped) < min_chars or '(cid:' in text:
+        return False
+    bad = sum(1 for ch in stripped if ch == '\ufffd' or not ch.isprintable())
+    letters = sum(1 for ch in stripped if ch.isalpha())
+    return bad / len(stripped) < 0.02 and letters / len(stripped) > 0.5
+
+
+def page_text_layer(page):
+    """
+    Read a page's text layer once into plain Python data.
+
+    The result holds no PyMuPDF objects, so captions can be cut from it on any
+    thread (PyMuPDF itself is not thread-safe) after the figure boxes are known.
+
+    Args:
+        page (fitz.Page): Page to read
+
+    Returns:
+        List[List[dict]]: Lines in reading order, each a list of spans with 'text', 'font',
+            'size', 'flags', 'bbox' and 'chars' ([(char, (x0, y0, x1, y1))])
+    """
+    lines = []
+    for block in page.get_text('rawdict', flags=fitz.TEXTFLAGS_TEXT)['blocks']:
+        for line in block.get('lines', []):
+            lines.append([{
+                'text': ''.join(char['c'] for char in span['chars']),
+                'font': span['font'],
+                'size': span['size'],
+                'flags': span['flags'],
+                'bbox': tuple(span['bbox']),
+                'chars': [(char['c'], tuple(char['bbox'])) for char in span['chars']],
+            } for span in line['spans']])
+    return lines
+
+
+def _clip_span(span, rect):
+    """Keep the characters of a span whose box centre lies in `rect`; None when nothing is left."""
+    x0, y0, x1, y1 = rect
+    chars = [(c, bbox) for c, bbox in span['chars']
+             if x0 <= (bbox[0] + bbox[2]) / 2 <= x1 and y0 <= (bbox[1] + bbox[3]) / 2 <= y1]
+    if not chars:
+        return None
+    if len(chars) == len(span['chars']):
+        return span
+    return {**span, 'text': ''.join(c for c, _ in chars), 'chars': chars,
+            'bbox': (min(b[0] for _, b in chars), min(b[1] for _, b in chars),
+                     max(b[2] for _, b in chars), max(b[3] for _, b in chars))}
+
+
+def extract_caption_text(text_layer, rect, min_chars: int = 20):
+    """
+    Read the text inside `rect` from a page's text layer, keeping span and font details.
+
+    A character belongs to the caption when the centre of its box lies in
+    `rect`. Lines are joined with spaces; a trailing hyphen at a line end is
+    treated as a word break. When the result is empty or looks garbled,
+    'usable' is False and the caller should fall back to OCR on the caption crop.
+
+    Args:
+        text_layer (list or fitz.Page): Output of `page_text_layer`, or the page to read it from
+        rect (fitz.Rect): Caption region in page coordinates
+        min_chars (int): Minimum non-whitespace characters for the text to count as usable
+
+    Returns:
+        dict: {'text': str, 'spans': List[dict] with 'text', 'font', 'size', 'flags', 'bbox',
+               'usable': bool}
+    """
+    if isinstance(text_layer, fitz.Page):
+        text_layer = page_text_layer(text_layer)
+
+    lines = []
+    spans = []
+    for line in text_layer:
+        clipped = [span for span in (_clip_span(span, rect) for span in line) if span is not None]
+        line_text = ''.join(span['text'] for span in clipped).strip()
+        if line_text:
+            lines.append(line_text)
+        for span in clipped:
+            spans.append({key: span[key] for key in ('text', 'font', 'size', 'flags', 'bbox')})
 
+    text = ''
+    for line_text in lines:
+        if text.endswith('-'):
+            text = text[:-1] + line_text
+        else:
+            text = f"{text} {line_text}" if text else line_text
 
+    return {'text': text, 'spans': spans, 'usable': _text_layer_usable(text, min_chars)}
@@ -0,0 +1,259 @@
+"""
+Near-duplicate detection for extracted TEM sub-images using 64-bit perceptual
+hashes stored in a persistent multi-index hash table.
+"""
+import re
+import sqlite3
+import threading
+
+import cv2
+import numpy as np
+
+from project_function import config
+
+# 64-bit hashes are split into 4 chunks of 16 bits. Two hashes within Hamming
+# distance 3 must agree exactly on at least one chunk (pigeonhole), so each
+# lookup is 4 indexed equality queries instead of a scan.
+NUM_CHUNKS = 4
+CHUNK_BITS = 64 // NUM_CHUNKS
+MAX_SEARCH_DISTANCE = NUM_CHUNKS - 1
+
+# Written sub-TEM images are named 'PDF{pdf stem}_Image{n}_{m}{ext}' by the pipeline
+_WRITTEN_NAME = re.compile(r'^PDF(.+)_Image\d+_\d+\.\w+$')
+
+
+def phash(image: np.ndarray) -> int:
+    """
+    Compute a 64-bit DCT perceptual hash.
+
+    Args:
+        image (np.ndarray): BGR, BGRA or grayscale image
+
+    Returns:
+        int: Unsigned 64-bit hash
+    """
+    if image.ndim == 3:
+        code = cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        image = cv2.cvtColor(image, code)
+    small = cv2.resize(image, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    # Keep the 8×8 lowest frequencies and threshold against their median (DC excluded)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def _chunks(value):
+    mask = (1 << CHUNK_BITS) - 1
+    return [(value >> (CHUNK_BITS * i)) & mask for i in range(NUM_CHUNKS)]
+
+
+def _to_signed(value):
+    """SQLite integers are signed 64-bit."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def _pdf_of(image_name):
+    """Best-effort source PDF of an entry stored before entries recorded it."""
+    if '#p' in image_name:
+        return image_name.rsplit('#p', 1)[0]
+    match = _WRITTEN_NAME.match(image_name)
+    return f"{match.group(1)}.pdf" if match else None
+
+
+class PHashIndex:
+    """
+    Persistent near-duplicate index (SQLite-backed multi-index hash table).
+
+    The first image stored with a given hash neighbourhood is canonical; later
+    near-duplicates are recorded as links to it. Entries remember the PDF they
+    came from, so a document that is processed again can first drop its own
+    entries (`purge`) instead of matching its earlier crops.
+    """
+
+    def __init__(self, path=None, max_distance=3):
+        if max_distance > MAX_SEARCH_DISTANCE:
+            raise ValueError(f"max_distance must be <= {MAX_SEARCH_DISTANCE} with {NUM_CHUNKS} hash chunks")
+
+        self.path = path or config.PHASH_INDEX_PATH
+        self.max_distance = max_distance
+        # Several worker processes may share the index; wait for locks instead of failing.
+        # Within a process, pipelined stages share the connection under `_lock`.
+        self.conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        chunk_columns = ', '.join(f'c{i} INTEGER NOT NULL' for i in range(NUM_CHUNKS))
+        self.conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS phashes (
+                image_name TEXT PRIMARY KEY,
+                hash INTEGER NOT NULL,
+                label TEXT,
+                pdf TEXT,
+                {chunk_columns}
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS duplicates (
+                source TEXT PRIMARY KEY,
+                canonical TEXT NOT NULL,
+                distance INTEGER NOT NULL,
+                pdf TEXT
+            )
+        ''')
+        # Indexes created before entries recorded their PDF lack this column; fill it in from the names
+        for table, name_column in (('phashes', 'image_name'), ('duplicates', 'source')):
+            if 'pdf' not in [row[1] for row in self.conn.execute(f'PRAGMA table_info({table})')]:
+                self.conn.execute(f'ALTER TABLE {table} ADD COLUMN pdf TEXT')
+                names = [name for (name,) in self.conn.execute(f'SELECT {name_column} FROM {table}')]
+                self.conn.executemany(f'UPDATE {table} SET pdf = ? WHERE {name_column} = ?',
+                                      [(_pdf_of(name), name) for name in names])
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_pdf ON {table}(pdf)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS duplicates_canonical ON duplicates(canonical)')
+        for i in range(NUM_CHUNKS):
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS phashes_c{i} ON phashes(c{i})')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM phashes').fetchone()[0]
+
+    def lookup(self, value):
+        """
+        Find the closest stored hash within `max_distance`.
+
+        Args:
+            value (int): Unsigned 64-bit perceptual hash
+
+        Returns:
+            Tuple[str, int, str or None] or None: (canonical image name, Hamming distance, label)
+        """
+        with self._lock:
+            return self._closest(value)
+
+    def _closest(self, value):
+        query = ' UNION '.join(f'SELECT image_name, hash, label FROM phashes WHERE c{i} = ?' for i in range(NUM_CHUNKS))
+        best = None
+        for image_name, stored, label in self.conn.execute(query, _chunks(value)).fetchall():
+            distance = (_to_unsigned(stored) ^ value).bit_count()
+            if distance <= self.max_distance and (best is None or distance < best[1]):
+                best = (image_name, distance, label)
+        return best
+
+    def _insert(self, value, image_name, label, pdf):
+        self.conn.execute(
+            f'INSERT OR REPLACE INTO phashes (image_name, hash, label, pdf, '
+            f'{", ".join(f"c{i}" for i in range(NUM_CHUNKS))}) VALUES (?, ?, ?, ?, {", ".join("?" * NUM_CHUNKS)})',
+            (image_name, _to_signed(value), label, pdf, *_chunks(value))
+        )
+
+    def add(self, value, image_name, label=None, pdf=None):
+        """Store `image_name` (from `pdf`) as a canonical image with hash `value`."""
+        with self._lock:
+            self._insert(value, image_name, label, pdf)
+            self.conn.commit()
+
+    def add_or_link(self, value, image_name, pdf=None):
+        """
+        Store `image_name` as canonical, or link it to an indexed near-duplicate, in one transaction.
+
+        Looking up and adding together means two copies of an image that are
+        processed at the same time (in other threads or worker processes)
+        cannot both become canonical.
+
+        Args:
+            value (int): Unsigned 64-bit perceptual hash
+            image_name (str): Name to store, e.g. 'paper.pdf#p3@x1,y1,x2,y2' (see `assign`)
+            pdf (str or None): PDF the image comes from
+
+        Returns:
+            Tuple[str, int, str or None] or None: The match `image_name` was linked to, or None if it was added
+        """
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                match = self._closest(value)
+                if match is None:
+                    self._insert(value, image_name, None, pdf)
+                else:
+                    self.conn.execute(
+                        'INSERT OR REPLACE INTO duplicates (source, canonical, distance, pdf) VALUES (?, ?, ?, ?)',
+                        (image_name, match[0], match[1], pdf)
+                    )
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+        return match
+
+    def assign(self, image_name, new_name, label=None):
+        """Rename a canonical entry (e.g. once its output file name is known) and set its label."""
+        with self._lock:
+            self.conn.execute('UPDATE OR REPLACE phashes SET image_name = ?, label = ? WHERE image_name = ?',
+                              (new_name, label, image_name))
+            self.conn.execute('UPDATE duplicates SET canonical = ? WHERE canonical = ?', (new_name, image_name))
+            self.conn.commit()
+
+    def remove(self, image_name):
+        """Remove a canonical entry (e.g. a crop that was not written) and move its duplicate links on."""
+        with self._lock:
+            removed = self.conn.execute('SELECT image_name, hash FROM phashes WHERE image_name = ?',
+                                        (image_name,)).fetchall()
+            self.conn.execute('DELETE FROM phashes WHERE image_name = ?', (image_name,))
+            self._relink(removed)
+            self.conn.commit()
+
+    def _relink(self, removed):
+        """
+        Point the duplicate links of removed canonical entries at the closest remaining entry,
+        or drop them when none is left within `max_distance`. The stored distance then becomes
+        an upper bound (link distance plus the distance between the two canonical hashes).
+        """
+        for image_name, value in removed:
+            match = self._closest(_to_unsigned(value))
+            if match is None:
+                self.conn.execute('DELETE FROM duplicates WHERE canonical = ?', (image_name,))
+            else:
+                self.conn.execute('UPDATE duplicates SET canonical = ?, distance = distance + ? WHERE canonical = ?',
+                                  (match[0], match[1], image_name))
+
+    def link(self, source, canonical, distance, pdf=None):
+        """Record that `source` (e.g. 'paper.pdf#p3@x1,y1,x2,y2') duplicates `canonical`."""
+        with self._lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO duplicates (source, canonical, distance, pdf) VALUES (?, ?, ?, ?)',
+                (source, canonical, distance, pdf)
+            )
+            self.conn.commit()
+
+    def purge(self, pdf):
+        """
+        Remove the entries and duplicate links recorded for `pdf`, before it is processed again.
+        Other PDFs' links to the removed entries are moved on as in `remove`.
+
+        Returns:
+            int: Number of removed canonical entries
+        """
+        with self._lock:
+            removed = self.conn.execute('SELECT image_name, hash FROM phashes WHERE pdf = ?', (pdf,)).fetchall()
+            self.conn.execute('DELETE FROM phashes WHERE pdf = ?', (pdf,))
+            self.conn.execute('DELETE FROM duplicates WHERE pdf = ?', (pdf,))
+            self._relink(removed)
+            self.conn.commit()
+        return len(removed)
+
+    def canonical_of(self, source):
+        with self._lock:
+            row = self.conn.execute('SELECT canonical FROM duplicates WHERE source = ?', (source,)).fetchone()
+        return row[0] if row else None
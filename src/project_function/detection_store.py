@@ -0,0 +1,83 @@
+"""
+Stored detector outputs of one document: the TEM and description crops of
+every figure with their boxes, and the sub-TEM boxes inside each TEM crop.
+
+A run whose detection stage is unchanged (same PDF, rendering settings and
+YOLO weights) loads these instead of rendering the PDF and running the three
+detectors, and only classifies and writes again (see `pipeline.process_pdf`).
+"""
+import json
+import os
+
+import numpy as np
+
+from project_function.vision_crop import Detection
+
+
+def _plain(values):
+    """Box coordinates as JSON numbers (ints stay ints, so index names built from them do not change)."""
+    return [value.item() if hasattr(value, 'item') else value for value in values]
+
+
+def save(path, pages, stats):
+    """
+    Write the detections of one document.
+
+    Args:
+        path (str): .npz file; written to a temporary file and renamed, so it is never half-written
+        pages (List[Tuple[int, list]]): (page number, [(tem, description, subs)] per figure) in page order
+        stats (dict): Document stats; the page counts 'pages' and 'skipped' are kept
+    """
+    arrays = {}
+
+    def record(detection):
+        if detection is None:
+            return None
+        name = f"a{len(arrays)}"
+        arrays[name] = np.ascontiguousarray(detection.image)
+        return {'image': name, 'bbox': _plain(detection.bbox), 'page_bbox': _plain(detection.page_bbox),
+                'score': float(detection.score), 'cls': int(detection.cls), 'page': detection.page}
+
+    meta = {
+        'pages': stats.get('pages', 0),
+        'skipped': stats.get('skipped', 0),
+        'figures': [[page_num, [{'tem': record(tem), 'description': record(description),
+                                 'subs': [[_plain(sub.bbox), float(sub.score), int(sub.cls)] for sub in subs]}
+                                for tem, description, subs in regions]]
+                    for page_num, regions in pages],
+    }
+    arrays['meta'] = np.array(json.dumps(meta))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load(path):
+    """
+    Read the detections written by `save`.
+
+    Returns:
+        Tuple[List[Tuple[int, list]], dict]: (pages as given to `save`, {'pages', 'skipped'} counts);
+            sub-TEM detections are views into their TEM crop, as when they were detected
+    """
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(str(data['meta']))
+        arrays = {name: data[name] for name in data.files if name != 'meta'}
+
+    def restore(entry):
+        if entry is None:
+            return None
+        return Detection(arrays[entry['image']], tuple(entry['bbox']), tuple(entry['page_bbox']),
+                         entry['score'], entry['cls'], entry['page'])
+
+    pages = []
+    for page_num, figures in meta['figures']:
+        regions = []
+        for figure in figures:
+            tem = restore(figure['tem'])
+            subs = [tem.child(tuple(bbox), score, cls) for bbox, score, cls in figure['subs']]
+            regions.append((tem, restore(figure['description']), subs))
+        pages.append((page_num, regions))
+    return pages, {'pages': meta['pages'], 'skipped': meta['skipped']}
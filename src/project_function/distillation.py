@@ -0,0 +1,755 @@
+"""
+VQA distillation of the extracted TEM images with an OpenAI-compatible chat model.
+
+Reads the pipeline outputs (metadata CSV, caption CSV, and the TEM_images /
+PDF_images / TEM_descriptions folders or the tar shards), groups the sub-TEM
+images by their parent figure and asks the model for question-answer pairs
+about every sub-image, like the GPT-4o step of `scripts/data distillation.ipynb`:
+
+- Requests run concurrently on one asyncio event loop, limited by the number of
+  requests in flight and by requests- and tokens-per-minute budgets
+  (`RateLimiter`). Token use is estimated before sending (text + image tiles +
+  `max_tokens`) and corrected with the reported usage afterwards.
+- Small figures are packed into one request (`pack_requests`) up to
+  `max_images` images, which saves requests and repeated system prompts.
+- Replies are cached in SQLite (`ResponseCache`), keyed by the content hash of
+  every image, the prompt template, the model and the rendered text, so a rerun
+  never pays twice for an identical prompt.
+- Every finished request is appended at once to a LLaVA-format JSONL file; a
+  rerun skips the figures already in it.
+
+Figures whose caption could not be read from the PDF text layer get their
+caption crop (TEM_descriptions) attached, so the model reads it from the image.
+
+`StandInServer` is a local OpenAI-compatible endpoint with deterministic
+replies, optional latency and a request limit, for trying the client without
+an API key:
+
+    python -m project_function.distillation stand-in --port 8011
+    python -m project_function.distillation run --base-url http://127.0.0.1:8011/v1
+
+Any other OpenAI-compatible server (vLLM, SGLang) works through `--base-url` too.
+"""
+import argparse
+import asyncio
+import base64
+import csv
+import hashlib
+import http.server
+import io
+import itertools
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from PIL import Image
+
+from project_function import config
+
+SYSTEM_PROMPT = """
+You are a scientific assistant that builds visual question answering (VQA) data for transmission electron
+microscopy (TEM) images.
+
+For every sub-image you are shown, generate question-answer pairs by task type:
+- classification: imaging modality and image type
+- recognition: observable features and measurements
+- analysis: visual reasoning and interpretation
+- description: a comprehensive summary of the image
+
+Rules:
+- Answer from visual evidence only. The parent caption and the predicted labels are context, not answers.
+- Do not name materials unless they can be identified in the image.
+- Treat every sub-image independently; for a blank or unreadable sub-image, return no pairs.
+- Give several pairs per task type.
+
+Return only a JSON list of objects with the fields: sub_image, question, answer, level.
+""".strip()
+
+USER_TEMPLATE = (
+    "Parent image filename: {parent_image}\n"
+    "Caption: {caption}\n"
+    "{sub_images}"
+)
+SUB_IMAGE_TEMPLATE = "Sub-image: {sub_image} (predicted TEM type: {tem_type})"
+CAPTION_IMAGE_NOTE = "(not available as text; read it from the caption image)"
+REQUEST_TEMPLATE = (
+    "The following images will be shown to you:\n\n{figures}\n\n"
+    "Please generate multiple high-quality VQA (Visual Question Answering) pairs for each sub-image. "
+    "Each VQA pair should include a meaningful question and answer that is visually grounded in the image content. "
+    "Return your answer as a JSON list with the fields: sub_image, question, answer, level."
+)
+
+MIME_TYPES = {'.png': 'image/png', '.webp': 'image/webp', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg'}
+
+
+# === Inputs ===
+def load_groups(csv_path=None, caption_csv_path=None):
+    """
+    Group the pipeline's sub-TEM rows by parent figure and attach the caption text.
+
+    Args:
+        csv_path (str or None): Metadata CSV with parent_image, sub_image, TEM_type (default: config.CSV_PATH)
+        caption_csv_path (str or None): Caption CSV with image_name and caption_text (pipeline) or
+            caption_content (caption reconstruction notebook) (default: config.CAPTION_TEXT_PATH)
+
+    Returns:
+        List[dict]: 'parent_image', 'caption' ('' if unusable) and 'subs' ([(sub_image, TEM_type)]),
+            in CSV order
+    """
+    groups = {}
+    with open(csv_path or config.CSV_PATH, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            group = groups.setdefault(row['parent_image'], {'parent_image': row['parent_image'], 'caption': '',
+                                                            'subs': []})
+            group['subs'].append((row['sub_image'], row['TEM_type']))
+
+    caption_csv_path = caption_csv_path or config.CAPTION_TEXT_PATH
+    if os.path.exists(caption_csv_path):
+        with open(caption_csv_path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                text = row.get('caption_content', row.get('caption_text')) or ''
+                if row['image_name'] in groups and row.get('caption_source') != 'needs_ocr':
+                    groups[row['image_name']]['caption'] = text.strip()
+    return list(groups.values())
+
+
+def pack_requests(groups, max_images=6):
+    """
+    Pack consecutive figures into requests of at most `max_images` images (parent + sub-images each);
+    a figure that is larger on its own gets a request of its own.
+
+    Returns:
+        List[List[dict]]: Groups per request
+    """
+    packs = []
+    size = 0
+    for group in groups:
+        images = 1 + len(group['subs'])
+        if packs and size + images <= max_images:
+            packs[-1].append(group)
+            size += images
+        else:
+            packs.append([group])
+            size = images
+    return packs
+
+
+def image_loader(output_mode=None, shard_path=None):
+    """
+    Return a function (kind, name) → image bytes or None for the pipeline's output,
+    where kind is 'tem_image', 'pdf_image' or 'description'.
+
+    Args:
+        output_mode (str or None): 'files' or 'shards' (default: config.OUTPUT_MODE)
+        shard_path (str or None): Shard directory (default: config.SHARD_PATH)
+    """
+    if (output_mode or config.OUTPUT_MODE) == 'shards':
+        from project_function.shards import ShardReader
+
+        reader = ShardReader(shard_path)
+
+        def load(kind, name):
+            try:
+                return bytes(reader.read(f"{kind}/{os.path.splitext(name)[0]}"))
+            except KeyError:
+                return None
+        return load
+
+    folders = {'tem_image': config.TEM_IMAGE_PATH, 'pdf_image': config.PDF_IMAGE_PATH,
+               'description': config.DESCRIPTION_PATH}
+
+    def load(kind, name):
+        path = os.path.join(folders[kind], name)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+    return load
+
+
+# === Requests ===
+def image_tokens(data, detail='auto'):
+    """
+    Input tokens of one image in OpenAI's accounting: 85 at low detail, else 85 + 170 per
+    512-pixel tile after fitting into 2048×2048 and scaling the short side to 768.
+    """
+    if detail == 'low':
+        return 85
+    width, height = Image.open(io.BytesIO(data)).size
+    scale = min(1.0, 2048 / max(width, height))
+    scale *= min(1.0, 768 / (min(width, height) * scale))
+    return 85 + 170 * math.ceil(width * scale / 512) * math.ceil(height * scale / 512)
+
+
+def template_hash(system_prompt=SYSTEM_PROMPT):
+    """Hash of the system prompt and the user templates; part of every cache key."""
+    text = '\0'.join((system_prompt, USER_TEMPLATE, SUB_IMAGE_TEMPLATE, CAPTION_IMAGE_NOTE, REQUEST_TEMPLATE))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def build_request(pack, load_image, system_prompt=SYSTEM_PROMPT, detail='auto'):
+    """
+    Build the chat messages for one pack of figures.
+
+    Images are sent inline as base64 data URLs, each preceded by its file name.
+    Sub-images and parents that cannot be found are left out.
+
+    Args:
+        pack (List[dict]): Groups from `pack_requests`
+        load_image (Callable): From `image_loader`
+        system_prompt (str): System message
+        detail (str): OpenAI image detail ('low', 'high' or 'auto')
+
+    Returns:
+        dict or None: 'messages', 'image_hashes' (sha256 per image, in message order), 'text' (all
+            text parts), 'tokens' (estimated input tokens) and 'sub_images' ({sub_image: group}),
+            or None if no sub-image of the pack was found
+    """
+    content = []
+    hashes = []
+    tokens = 0
+    sections = []
+    sub_images = {}
+
+    def add_image(kind, name):
+        nonlocal tokens
+        data = load_image(kind, name)
+        if data is None:
+            return False
+        mime = MIME_TYPES.get(os.path.splitext(name)[1].lower(), 'image/png')
+        content.append({'type': 'text', 'text': f"Filename: {name}"})
+        content.append({'type': 'image_url', 'image_url': {
+            'url': f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}", 'detail': detail}})
+        hashes.append(hashlib.sha256(data).hexdigest())
+        tokens += image_tokens(data, detail)
+        return True
+
+    for group in pack:
+        parent = group['parent_image']
+        first = len(content)
+        found = [(sub, tem_type) for sub, tem_type in group['subs'] if add_image('tem_image', sub)]
+        if not found:
+            logging.warning(f"{parent}: no sub-images found, skipped")
+            del content[first:]
+            continue
+        sub_images.update((sub, group) for sub, _ in found)
+        add_image('pdf_image', parent)
+        caption = group['caption']
+        if not caption:
+            caption = CAPTION_IMAGE_NOTE if add_image('description', parent) else ''
+        sections.append(USER_TEMPLATE.format(
+            parent_image=parent, caption=caption,
+            sub_images='\n'.join(SUB_IMAGE_TEMPLATE.format(sub_image=sub, tem_type=tem_type) for sub, tem_type in found)))
+
+    if not sub_images:
+        return None
+    text = REQUEST_TEMPLATE.format(figures='\n\n'.join(sections))
+    messages = [{'role': 'system', 'content': system_prompt},
+                {'role': 'user', 'content': [{'type': 'text', 'text': text}, *content]}]
+    text_parts = [system_prompt, text] + [part['text'] for part in content if part['type'] == 'text']
+    # ~4 characters per token for English text, plus per-message overhead
+    tokens += sum(len(part) for part in text_parts) // 4 + 10
+    return {'messages': messages, 'image_hashes': hashes, 'text': text, 'tokens': tokens, 'sub_images': sub_images}
+
+
+def cache_key(model, request, template, params):
+    """Key of a request: image content hashes, prompt template, model, sampling parameters and rendered text."""
+    payload = json.dumps({'model': model, 'template': template, 'params': params,
+                          'images': request['image_hashes'], 'text': request['text']}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# === Replies ===
+def parse_reply(reply, sub_images):
+    """
+    Extract the QA pairs from a model reply.
+
+    Args:
+        reply (str): Model output; a JSON list, optionally inside a ```json fence
+        sub_images (Iterable[str]): Sub-images of the request (pairs for other names are dropped)
+
+    Returns:
+        dict: {sub_image: [{'question', 'answer', 'level'}]} for sub-images with at least one pair
+
+    Raises:
+        ValueError: If the reply holds no JSON list
+    """
+    match = re.search(r'```(?:json)?\s*(.*?)```', reply, re.DOTALL)
+    text = match.group(1) if match else reply
+    start, end = text.find('['), text.rfind(']')
+    if start < 0 or end < start:
+        raise ValueError("No JSON list in reply")
+    items = json.loads(text[start:end + 1])
+
+    wanted = set(sub_images)
+    pairs = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        sub_image = os.path.basename(str(item.get('sub_image', '')).strip())
+        question, answer = str(item.get('question', '')).strip(), str(item.get('answer', '')).strip()
+        if sub_image in wanted and question and answer:
+            pairs.setdefault(sub_image, []).append({'question': question, 'answer': answer,
+                                                    'level': str(item.get('level', '')).strip()})
+    return pairs
+
+
+def to_llava(sub_image, group, pairs, model):
+    """
+    One LLaVA training record: a multi-turn conversation about `sub_image`, the image token
+    in the first question.
+    """
+    tem_type = dict(group['subs'])[sub_image]
+    conversations = []
+    for i, pair in enumerate(pairs):
+        conversations.append({'from': 'human', 'value': ('<image>\n' if i == 0 else '') + pair['question']})
+        conversations.append({'from': 'gpt', 'value': pair['answer']})
+    return {'id': os.path.splitext(sub_image)[0], 'image': sub_image, 'conversations': conversations,
+            'levels': [pair['level'] for pair in pairs], 'parent_image': group['parent_image'],
+            'TEM_type': tem_type, 'model': model}
+
+
+def done_parents(output_path):
+    """
+    Parent images already in the JSONL checkpoint. A line torn by a crash is cut off,
+    so appending continues on a clean line.
+    """
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+            data = data[:data.rfind(b'\n') + 1]
+    return {json.loads(line)['parent_image'] for line in data.decode('utf-8').splitlines() if line.strip()}
+
+
+# === Response cache ===
+class ResponseCache:
+    """
+    SQLite cache of model replies (see `cache_key`). Only replies that parsed are stored,
+    so a malformed reply is asked again on the next run.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.DISTILL_CACHE_PATH
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                reply TEXT NOT NULL,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                created REAL NOT NULL
+            )
+        ''')
+        self.conn.commit()
+
+    def get(self, key):
+        """Return the cached reply text or None."""
+        row = self.conn.execute('SELECT reply FROM responses WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, model, reply, usage=None):
+        usage = usage or {}
+        self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                          (key, model, reply, usage.get('prompt_tokens'), usage.get('completion_tokens'), time.time()))
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# === Rate limits ===
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budgets as token buckets shared by all
+    requests of one event loop. Callers are served in arrival order, so a large request
+    is not starved by small ones.
+
+    Args:
+        rpm (int or None): Requests per minute (None: unlimited)
+        tpm (int or None): Tokens per minute, input + output (None: unlimited)
+    """
+
+    def __init__(self, rpm=None, tpm=None):
+        self.limits = {name: limit for name, limit in (('requests', rpm), ('tokens', tpm)) if limit}
+        self.levels = {name: float(limit) for name, limit in self.limits.items()}
+        self.updated = time.monotonic()
+        self.waited = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        for name, limit in self.limits.items():
+            self.levels[name] = min(limit, self.levels[name] + (now - self.updated) * limit / 60)
+        self.updated = now
+
+    async def acquire(self, tokens):
+        """Wait until one request using `tokens` (estimated) fits in both budgets, then take it."""
+        async with self._lock:
+            while True:
+                self._refill()
+                # A request above the per-minute budget only needs a full bucket
+                need = {'requests': 1, 'tokens': min(tokens, self.limits.get('tokens', tokens))}
+                delay = max([(need[name] - self.levels[name]) * 60 / limit
+                             for name, limit in self.limits.items()] + [0])
+                if delay <= 0:
+                    for name in self.limits:
+                        self.levels[name] -= need[name]
+                    return
+                self.waited += delay
+                await asyncio.sleep(delay)
+
+    def adjust(self, tokens):
+        """Charge (positive) or refund (negative) the difference between actual and estimated tokens."""
+        if 'tokens' in self.limits:
+            self._refill()
+            self.levels['tokens'] = min(self.limits['tokens'], self.levels['tokens'] - tokens)
+
+
+# === Driver ===
+async def _distill(packs, load_image, output_path, cache, client, model, limiter, concurrency, system_prompt,
+                   detail, max_tokens, temperature, summary):
+    template = template_hash(system_prompt)
+    params = {'temperature': temperature, 'max_tokens': max_tokens, 'detail': detail}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    with open(output_path, 'a', encoding='utf-8') as out:
+        async def run_pack(pack):
+            names = [group['parent_image'] for group in pack]
+            # Reading and base64-encoding the images stays off the event loop
+            request = await asyncio.to_thread(build_request, pack, load_image, system_prompt, detail)
+            if request is None:
+                summary['skipped'] += len(pack)
+                return
+            key = cache_key(model, request, template, params)
+            reply = cache.get(key)
+            fresh = reply is None
+            usage = None
+            if not fresh:
+                summary['cached'] += 1
+            else:
+                async with semaphore:
+                    estimate = request['tokens'] + max_tokens
+                    await limiter.acquire(estimate)
+                    try:
+                        response = await client.chat.completions.create(
+                            model=model, messages=request['messages'], temperature=temperature, max_tokens=max_tokens)
+                    except Exception as e:
+                        limiter.adjust(-estimate)
+                        logging.error(f"Request for {', '.join(names)} failed: {e}")
+                        summary['failed'].extend(names)
+                        return
+                reply = (response.choices[0].message.content or '').strip()
+                if response.usage is not None:
+                    usage = {'prompt_tokens': response.usage.prompt_tokens,
+                             'completion_tokens': response.usage.completion_tokens}
+                    limiter.adjust(response.usage.total_tokens - estimate)
+                    summary['prompt_tokens'] += usage['prompt_tokens']
+                    summary['completion_tokens'] += usage['completion_tokens']
+                summary['requests'] += 1
+
+            try:
+                pairs = parse_reply(reply, request['sub_images'])
+            except ValueError as e:
+                logging.error(f"Unusable reply for {', '.join(names)}: {e}")
+                summary['failed'].extend(names)
+                return
+            if fresh:
+                cache.put(key, model, reply, usage)
+
+            records = [to_llava(sub, request['sub_images'][sub], sub_pairs, model) for sub, sub_pairs in pairs.items()]
+            # One write per request: a crash loses at most the request in progress
+            out.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+            out.flush()
+            summary['figures'] += len({group['parent_image'] for group in request['sub_images'].values()})
+            summary['records'] += len(records)
+            summary['pairs'] += sum(map(len, pairs.values()))
+            logging.info(f"Distilled {', '.join(names)}: {sum(map(len, pairs.values()))} QA pairs")
+
+        async def run_pack_safe(pack):
+            # An unreadable image, a cache error or a malformed response fails the pack's figures, not the run
+            try:
+                await run_pack(pack)
+            except Exception as e:
+                names = [group['parent_image'] for group in pack]
+                logging.error(f"Distilling {', '.join(names)} failed: {type(e).__name__}: {e}")
+                summary['failed'].extend(names)
+
+        # Bounded number of pending tasks, so huge inputs do not hold every request in memory
+        pending = set()
+        for pack in packs:
+            if len(pending) >= 4 * concurrency:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            pending.add(asyncio.create_task(run_pack_safe(pack)))
+        if pending:
+            await asyncio.wait(pending)
+
+
+def distill(output_path=None, csv_path=None, caption_csv_path=None, model=None, base_url=None, api_key=None,
+            rpm=None, tpm=None, concurrency=8, max_images=6, cache_path=None, system_prompt=SYSTEM_PROMPT,
+            detail='auto', max_tokens=4096, temperature=0.7, limit=None, output_mode=None, shard_path=None,
+            max_retries=5, timeout=600):
+    """
+    Generate LLaVA VQA records for every extracted figure not yet in `output_path`.
+
+    Args:
+        output_path (str or None): LLaVA JSONL checkpoint, appended to (default: config.DISTILL_OUTPUT_PATH)
+        csv_path (str or None): Pipeline metadata CSV (default: config.CSV_PATH)
+        caption_csv_path (str or None): Caption CSV (default: config.CAPTION_TEXT_PATH)
+        model (str or None): Chat model (default: config.DISTILL_MODEL)
+        base_url (str or None): OpenAI-compatible endpoint, e.g. a local stand-in (default: OpenAI)
+        api_key (str or None): API key (default: $OPENAI_API_KEY; a placeholder with `base_url`)
+        rpm (int or None): Requests-per-minute budget
+        tpm (int or None): Tokens-per-minute budget
+        concurrency (int): Requests in flight
+        max_images (int): Images per request when packing figures (1: one figure per request)
+        cache_path (str or None): Response cache (default: config.DISTILL_CACHE_PATH)
+        system_prompt (str): System message (part of the cache key)
+        detail (str): Image detail ('low', 'high' or 'auto')
+        max_tokens (int): Output tokens per request (reserved from the token budget until the reply arrives)
+        temperature (float): Sampling temperature
+        limit (int or None): Only process the first `limit` pending figures
+        output_mode (str or None): Where the pipeline wrote the images, 'files' or 'shards' (default: config.OUTPUT_MODE)
+        shard_path (str or None): Shard directory (default: config.SHARD_PATH)
+        max_retries (int): Client retries of a failed request (429 and 5xx, honoring Retry-After)
+        timeout (float): Seconds per request
+
+    Returns:
+        dict: 'figures', 'records', 'pairs', 'requests' (sent to the API), 'cached' (answered from
+            the cache), 'skipped' (figures without images), 'failed' (parent images to retry),
+            'prompt_tokens', 'completion_tokens', 'rate_limit_wait' (seconds) and 'seconds'
+    """
+    from openai import AsyncOpenAI
+
+    output_path = output_path or config.DISTILL_OUTPUT_PATH
+    model = model or config.DISTILL_MODEL
+    done = done_parents(output_path)
+    groups = [group for group in load_groups(csv_path, caption_csv_path) if group['parent_image'] not in done]
+    groups = groups[:limit]
+    packs = pack_requests(groups, max_images)
+    logging.info(f"Distilling {len(groups)} figures in {len(packs)} requests ({len(done)} already done)")
+
+    summary = {'figures': 0, 'records': 0, 'pairs': 0, 'requests': 0, 'cached': 0, 'skipped': 0, 'failed': [],
+               'prompt_tokens': 0, 'completion_tokens': 0, 'rate_limit_wait': 0.0, 'seconds': 0.0}
+    if api_key is None:
+        api_key = os.environ.get('OPENAI_API_KEY') or ('not-needed' if base_url else None)
+
+    async def main(cache):
+        client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries, timeout=timeout)
+        limiter = RateLimiter(rpm, tpm)
+        try:
+            await _distill(packs, image_loader(output_mode, shard_path), output_path, cache, client, model, limiter,
+                           concurrency, system_prompt, detail, max_tokens, temperature, summary)
+        finally:
+            summary['rate_limit_wait'] = limiter.waited
+            await client.close()
+
+    start = time.perf_counter()
+    with ResponseCache(cache_path) as cache:
+        asyncio.run(main(cache))
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+# === Local stand-in server ===
+class _StandInHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path.rstrip('/') not in ('/v1/chat/completions', '/chat/completions'):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        server = self.server
+        if not server.allow():
+            self._send(429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit_error',
+                                       'code': 'rate_limit_exceeded'}}, {'Retry-After': '1'})
+            return
+        if server.latency:
+            time.sleep(server.latency)
+
+        parts = [part for message in body['messages'] for part in
+                 (message['content'] if isinstance(message['content'], list) else [{'type': 'text', 'text': message['content']}])]
+        text = '\n'.join(part['text'] for part in parts if part.get('type') == 'text')
+        images = sum(part.get('type') == 'image_url' for part in parts)
+        reply = json.dumps(stand_in_reply(text), indent=1)
+        prompt_tokens = len(text) // 4 + 85 * images
+        completion_tokens = len(reply) // 4
+        self._send(200, {
+            'id': f"chatcmpl-standin-{next(server.ids)}", 'object': 'chat.completion', 'created': int(time.time()),
+            'model': body.get('model', 'stand-in'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': reply}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens}})
+
+    def _send(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def stand_in_reply(text):
+    """Deterministic QA pairs for every 'Sub-image: <name> (predicted TEM type: <type>)' line of a prompt."""
+    pairs = []
+    for sub_image, tem_type in re.findall(r'Sub-image: (\S+) \(predicted TEM type: ([^)]*)\)', text):
+        pairs += [
+            {'sub_image': sub_image, 'question': 'What imaging modality was used to acquire this image?',
+             'answer': f"The image was acquired in {tem_type} mode.", 'level': 'classification'},
+            {'sub_image': sub_image, 'question': 'Describe the main features visible in this image.',
+             'answer': f"The {tem_type} image shows the microstructure of the sample.", 'level': 'description'},
+        ]
+    return pairs
+
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    """
+    OpenAI-compatible /v1/chat/completions endpoint with deterministic replies (`stand_in_reply`).
+
+    Args:
+        port (int): Port (0 picks a free one)
+        host (str): Interface
+        latency (float): Seconds each reply is delayed
+        rpm (int or None): Requests per minute before answering 429 with Retry-After
+    """
+    daemon_threads = True
+
+    def __init__(self, port=8011, host='127.0.0.1', latency=0.0, rpm=None):
+        super().__init__((host, port), _StandInHandler)
+        self.latency = latency
+        self.rpm = rpm
+        self.ids = itertools.count(1)
+        self.calls = 0
+        self.rejected = 0
+        self._window = []
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            now = time.monotonic()
+            self._window = [t for t in self._window if now - t < 60]
+            if self.rpm and len(self._window) >= self.rpm:
+                self.rejected += 1
+                return False
+            self._window.append(now)
+            self.calls += 1
+            return True
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/v1"
+
+    def start(self):
+        """Serve from a daemon thread; returns self."""
+        threading.Thread(target=self.serve_forever, name='stand-in-server', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+# === Command line ===
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Distill VQA pairs for the extracted TEM images')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Distill figures not yet in the output JSONL')
+    run_parser.add_argument('--out', default=None, help='LLaVA JSONL output (default: config.DISTILL_OUTPUT_PATH)')
+    run_parser.add_argument('--csv', default=None, help='Pipeline metadata CSV (default: config.CSV_PATH)')
+    run_parser.add_argument('--caption-csv', default=None, help='Caption CSV (default: config.CAPTION_TEXT_PATH)')
+    run_parser.add_argument('--model', default=None, help='Chat model (default: config.DISTILL_MODEL)')
+    run_parser.add_argument('--base-url', default=None, help='OpenAI-compatible endpoint, e.g. a local stand-in server')
+    run_parser.add_argument('--rpm', type=int, default=None, help='Requests per minute (default: unlimited)')
+    run_parser.add_argument('--tpm', type=int, default=None, help='Tokens per minute (default: unlimited)')
+    run_parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight (default: 8)')
+    run_parser.add_argument('--max-images', type=int, default=6,
+                            help='Images per request when packing small figures, 1 = one figure per request (default: 6)')
+    run_parser.add_argument('--cache', default=None, help='Response cache (default: config.DISTILL_CACHE_PATH)')
+    run_parser.add_argument('--system-prompt', default=None, help='File with the system prompt (default: built-in)')
+    run_parser.add_argument('--detail', choices=('low', 'high', 'auto'), default='auto', help='Image detail (default: auto)')
+    run_parser.add_argument('--max-tokens', type=int, default=4096, help='Output tokens per request (default: 4096)')
+    run_parser.add_argument('--temperature', type=float, default=0.7, help='Sampling temperature (default: 0.7)')
+    run_parser.add_argument('--limit', type=int, default=None, help='Only the first N pending figures')
+    run_parser.add_argument('--output-mode', choices=('files', 'shards'), default=None,
+                            help='Where the pipeline wrote the images (default: config.OUTPUT_MODE)')
+    run_parser.add_argument('--shard-dir', default=None, help='Shard directory (default: config.SHARD_PATH)')
+
+    stand_in_parser = subparsers.add_parser('stand-in', help='Serve a local OpenAI-compatible stand-in')
+    stand_in_parser.add_argument('--port', type=int, default=8011, help='Port (default: 8011)')
+    stand_in_parser.add_argument('--latency', type=float, default=0.0, help='Seconds per reply (default: 0)')
+    stand_in_parser.add_argument('--rpm', type=int, default=None, help='Answer 429 above this many requests per minute')
+    return parser.parse_args()
+
+
+def main():
+    """Main program entry point"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_arguments()
+    if args.command == 'stand-in':
+        server = StandInServer(args.port, latency=args.latency, rpm=args.rpm)
+        print(f"[✓] Stand-in server at {server.url} (Ctrl+C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    system_prompt = SYSTEM_PROMPT
+    if args.system_prompt:
+        with open(args.system_prompt, encoding='utf-8') as f:
+            system_prompt = f.read().strip()
+    summary = distill(
+        output_path=args.out,
+        csv_path=args.csv,
+        caption_csv_path=args.caption_csv,
+        model=args.model,
+        base_url=args.base_url,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        concurrency=args.concurrency,
+        max_images=args.max_images,
+        cache_path=args.cache,
+        system_prompt=system_prompt,
+        detail=args.detail,
+        max_tokens=args.max_tokens,
+        temperature=args.temperature,
+        limit=args.limit,
+        output_mode=args.output_mode,
+        shard_path=args.shard_dir
+    )
+    logging.info(f"Done: {summary['figures']} figures, {summary['records']} records, {summary['pairs']} QA pairs "
+                 f"in {summary['seconds']:.1f}s; {summary['requests']} API requests, {summary['cached']} from cache, "
+                 f"{len(summary['failed'])} failed, {summary['skipped']} without images")
+    logging.info(f"Tokens: {summary['prompt_tokens']} prompt, {summary['completion_tokens']} completion; "
+                 f"{summary['rate_limit_wait']:.1f}s waiting for rate limits")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,787 @@
+"""
+Scoring of model predictions against reference answers (docs/Model Evaluation.md).
+
+Per sample, as in `scripts/evaluation.ipynb`:
+
+    BLEU     = 0.4 BLEU-1 + 0.3 BLEU-2 + 0.2 BLEU-3 + 0.1 BLEU-4   (smoothed n-gram precisions)
+    ROUGE    = (ROUGE-1 + ROUGE-2 + (ROUGE-L + ROUGE-Lsum) / 2) / 3   (F-measures)
+    lexical  = 0.3 ROUGE + 0.2 BLEU + 0.5 METEOR
+    semantic = (BERTScore F1 + SBERT cosine) / 2
+    final    = 0.5 lexical + 0.5 semantic
+
+The lexical metrics reproduce the libraries behind `evaluate` ('bleu': 13a
+tokenizer and smoothed precisions; 'rouge': rouge_score without stemming;
+'meteor': NLTK) without their per-call overhead:
+
+- References are tokenized once per run and shared by every prediction file.
+- Tokens are mapped to int32 ids; n-gram matches of a whole chunk of samples
+  are counted with one `np.unique` per order instead of a Counter per sample.
+- ROUGE-L uses a bit-parallel LCS; METEOR memoizes stems and WordNet synonyms.
+- Chunks of every prediction file are scored in a process pool.
+
+BERTScore token embeddings and SBERT sentence embeddings are cached in SQLite
+by model and text, so evaluating a new checkpoint against the same references
+only embeds its predictions.
+
+Run from the `src` directory:
+
+    python -m project_function.evaluation pretrain_val_predict.csv finetune_val_predict.csv --workers 8
+"""
+import argparse
+import functools
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sqlite3
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from project_function import config
+
+BLEU_WEIGHTS = (0.4, 0.3, 0.2, 0.1)
+LEXICAL_WEIGHTS = {'rouge': 0.3, 'bleu': 0.2, 'meteor': 0.5}
+METEOR_PARAMS = {'alpha': 0.9, 'beta': 3.0, 'gamma': 0.5}
+# Notebook column names of the per-sample scores
+SCORE_COLUMNS = ('bleu_scores', 'rouge_scores', 'meteor_scores', 'lexical_scores',
+                 'bert_scores', 'sbert_scores', 'semantic_scores', 'final_scores')
+COMPONENT_COLUMNS = ('bleu_1', 'bleu_2', 'bleu_3', 'bleu_4', 'rouge_1', 'rouge_2', 'rouge_l', 'rouge_lsum')
+
+
+# === Tokenizers ===
+# 13a rules of the `evaluate` BLEU tokenizer (copied from sacrebleu)
+_13A_RULES = [
+    (re.compile(r"([\{-\~\[-\` -\&\(-\+\:-\@\/])"), r" \1 "),   # Punctuation and symbols
+    (re.compile(r"([^0-9])([\.,])"), r"\1 \2 "),                 # Period and comma unless preceded by a digit
+    (re.compile(r"([\.,])([^0-9])"), r" \1 \2"),                 # ... unless followed by a digit
+    (re.compile(r"([0-9])(-)"), r"\1 \2 "),                      # Dash preceded by a digit
+]
+
+
+def tokenize_13a(line):
+    """Tokens of `line` as seen by `evaluate.load('bleu')` (13a tokenizer, case kept)."""
+    line = line.replace('<skipped>', '').replace('-\n', '').replace('\n', ' ')
+    if '&' in line:
+        line = line.replace('&quot;', '"').replace('&amp;', '&').replace('&lt;', '<').replace('&gt;', '>')
+    line = f" {line} "
+    for pattern, replacement in _13A_RULES:
+        line = pattern.sub(replacement, line)
+    return line.split()
+
+
+_NON_ALPHANUM = re.compile(r'[^a-z0-9]+')
+_SPACES = re.compile(r'\s+')
+_VALID_TOKEN = re.compile(r'^[a-z0-9]+$')
+
+
+def tokenize_rouge(text):
+    """Tokens of `text` as seen by rouge_score's default tokenizer (lowercase alphanumeric runs, no stemming)."""
+    tokens = _SPACES.split(_NON_ALPHANUM.sub(' ', text.lower()))
+    return [token for token in tokens if _VALID_TOKEN.match(token)]
+
+
+def rouge_sentences(text):
+    """Per-sentence ROUGE tokens for ROUGE-Lsum (sentences are lines, empty lines dropped)."""
+    return [tokenize_rouge(sentence) for sentence in text.split('\n') if len(sentence)]
+
+
+def _nltk_resources():
+    """Download the NLTK data METEOR needs (as `evaluate.load('meteor')` does) if it is missing."""
+    import nltk
+
+    punkt = 'punkt_tab' if tuple(map(int, re.findall(r'\d+', nltk.__version__)[:2])) >= (3, 9) else 'punkt'
+    for path, name in (('corpora/wordnet', 'wordnet'), (f'tokenizers/{punkt}', punkt), ('corpora/omw-1.4', 'omw-1.4')):
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            nltk.download(name, quiet=True)
+
+
+def tokenize_meteor(text):
+    """Lowercased `nltk.word_tokenize` tokens (METEOR's input after its `str.lower` preprocessing)."""
+    from nltk import word_tokenize
+
+    return tuple(token.lower() for token in word_tokenize(text))
+
+
+# === Compact n-gram statistics ===
+class Vocabulary:
+    """Token → int32 id map; unseen tokens get the next id."""
+
+    def __init__(self):
+        self.ids = {}
+
+    def encode(self, tokens):
+        ids = self.ids
+        return np.fromiter((ids.setdefault(token, len(ids)) for token in tokens), dtype=np.int32, count=len(tokens))
+
+
+def ngram_overlaps(predictions, references, orders):
+    """
+    Clipped n-gram matches of many (prediction, reference) pairs at once.
+
+    Predictions and references are concatenated into one id array. N-gram ids are built
+    order by order: an n-gram is (id of its first n-1 tokens, last token), numbered with one
+    `np.unique` over int64 keys. Each (sample, n-gram) pair is then a single int64 key, whose
+    counts on the two sides are intersected for all samples together.
+
+    Args:
+        predictions (List[np.ndarray]): Token ids per sample
+        references (List[np.ndarray]): Token ids per sample (same vocabulary)
+        orders (Iterable[int]): N-gram orders
+
+    Returns:
+        dict: {n: (matches, prediction n-grams, reference n-grams)}, int64 arrays with one value per sample
+    """
+    orders = set(orders)
+    count = len(predictions)
+    sequences = list(predictions) + list(references)
+    lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+    flat = np.concatenate(sequences).astype(np.int64) if sequences else np.empty(0, dtype=np.int64)
+    owner = np.repeat(np.arange(len(sequences)), lengths)
+    # Tokens from every position to the end of its sequence
+    remaining = np.repeat(np.cumsum(lengths), lengths) - np.arange(len(flat))
+    vocab = int(flat.max()) + 1 if len(flat) else 1
+
+    result = {}
+    positions = np.arange(len(flat))   # Start of every n-gram of the current order
+    grams = flat                       # Id of every such n-gram
+    for n in range(1, max(orders) + 1):
+        if n > 1:
+            keep = remaining[positions] >= n
+            positions = positions[keep]
+            grams = np.unique(grams[keep] * vocab + flat[positions + n - 1], return_inverse=True)[1].ravel()
+        if n not in orders:
+            continue
+        num_grams = int(grams.max()) + 1 if len(grams) else 1
+        keys = (owner[positions] % max(count, 1)) * num_grams + grams
+        is_prediction = owner[positions] < count
+        pred_keys, pred_counts = np.unique(keys[is_prediction], return_counts=True)
+        ref_keys, ref_counts = np.unique(keys[~is_prediction], return_counts=True)
+        common, pred_index, ref_index = np.intersect1d(pred_keys, ref_keys, assume_unique=True, return_indices=True)
+        matches = np.bincount(common // num_grams, weights=np.minimum(pred_counts[pred_index], ref_counts[ref_index]),
+                              minlength=count).astype(np.int64)
+        result[n] = (matches, np.maximum(lengths[:count] - n + 1, 0), np.maximum(lengths[count:] - n + 1, 0))
+    return result
+
+
+def _fmeasure(precision, recall):
+    """rouge_score's F1, elementwise (0 where precision + recall is 0)."""
+    total = precision + recall
+    return np.divide(2 * precision * recall, total, out=np.zeros_like(total), where=total > 0)
+
+
+# === Longest common subsequence ===
+def lcs_length(a, b):
+    """Length of the longest common subsequence of two token sequences (bit-parallel, one big-int pass over `a`)."""
+    if not len(a) or not len(b):
+        return 0
+    masks = {}
+    for j, token in enumerate(b):
+        masks[token] = masks.get(token, 0) | (1 << j)
+    full = (1 << len(b)) - 1
+    v = full
+    for token in a:
+        u = v & masks.get(token, 0)
+        v = ((v + u) | (v - u)) & full
+    return len(b) - v.bit_count()
+
+
+def _lcs_indices(ref, can):
+    """Indices into `ref` of rouge_score's LCS of `ref` and `can` (same DP table and backtracking)."""
+    rows, cols = len(ref), len(can)
+    table = [[0] * (cols + 1) for _ in range(rows + 1)]
+    for i in range(1, rows + 1):
+        for j in range(1, cols + 1):
+            table[i][j] = table[i - 1][j - 1] + 1 if ref[i - 1] == can[j - 1] else max(table[i - 1][j], table[i][j - 1])
+    i, j, indices = rows, cols, []
+    while i > 0 and j > 0:
+        if can[j - 1] == ref[i - 1]:
+            indices.insert(0, i - 1)
+            i -= 1
+            j -= 1
+        elif table[i][j - 1] > table[i - 1][j]:
+            j -= 1
+        else:
+            i -= 1
+    return indices
+
+
+def summary_lcs(ref_sentences, can_sentences):
+    """rouge_score's summary-level (union) LCS: returns (hits, reference tokens, candidate tokens)."""
+    m = sum(map(len, ref_sentences))
+    n = sum(map(len, can_sentences))
+    if not ref_sentences or not can_sentences or not m or not n:
+        return 0, m, n
+    ref_counts, can_counts = defaultdict(int), defaultdict(int)
+    for sentence in ref_sentences:
+        for token in sentence:
+            ref_counts[token] += 1
+    for sentence in can_sentences:
+        for token in sentence:
+            can_counts[token] += 1
+    hits = 0
+    for ref in ref_sentences:
+        union = sorted(set().union(*[_lcs_indices(ref, can) for can in can_sentences]))
+        for token in (ref[i] for i in union):
+            if can_counts[token] > 0 and ref_counts[token] > 0:
+                hits += 1
+                can_counts[token] -= 1
+                ref_counts[token] -= 1
+    return hits, m, n
+
+
+# === METEOR (NLTK's single_meteor_score with memoized stems and synonyms) ===
+@functools.lru_cache(maxsize=1)
+def _stemmer():
+    from nltk.stem.porter import PorterStemmer
+
+    return PorterStemmer()
+
+
+@functools.lru_cache(maxsize=1)
+def _wordnet():
+    from nltk.corpus import wordnet
+
+    return wordnet
+
+
+@functools.lru_cache(maxsize=1 << 18)
+def _stem(word):
+    return _stemmer().stem(word)
+
+
+@functools.lru_cache(maxsize=1 << 18)
+def _synonyms(word):
+    lemmas = itertools.chain.from_iterable(
+        (lemma.name() for lemma in synset.lemmas() if lemma.name().find('_') < 0) for synset in _wordnet().synsets(word))
+    return frozenset(lemmas) | {word}
+
+
+def _match_equal(hypothesis, reference):
+    """
+    NLTK `_match_enums`: every hypothesis word, last first, takes the last still unmatched
+    equal reference word. Lists hold (original index, word).
+    """
+    positions = defaultdict(list)
+    for j, (_, word) in enumerate(reference):
+        positions[word].append(j)
+    matches, used_h, used_r = [], set(), set()
+    for i in range(len(hypothesis) - 1, -1, -1):
+        candidates = positions.get(hypothesis[i][1])
+        if candidates:
+            j = candidates.pop()
+            matches.append((hypothesis[i][0], reference[j][0]))
+            used_h.add(i)
+            used_r.add(j)
+    return (matches, [pair for i, pair in enumerate(hypothesis) if i not in used_h],
+            [pair for j, pair in enumerate(reference) if j not in used_r])
+
+
+def _match_synonyms(hypothesis, reference):
+    """NLTK `_enum_wordnetsyn_match`: like `_match_equal`, with a reference word matching any WordNet synonym."""
+    matches = []
+    hypothesis, reference = list(hypothesis), list(reference)
+    for i in range(len(hypothesis) - 1, -1, -1):
+        synonyms = _synonyms(hypothesis[i][1])
+        for j in range(len(reference) - 1, -1, -1):
+            if reference[j][1] in synonyms:
+                matches.append((hypothesis[i][0], reference[j][0]))
+                hypothesis.pop(i)
+                reference.pop(j)
+                break
+    return matches, hypothesis, reference
+
+
+def meteor(reference, hypothesis, alpha=0.9, beta=3.0, gamma=0.5):
+    """
+    METEOR of one pair, equal to `nltk.translate.meteor_score.single_meteor_score`
+    (exact, then Porter stem, then WordNet synonym matching; fragmentation penalty).
+
+    Args:
+        reference (Sequence[str]): Lowercased reference tokens (`tokenize_meteor`)
+        hypothesis (Sequence[str]): Lowercased prediction tokens
+    """
+    hypothesis_pairs = list(enumerate(hypothesis))
+    reference_pairs = list(enumerate(reference))
+    exact, hypothesis_pairs, reference_pairs = _match_equal(hypothesis_pairs, reference_pairs)
+    # As in NLTK, the words left after stem matching stay stemmed for the synonym stage
+    stem, hypothesis_pairs, reference_pairs = _match_equal([(i, _stem(w)) for i, w in hypothesis_pairs],
+                                                           [(j, _stem(w)) for j, w in reference_pairs])
+    synonym, _, _ = _match_synonyms(hypothesis_pairs, reference_pairs)
+    matches = sorted(exact + stem + synonym, key=lambda pair: pair[0])
+
+    if not matches or not hypothesis or not reference:
+        return 0.0
+    precision = len(matches) / len(hypothesis)
+    recall = len(matches) / len(reference)
+    fmean = (precision * recall) / (alpha * precision + (1 - alpha) * recall)
+    chunks = 1
+    for (h1, r1), (h2, r2) in zip(matches, matches[1:]):
+        if not (h2 == h1 + 1 and r2 == r1 + 1):
+            chunks += 1
+    penalty = gamma * (chunks / len(matches)) ** beta
+    return (1 - penalty) * fmean
+
+
+# === References, tokenized once per run ===
+class ReferenceSet:
+    """
+    Unique reference answers with all their lexical tokenizations, shared by every
+    prediction file of a run (and sent once to each worker process).
+
+    Args:
+        texts (Iterable[str]): Reference answers (duplicates are stored once)
+    """
+
+    def __init__(self, texts):
+        _nltk_resources()
+        self.texts = list(dict.fromkeys(texts))
+        self.positions = {text: i for i, text in enumerate(self.texts)}
+        self.bleu_vocab = Vocabulary()
+        self.rouge_vocab = Vocabulary()
+        self.bleu = [self.bleu_vocab.encode(tokenize_13a(text)) for text in self.texts]
+        self.rouge = [self.rouge_vocab.encode(tokenize_rouge(text)) for text in self.texts]
+        # Sentence tokens only where ROUGE-Lsum differs from ROUGE-L (several non-empty lines)
+        self.sentences = [_multi_sentence(text) for text in self.texts]
+        self.meteor = [tokenize_meteor(text) for text in self.texts]
+
+    def __len__(self):
+        return len(self.texts)
+
+    def index(self, texts):
+        """Positions of `texts` in the set (int64 array)."""
+        return np.fromiter((self.positions[text] for text in texts), dtype=np.int64, count=len(texts))
+
+
+def _multi_sentence(text):
+    sentences = rouge_sentences(text) if '\n' in text else []
+    return sentences if sum(1 for sentence in sentences if sentence) > 1 else None
+
+
+# === Lexical scores ===
+def score_lexical(predictions, reference_index, references):
+    """
+    Lexical metrics of predictions against their references.
+
+    A sample whose prediction or reference has no BLEU tokens scores 0 on every lexical
+    metric (`evaluate`'s BLEU raises a ZeroDivisionError on it, which the notebook caught).
+
+    Args:
+        predictions (List[str]): Predicted answers
+        reference_index (np.ndarray): Position in `references` of each sample's reference
+        references (ReferenceSet): Tokenized references
+
+    Returns:
+        dict: float64 arrays 'bleu_1'..'bleu_4', 'rouge_1', 'rouge_2', 'rouge_l', 'rouge_lsum',
+            'bleu', 'rouge', 'meteor' and 'lexical' (unrounded), one value per sample
+    """
+    unique = list(dict.fromkeys(predictions))
+    bleu_tokens = {text: references.bleu_vocab.encode(tokenize_13a(text)) for text in unique}
+    rouge_tokens = {text: references.rouge_vocab.encode(tokenize_rouge(text)) for text in unique}
+    meteor_tokens = {text: tokenize_meteor(text) for text in unique}
+
+    scores = {}
+    bleu_overlaps = ngram_overlaps([bleu_tokens[text] for text in predictions],
+                                   [references.bleu[i] for i in reference_index], range(1, 5))
+    for n, (matches, possible, _) in bleu_overlaps.items():
+        scores[f'bleu_{n}'] = (matches + 1.) / (possible + 1.)
+    valid = (bleu_overlaps[1][1] > 0) & (bleu_overlaps[1][2] > 0)
+
+    rouge_predictions = [rouge_tokens[text] for text in predictions]
+    rouge_references = [references.rouge[i] for i in reference_index]
+    for n, (matches, predicted, expected) in ngram_overlaps(rouge_predictions, rouge_references, (1, 2)).items():
+        scores[f'rouge_{n}'] = _fmeasure(matches / np.maximum(predicted, 1), matches / np.maximum(expected, 1))
+
+    lcs = np.fromiter((lcs_length(ref, pred) for ref, pred in zip(rouge_references, rouge_predictions)),
+                      dtype=np.int64, count=len(predictions))
+    predicted = np.fromiter(map(len, rouge_predictions), dtype=np.int64, count=len(predictions))
+    expected = np.fromiter(map(len, rouge_references), dtype=np.int64, count=len(predictions))
+    scores['rouge_l'] = _fmeasure(np.divide(lcs, predicted, out=np.zeros(len(lcs)), where=predicted > 0),
+                                  np.divide(lcs, expected, out=np.zeros(len(lcs)), where=expected > 0))
+    scores['rouge_lsum'] = scores['rouge_l'].copy()
+    for k, (text, i) in enumerate(zip(predictions, reference_index)):
+        if references.sentences[i] is not None or '\n' in text:
+            hits, m, n = summary_lcs(references.sentences[i] or rouge_sentences(references.texts[i]), rouge_sentences(text))
+            scores['rouge_lsum'][k] = _fmeasure(np.float64(hits / n if n else 0.0), np.float64(hits / m if m else 0.0))
+
+    scores['meteor'] = np.fromiter((meteor(references.meteor[i], meteor_tokens[text], **METEOR_PARAMS)
+                                    for text, i in zip(predictions, reference_index)),
+                                   dtype=np.float64, count=len(predictions))
+
+    for key in scores:
+        scores[key] = np.where(valid, scores[key], 0.0)
+    scores['bleu'] = sum(weight * scores[f'bleu_{n}'] for n, weight in enumerate(BLEU_WEIGHTS, start=1))
+    scores['rouge'] = (scores['rouge_1'] + scores['rouge_2'] + ((scores['rouge_l'] + scores['rouge_lsum']) / 2)) / 3
+    scores['lexical'] = (LEXICAL_WEIGHTS['rouge'] * scores['rouge'] + LEXICAL_WEIGHTS['bleu'] * scores['bleu']
+                         + LEXICAL_WEIGHTS['meteor'] * scores['meteor'])
+    return scores
+
+
+# One ReferenceSet per worker process
+_references = None
+
+
+def _init_worker(references):
+    global _references
+    _nltk_resources()
+    _references = references
+
+
+def _score_chunk(args):
+    predictions, reference_index = args
+    return score_lexical(predictions, reference_index, _references)
+
+
+# === Embedding cache ===
+class EmbeddingCache:
+    """
+    SQLite store of text embeddings per model: one float32 matrix per text (token
+    embeddings for BERTScore, a single row for SBERT) plus optional token weights.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.EVAL_EMBEDDING_CACHE_PATH
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                key TEXT NOT NULL,
+                rows INTEGER NOT NULL,
+                dim INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                weights BLOB,
+                PRIMARY KEY (model, key)
+            )
+        ''')
+        self.conn.commit()
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get(self, model, texts):
+        """Return {text: (matrix, weights or None)} for the cached ones among `texts`."""
+        found = {}
+        texts = list(texts)
+        for start in range(0, len(texts), 500):
+            keys = {self.key(text): text for text in texts[start:start + 500]}
+            query = (f"SELECT key, rows, dim, data, weights FROM embeddings "
+                     f"WHERE model = ? AND key IN ({', '.join('?' * len(keys))})")
+            for key, rows, dim, data, weights in self.conn.execute(query, (model, *keys)):
+                found[keys[key]] = (np.frombuffer(data, dtype=np.float32).reshape(rows, dim),
+                                    np.frombuffer(weights, dtype=np.float32) if weights is not None else None)
+        return found
+
+    def put(self, model, items):
+        """Store {text: (matrix, weights or None)}."""
+        self.conn.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?, ?)', [
+            (model, self.key(text), matrix.shape[0], matrix.shape[1], np.ascontiguousarray(matrix, np.float32).tobytes(),
+             None if weights is None else np.ascontiguousarray(weights, np.float32).tobytes())
+            for text, (matrix, weights) in items.items()])
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# === Semantic scores ===
+class SemanticScorer:
+    """
+    BERTScore F1 (no idf, no baseline rescaling, like `evaluate.load('bertscore')`) and
+    SBERT cosine similarity, with every text embedded at most once per model.
+
+    Args:
+        cache (EmbeddingCache): Persistent embeddings
+        bert_model (str or None): BERTScore model (default: config.BERTSCORE_MODEL)
+        bert_layers (int or None): BERTScore layer (default: bert_score's choice for the model)
+        sbert_model (str or None): SentenceTransformer model (default: config.SBERT_MODEL)
+        device (str or None): Torch device (default: CUDA if available)
+        batch_size (int): Texts per forward pass
+    """
+
+    def __init__(self, cache, bert_model=None, bert_layers=None, sbert_model=None, device=None, batch_size=64):
+        import torch
+
+        self.cache = cache
+        self.bert_model = bert_model or config.BERTSCORE_MODEL
+        if bert_layers is None:
+            from bert_score.utils import model2layers
+
+            bert_layers = model2layers[self.bert_model]
+        self.bert_layers = bert_layers
+        self.sbert_model = sbert_model or config.SBERT_MODEL
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.batch_size = batch_size
+        self._bert = None
+        self._sbert = None
+        self._memory = {}   # (model key, text) → embedding, for texts reused across files (references)
+
+    def _bert_key(self):
+        return f"bertscore:{self.bert_model}:{self.bert_layers}"
+
+    def _load_bert(self):
+        if self._bert is None:
+            from bert_score.utils import get_model, get_tokenizer
+
+            tokenizer = get_tokenizer(self.bert_model, use_fast=False)
+            model = get_model(self.bert_model, self.bert_layers).to(self.device)
+            # BERTScore without idf: weight 1 per token, 0 for [CLS] and [SEP]
+            idf = defaultdict(lambda: 1.0)
+            idf[tokenizer.sep_token_id] = 0
+            idf[tokenizer.cls_token_id] = 0
+            self._bert = (model, tokenizer, idf)
+        return self._bert
+
+    def _embed_bert(self, texts):
+        from bert_score.utils import get_bert_embedding
+
+        model, tokenizer, idf = self._load_bert()
+        out = {}
+        texts = sorted(texts, key=len, reverse=True)
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            embedding, mask, weights = get_bert_embedding(batch, model, tokenizer, idf, device=self.device)
+            for k, text in enumerate(batch):
+                length = int(mask[k].sum())
+                out[text] = (embedding[k, :length].float().cpu().numpy(), weights[k, :length].float().cpu().numpy())
+        return out
+
+    def _embed_sbert(self, texts):
+        if self._sbert is None:
+            from sentence_transformers import SentenceTransformer
+
+            self._sbert = SentenceTransformer(self.sbert_model, device=self.device)
+        vectors = self._sbert.encode(list(texts), batch_size=self.batch_size, convert_to_numpy=True,
+                                     show_progress_bar=False)
+        return {text: (vector[None, :].astype(np.float32), None) for text, vector in zip(texts, vectors)}
+
+    def embeddings(self, model_key, texts, embed, keep=False):
+        """Embeddings of `texts` from memory, the cache, or `embed` for the rest (which are then cached)."""
+        texts = list(dict.fromkeys(texts))
+        found = {text: self._memory[model_key, text] for text in texts if (model_key, text) in self._memory}
+        missing = [text for text in texts if text not in found]
+        found.update(self.cache.get(model_key, missing))
+        missing = [text for text in missing if text not in found]
+        if missing:
+            logging.info(f"Embedding {len(missing)} texts with {model_key}")
+            computed = embed(missing)
+            self.cache.put(model_key, computed)
+            found.update(computed)
+        if keep:
+            self._memory.update(((model_key, text), found[text]) for text in texts)
+        return found
+
+    def score(self, predictions, references):
+        """
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (BERTScore F1, SBERT cosine) per pair, float64
+        """
+        import torch
+
+        if not predictions:
+            return np.empty(0), np.empty(0)
+        bert = self._bert_key()
+        ref_bert = self.embeddings(bert, references, self._embed_bert, keep=True)
+        pred_bert = self.embeddings(bert, predictions, self._embed_bert)
+        bert_f1 = np.empty(len(predictions))
+        for start in range(0, len(predictions), self.batch_size):
+            pairs = [(pred_bert[p], ref_bert[r]) for p, r in
+                     zip(predictions[start:start + self.batch_size], references[start:start + self.batch_size])]
+            bert_f1[start:start + len(pairs)] = _greedy_cos_f1(pairs, self.device).astype(np.float64)
+
+        sbert = f"sbert:{self.sbert_model}"
+        ref_sbert = self.embeddings(sbert, references, self._embed_sbert, keep=True)
+        pred_sbert = self.embeddings(sbert, predictions, self._embed_sbert)
+        a = torch.nn.functional.normalize(torch.from_numpy(np.concatenate([pred_sbert[p][0] for p in predictions])), p=2, dim=1)
+        b = torch.nn.functional.normalize(torch.from_numpy(np.concatenate([ref_sbert[r][0] for r in references])), p=2, dim=1)
+        cosine = (a * b).sum(dim=1).numpy().astype(np.float64)
+        return bert_f1, cosine
+
+
+def _greedy_cos_f1(pairs, device):
+    """
+    bert_score's `greedy_cos_idf` F1 for a batch of (prediction, reference) token embeddings,
+    computed as if each pair were scored alone (padding never takes part in the maxima).
+    """
+    import torch
+
+    def pad(items):
+        length = max(matrix.shape[0] for matrix, _ in items)
+        embedding = torch.zeros(len(items), length, items[0][0].shape[1])
+        weights = torch.zeros(len(items), length)
+        mask = torch.zeros(len(items), length, dtype=torch.bool)
+        for k, (matrix, weight) in enumerate(items):
+            embedding[k, :len(matrix)] = torch.from_numpy(matrix)
+            weights[k, :len(matrix)] = torch.from_numpy(weight)
+            mask[k, :len(matrix)] = True
+        embedding = embedding.to(device)
+        embedding = embedding / torch.norm(embedding, dim=-1, keepdim=True).clamp_min(1e-12)
+        return embedding, weights.to(device), mask.to(device)
+
+    hyp, hyp_weights, hyp_mask = pad([hyp for hyp, _ in pairs])
+    ref, ref_weights, ref_mask = pad([ref for _, ref in pairs])
+    sim = torch.bmm(hyp, ref.transpose(1, 2))
+    sim = sim.masked_fill(~(hyp_mask.unsqueeze(2) & ref_mask.unsqueeze(1)), float('-inf'))
+    word_precision = sim.max(dim=2)[0].masked_fill(~hyp_mask, 0.0)
+    word_recall = sim.max(dim=1)[0].masked_fill(~ref_mask, 0.0)
+    precision = (word_precision * hyp_weights / hyp_weights.sum(dim=1, keepdim=True)).sum(dim=1)
+    recall = (word_recall * ref_weights / ref_weights.sum(dim=1, keepdim=True)).sum(dim=1)
+    f1 = 2 * precision * recall / (precision + recall)
+    # Texts with no tokens besides [CLS] and [SEP] score 0
+    empty = (hyp_mask.sum(dim=1) == 2) | (ref_mask.sum(dim=1) == 2)
+    return f1.masked_fill(empty | torch.isnan(f1), 0.0).cpu().numpy()
+
+
+# === Driver ===
+def _clip_round(values):
+    """The notebook's per-sample `round(min(max(x, 0.0), 1.0), 4)`."""
+    return [round(min(max(float(value), 0.0), 1.0), 4) for value in values]
+
+
+def load_predictions(path, sample_per_type=None, seed=42):
+    """
+    Read a prediction CSV (columns 'expected' and 'predicted'; 'question' and 'type' optional).
+
+    Args:
+        sample_per_type (int or None): Evaluate `n` random rows per 'type', like the notebook's
+            `df.groupby('type').sample(n=2500, random_state=42)`
+    """
+    # Empty answers stay empty strings (and score 0) instead of becoming NaN
+    df = pd.read_csv(path, keep_default_na=False, dtype={'expected': str, 'predicted': str})
+    if sample_per_type is not None:
+        df = df.groupby('type').sample(n=sample_per_type, random_state=seed).reset_index(drop=True)
+    return df
+
+
+def scored_path(path):
+    """Output CSV of a prediction file: 'preds.csv', 'preds.CSV' or 'preds.tsv' → 'preds_scored.csv'."""
+    return os.path.splitext(path)[0] + '_scored.csv'
+
+
+def evaluate_files(paths, workers=None, chunk_size=1000, semantic=True, sample_per_type=None, cache_path=None,
+                   bert_model=None, bert_layers=None, sbert_model=None, device=None, batch_size=64, write=True):
+    """
+    Score several prediction files against their references.
+
+    Lexical chunks of all files go to a process pool first; the semantic models run
+    in this process meanwhile.
+
+    Args:
+        paths (List[str]): Prediction CSVs
+        workers (int or None): Lexical worker processes (default: CPU count)
+        chunk_size (int): Samples per lexical task
+        semantic (bool): Also compute BERTScore, SBERT, semantic and final scores
+        sample_per_type (int or None): Rows sampled per 'type' (see `load_predictions`)
+        cache_path (str or None): Embedding cache (default: config.EVAL_EMBEDDING_CACHE_PATH)
+        bert_model, bert_layers, sbert_model, device, batch_size: See `SemanticScorer`
+        write (bool): Write `<name>_scored.csv` next to every input (see `scored_path`)
+
+    Returns:
+        dict: {path: {'frame': scored DataFrame, 'summary': {'all': {column: mean}, 'by_type': {...}}}}
+    """
+    frames = [load_predictions(path, sample_per_type) for path in paths]
+    references = ReferenceSet(itertools.chain.from_iterable(df['expected'] for df in frames))
+    logging.info(f"{len(paths)} files, {sum(map(len, frames))} samples, {len(references)} unique references")
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=context,
+                             initializer=_init_worker, initargs=(references,)) as executor:
+        futures = []
+        for df in frames:
+            predictions = df['predicted'].tolist()
+            reference_index = references.index(df['expected'].tolist())
+            futures.append([executor.submit(_score_chunk, (predictions[start:start + chunk_size],
+                                                            reference_index[start:start + chunk_size]))
+                            for start in range(0, len(df), chunk_size)])
+
+        semantic_scores = {}
+        if semantic:
+            with EmbeddingCache(cache_path) as cache:
+                scorer = SemanticScorer(cache, bert_model, bert_layers, sbert_model, device, batch_size)
+                for path, df in zip(paths, frames):
+                    semantic_scores[path] = scorer.score(df['predicted'].tolist(), df['expected'].tolist())
+
+        for path, df, chunks in zip(paths, frames, futures):
+            parts = [future.result() for future in chunks]
+            lexical = {key: np.concatenate([part[key] for part in parts]) if parts else np.empty(0)
+                       for key in ('bleu', 'rouge', 'meteor', 'lexical') + COMPONENT_COLUMNS}
+            for column in COMPONENT_COLUMNS:
+                df[column] = lexical[column]
+            for column in ('bleu', 'rouge', 'meteor', 'lexical'):
+                df[f'{column}_scores'] = _clip_round(lexical[column])
+            if semantic:
+                bert_f1, cosine = semantic_scores[path]
+                df['bert_scores'] = _clip_round(bert_f1)
+                df['sbert_scores'] = _clip_round(cosine)
+                df['semantic_scores'] = _clip_round((bert_f1 + cosine) / 2)
+                df['final_scores'] = 0.5 * np.array(df['lexical_scores']) + 0.5 * np.array(df['semantic_scores'])
+            if write:
+                df.to_csv(scored_path(path), index=False)
+            results[path] = {'frame': df, 'summary': summarize(df)}
+    return results
+
+
+def summarize(df):
+    """Mean of every score column, overall and per 'type' (if present)."""
+    columns = [column for column in SCORE_COLUMNS if column in df]
+    summary = {'all': {column: float(df[column].mean()) for column in columns}, 'count': len(df)}
+    if 'type' in df:
+        summary['by_type'] = {str(name): {column: float(group[column].mean()) for column in columns}
+                              for name, group in df.groupby('type')}
+    return summary
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Lexical and semantic scores of prediction CSVs')
+    parser.add_argument('files', nargs='+', help="Prediction CSVs with 'expected' and 'predicted' columns")
+    parser.add_argument('--workers', type=int, default=None, help='Lexical worker processes (default: CPU count)')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Samples per lexical task (default: 1000)')
+    parser.add_argument('--lexical-only', action='store_true', help='Skip BERTScore, SBERT and the final score')
+    parser.add_argument('--sample-per-type', type=int, default=None, help="Score N random rows per 'type' (seed 42)")
+    parser.add_argument('--cache', default=None, help='Embedding cache (default: config.EVAL_EMBEDDING_CACHE_PATH)')
+    parser.add_argument('--bert-model', default=None, help='BERTScore model (default: config.BERTSCORE_MODEL)')
+    parser.add_argument('--bert-layers', type=int, default=None, help="BERTScore layer (default: bert_score's choice)")
+    parser.add_argument('--sbert-model', default=None, help='SentenceTransformer model (default: config.SBERT_MODEL)')
+    parser.add_argument('--device', default=None, help='Torch device for the semantic models (default: cuda if available)')
+    parser.add_argument('--batch-size', type=int, default=64, help='Texts per semantic forward pass (default: 64)')
+    parser.add_argument('--summary', default=None, help='Write the aggregate scores of all files to this JSON file')
+    return parser.parse_args()
+
+
+def main():
+    """Main program entry point"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_arguments()
+    results = evaluate_files(args.files, workers=args.workers, chunk_size=args.chunk_size,
+                             semantic=not args.lexical_only, sample_per_type=args.sample_per_type,
+                             cache_path=args.cache, bert_model=args.bert_model, bert_layers=args.bert_layers,
+                             sbert_model=args.sbert_model, device=args.device, batch_size=args.batch_size)
+    summaries = {path: result['summary'] for path, result in results.items()}
+    columns = [column for column in SCORE_COLUMNS if column in next(iter(summaries.values()))['all']]
+    print(f"{'file':<40} " + ' '.join(f"{column.replace('_scores', ''):>9}" for column in columns))
+    for path, summary in summaries.items():
+        print(f"{os.path.basename(path)[:40]:<40} " + ' '.join(f"{summary['all'][column]:>9.4f}" for column in columns))
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump(summaries, f, indent=2)
+        print(f"[✓] Summary written to {args.summary}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Background image encoding and writing.
+
+OpenCV releases the GIL while encoding, so a small thread pool encodes and
+writes crops while the caller continues with detection and classification.
+Files are written to a temporary name and renamed, so a crash never leaves a
+truncated image behind.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from project_function import config, telemetry
+
+# Format → (file extension, OpenCV flag, default quality)
+IMAGE_FORMATS = {
+    'png': ('.png', cv2.IMWRITE_PNG_COMPRESSION, 3),   # Quality = compression level 0-9
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY, 101),  # Quality > 100 = lossless
+    'jpeg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY, 95),    # Lossy, for previews
+}
+
+
+def image_extension(fmt=None):
+    """Return the file extension of `fmt` (default: config.IMAGE_FORMAT)."""
+    fmt = fmt or config.IMAGE_FORMAT
+    if fmt not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format '{fmt}', expected one of {tuple(IMAGE_FORMATS)}")
+    return IMAGE_FORMATS[fmt][0]
+
+
+def encode_image(image, fmt=None, quality=None):
+    """
+    Encode a BGR image.
+
+    Args:
+        image (np.ndarray): BGR, BGRA or grayscale image
+        fmt (str or None): 'png', 'webp' (lossless) or 'jpeg' (default: config.IMAGE_FORMAT)
+        quality (int or None): PNG compression level, WebP quality (> 100 lossless) or JPEG quality
+            (default: config.IMAGE_QUALITY, else the format default)
+
+    Returns:
+        bytes: Encoded image
+    """
+    ext = image_extension(fmt)
+    _, flag, default = IMAGE_FORMATS[fmt or config.IMAGE_FORMAT]
+    quality = quality if quality is not None else config.IMAGE_QUALITY
+    ok, encoded = cv2.imencode(ext, image, [flag, default if quality is None else quality])
+    if not ok:
+        raise ValueError(f"Could not encode image as {ext}")
+    return encoded.tobytes()
+
+
+def write_atomic(path, data):
+    """Write `data` to `path` through a temporary file in the same folder."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ImageWriter:
+    """
+    Thread pool that encodes images and hands the bytes to a file or a custom sink.
+
+    Args:
+        workers (int): Encoding threads (0: encode and write synchronously in the caller)
+        fmt (str or None): Image format (default: config.IMAGE_FORMAT)
+        quality (int or None): Format quality (default: config.IMAGE_QUALITY)
+        max_pending (int or None): Images queued at most before `save`/`submit` block
+            (default: 4 per thread); bounds the memory held by queued crops
+    """
+
+    def __init__(self, workers=4, fmt=None, quality=None, max_pending=None):
+        self.fmt = fmt or config.IMAGE_FORMAT
+        self.ext = image_extension(self.fmt)
+        self.quality = quality
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-writer') if workers else None
+        self._slots = threading.BoundedSemaphore(max_pending or max(1, 4 * workers))
+        self._sink_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._futures = set()
+        self._started = time.perf_counter()
+        self._counters = {'images': 0, 'bytes': 0, 'encode_seconds': 0.0, 'write_seconds': 0.0, 'max_pending': 0}
+
+    def _run(self, image, sink, serialize):
+        start = time.perf_counter()
+        data = encode_image(image, self.fmt, self.quality)
+        encoded = time.perf_counter()
+        if serialize:
+            with self._sink_lock:
+                sink(data)
+        else:
+            sink(data)
+        written = time.perf_counter()
+        with self._stats_lock:
+            self._counters['images'] += 1
+            self._counters['bytes'] += len(data)
+            self._counters['encode_seconds'] += encoded - start
+            self._counters['write_seconds'] += written - encoded
+        telemetry.observe('encode_seconds', encoded - start, format=self.fmt)
+        telemetry.observe('write_seconds', written - encoded)
+        telemetry.count('images_written', format=self.fmt)
+        telemetry.count('bytes_written', len(data), format=self.fmt)
+
+    def _submit(self, image, sink, serialize):
+        if self._pool is None:
+            self._run(image, sink, serialize)
+            return
+
+        self._slots.acquire()
+        future = self._pool.submit(self._run, image, sink, serialize)
+        with self._stats_lock:
+            self._futures.add(future)
+            self._counters['max_pending'] = max(self._counters['max_pending'], len(self._futures))
+
+        def done(f):
+            self._slots.release()
+            if f.exception() is None:
+                with self._stats_lock:
+                    self._futures.discard(f)
+        future.add_done_callback(done)
+
+    def save(self, path, image):
+        """Encode `image` in the background and write it atomically to `path`."""
+        self._submit(image, lambda data: write_atomic(path, data), serialize=False)
+
+    def submit(self, image, sink):
+        """
+        Encode `image` in the background and call `sink(data)`.
+        Sink calls are serialized, so a non-thread-safe sink (e.g., a tar shard) is safe.
+        """
+        self._submit(image, sink, serialize=True)
+
+    def flush(self):
+        """
+        Wait until every queued image is written.
+
+        Raises:
+            Exception: The first encoding or writing error since the last flush
+        """
+        with self._stats_lock:
+            futures = list(self._futures)
+        error = None
+        for future in futures:
+            if future.exception() is not None and error is None:
+                error = future.exception()
+        with self._stats_lock:
+            self._futures.difference_update(futures)
+        if error is not None:
+            raise error
+
+    def close(self):
+        """Flush and stop the threads."""
+        try:
+            self.flush()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+
+    def stats(self):
+        """
+        Return throughput counters: 'images', 'bytes', 'encode_seconds', 'write_seconds',
+        'max_pending' (queue high-water mark), 'images_per_second' and 'mb_per_second'
+        (since the writer was created).
+        """
+        with self._stats_lock:
+            counters = dict(self._counters)
+        elapsed = max(time.perf_counter() - self._started, 1e-9)
+        counters['images_per_second'] = counters['images'] / elapsed
+        counters['mb_per_second'] = counters['bytes'] / elapsed / 1e6
+        return counters
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
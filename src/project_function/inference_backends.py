@@ -0,0 +1,342 @@
+"""
+CPU inference backends for the five pipeline models.
+
+The backend is chosen with `config.INFERENCE_BACKEND`:
+    - 'eager':       PyTorch / ultralytics defaults
+    - 'compile':     `torch.compile` on the ResNet classifiers (YOLO stays eager)
+    - 'torchscript': traced TorchScript files from `export`
+    - 'onnx':        ONNX Runtime sessions from `export`
+
+`config.QUANTIZE_INT8` adds dynamic int8 quantization. In PyTorch (eager,
+compile, TorchScript) this covers the Linear layers only; the ONNX export is
+quantized with ONNX Runtime, which also covers the convolutions.
+
+Export and check the models from the `src` directory:
+
+    python -m project_function.inference_backends export --backend onnx --int8
+    python -m project_function.inference_backends parity --backend onnx --int8 --images path/to/sub_images
+"""
+import argparse
+import logging
+import os
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from project_function import config
+
+BACKENDS = ('eager', 'compile', 'torchscript', 'onnx')
+EXPORT_SUFFIX = {'torchscript': '.ts', 'onnx': '.onnx'}
+
+# Registry name → (config attribute of the weights, number of classes)
+CLASSIFIERS = {
+    'binary_classifier': ('BINARY_CLASSIFIER', 2),
+    'five_class_classifier': ('FIVE_CLASS_CLASSIFIER', 5),
+}
+# Registry name → config attribute of the weights
+DETECTORS = {
+    'crop': 'CROP_IMAGES',
+    'description': 'IMAGE_DESCRIPTION',
+    'tem': 'TEM_IMAGE_CROP',
+}
+
+
+def _settings(backend=None, int8=None):
+    backend = backend or config.INFERENCE_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}', expected one of {BACKENDS}")
+    return backend, config.QUANTIZE_INT8 if int8 is None else int8
+
+
+def exported_path(weights, backend, int8=False):
+    """
+    Return where `export` writes the `backend` version of `weights`.
+
+    Args:
+        weights (str): Original .pt/.pth weight file
+        backend (str): 'torchscript' or 'onnx'
+        int8 (bool): Quantized variant
+
+    Returns:
+        str: Path inside config.EXPORT_DIR (e.g., 'binary_classifier.int8.onnx')
+    """
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    return os.path.join(config.EXPORT_DIR, f"{stem}{'.int8' if int8 else ''}{EXPORT_SUFFIX[backend]}")
+
+
+def _require(path):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Exported model '{path}' not found; "
+                                f"run `python -m project_function.inference_backends export` first")
+    return path
+
+
+# === ResNet classifiers ===
+def quantize_dynamic(model):
+    """Dynamic int8 quantization of the Linear layers (weights int8, activations quantized on the fly)."""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxClassifier:
+    """
+    ONNX Runtime session with the call signature of the PyTorch classifiers
+    (N×3×224×224 tensor in, N×C logits tensor out).
+    """
+
+    def __init__(self, path):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        # Follow the per-worker torch thread pinning
+        options.intra_op_num_threads = torch.get_num_threads()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, input_tensor):
+        inputs = {self.input_name: input_tensor.detach().cpu().numpy()}
+        return torch.from_numpy(self.session.run(None, inputs)[0])
+
+
+def wrap_classifier(model, weights, device, backend=None, int8=None):
+    """
+    Return the configured backend version of an eager ResNet classifier.
+
+    Args:
+        model (torch.nn.Module): Eager model in eval mode (weights already loaded)
+        weights (str): Weight file the model was loaded from (locates exported files)
+        device (torch.device): Device the pipeline feeds inputs on
+        backend (str or None): Backend name (default: config.INFERENCE_BACKEND)
+        int8 (bool or None): Dynamic int8 quantization (default: config.QUANTIZE_INT8)
+
+    Returns:
+        Callable[[torch.Tensor], torch.Tensor]: Model returning logits
+    """
+    backend, int8 = _settings(backend, int8)
+
+    if backend in ('eager', 'compile'):
+        # Quantized kernels are CPU-only
+        if int8:
+            model = quantize_dynamic(model.cpu())
+        return torch.compile(model, dynamic=True) if backend == 'compile' else model
+
+    path = _require(exported_path(weights, backend, int8))
+    if backend == 'torchscript':
+        return torch.jit.load(path, map_location='cpu' if int8 else device).eval()
+    return OnnxClassifier(path)
+
+
+def _export_classifier(name, backend, int8):
+    from project_function import vision_crop
+
+    attr, num_classes = CLASSIFIERS[name]
+    weights = getattr(config, attr)
+    model = vision_crop._build_resnet(weights, num_classes, torch.device('cpu'))
+    example = torch.zeros(1, 3, 224, 224)
+    path = exported_path(weights, backend, int8)
+
+    if backend == 'torchscript':
+        with torch.no_grad():
+            traced = torch.jit.trace(quantize_dynamic(model) if int8 else model, example)
+        traced.save(path)
+        return path
+
+    fp32_path = exported_path(weights, backend)
+    torch.onnx.export(model, example, fp32_path, input_names=['input'], output_names=['logits'],
+                      dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}}, opset_version=17)
+    if int8:
+        _quantize_onnx(fp32_path, path)
+    return path
+
+
+# === YOLO detectors ===
+def detector_weights(weights, backend=None, int8=None):
+    """
+    Return the file ultralytics should load for `weights` under the configured backend.
+    ultralytics runs exported TorchScript and ONNX files (with embedded metadata) through `YOLO(path)`.
+
+    Args:
+        weights (str): Original .pt weight file
+        backend (str or None): Backend name (default: config.INFERENCE_BACKEND)
+        int8 (bool or None): Use the quantized ONNX export (default: config.QUANTIZE_INT8)
+
+    Returns:
+        str: Weight or exported model path
+    """
+    backend, int8 = _settings(backend, int8)
+    if backend in ('eager', 'compile'):
+        return weights
+    return _require(exported_path(weights, backend, int8 and backend == 'onnx'))
+
+
+def _export_detector(name, backend, int8):
+    from ultralytics import YOLO
+
+    weights = getattr(config, DETECTORS[name])
+    fp32_path = exported_path(weights, backend)
+    exported = YOLO(weights).export(format=backend, dynamic=backend == 'onnx')
+    os.replace(exported, fp32_path)
+
+    if not int8:
+        return fp32_path
+    if backend != 'onnx':
+        logging.warning(f"{name}: int8 YOLO export is only supported for ONNX, keeping fp32 TorchScript")
+        return fp32_path
+    path = exported_path(weights, backend, int8=True)
+    _quantize_onnx(fp32_path, path)
+    return path
+
+
+def _quantize_onnx(src, dst):
+    from onnxruntime.quantization import QuantType, quantize_dynamic as ort_quantize_dynamic
+    ort_quantize_dynamic(src, dst, weight_type=QuantType.QInt8)
+
+
+# === Export ===
+def export_all(backend, int8=False, names=None):
+    """
+    Export the given models (all five by default) for `backend` into config.EXPORT_DIR.
+
+    Args:
+        backend (str): 'torchscript' or 'onnx'
+        int8 (bool): Also apply dynamic int8 quantization
+        names (Iterable[str] or None): Registry names to export
+
+    Returns:
+        dict: {registry name: exported path}
+    """
+    if backend not in EXPORT_SUFFIX:
+        raise ValueError(f"Backend '{backend}' has nothing to export, expected one of {tuple(EXPORT_SUFFIX)}")
+
+    os.makedirs(config.EXPORT_DIR, exist_ok=True)
+    paths = {}
+    for name in (names if names is not None else [*DETECTORS, *CLASSIFIERS]):
+        export = _export_classifier if name in CLASSIFIERS else _export_detector
+        paths[name] = export(name, backend, int8)
+        print(f"[✓] Exported '{name}' → {paths[name]}")
+    return paths
+
+
+# === Parity check against eager ===
+def _load_images(image_dir):
+    names = sorted(name for name in os.listdir(image_dir)
+                   if name.lower().endswith(('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')))
+    return [image for image in (cv2.imread(os.path.join(image_dir, name)) for name in names) if image is not None]
+
+
+def _box_iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _run_models(images, backend, int8, detectors, batch_size):
+    """Run classifiers and detectors with the given backend; return outputs and ms/image per model."""
+    from project_function import vision_crop
+
+    config.INFERENCE_BACKEND, config.QUANTIZE_INT8 = backend, int8
+    vision_crop.registry.unload()
+
+    outputs, latency = {}, {}
+    vision_crop._load_classifiers()
+    vision_crop.TEM_classifier.device = vision_crop._classifier_device()
+    # One warm-up call first, so compilation and session setup are not timed
+    vision_crop.TEM_classifier_batch(images[:1], batch_size)
+    start = time.perf_counter()
+    outputs['classifier'] = [entry['label'] for entry in vision_crop.TEM_classifier_batch(images, batch_size)]
+    latency['classifier'] = 1000 * (time.perf_counter() - start) / max(len(images), 1)
+
+    for name in detectors:
+        model = vision_crop.registry.get(name)
+        vision_crop._batched_predict(model, images[:1], batch_size)
+        start = time.perf_counter()
+        results = vision_crop._batched_predict(model, images, batch_size)
+        latency[name] = 1000 * (time.perf_counter() - start) / max(len(images), 1)
+        outputs[name] = [[(tuple(box), int(cls)) for box, cls in
+                          zip(result.boxes.xyxy.tolist(), result.boxes.cls.tolist())] for result in results]
+    return outputs, latency
+
+
+def parity_check(image_dir, backend, int8=False, detectors=True, batch_size=16):
+    """
+    Compare a backend with eager PyTorch on the images in `image_dir`.
+
+    Classifier agreement is the share of images with the same final cascade
+    label. Detector agreement is the share of images where both backends find
+    the same classes, with the mean IoU of boxes matched by class.
+
+    Args:
+        image_dir (str): Validation images (sub-images for the classifiers, pages or figures for the detectors)
+        backend (str): Backend to check
+        int8 (bool): Check the quantized variant
+        detectors (bool): Also check the three YOLO models
+        batch_size (int): Batch size for both runs
+
+    Returns:
+        dict: {model: {'agreement', 'mean_iou' (detectors), 'eager_ms', 'backend_ms', 'speedup'}}
+    """
+    images = _load_images(image_dir)
+    names = list(DETECTORS) if detectors else []
+    previous = config.INFERENCE_BACKEND, config.QUANTIZE_INT8
+    try:
+        reference, reference_ms = _run_models(images, 'eager', False, names, batch_size)
+        candidate, candidate_ms = _run_models(images, backend, int8, names, batch_size)
+    finally:
+        config.INFERENCE_BACKEND, config.QUANTIZE_INT8 = previous
+
+    report = {}
+    for model, expected in reference.items():
+        actual = candidate[model]
+        entry = {'eager_ms': reference_ms[model], 'backend_ms': candidate_ms[model],
+                 'speedup': reference_ms[model] / max(candidate_ms[model], 1e-9)}
+        if model == 'classifier':
+            entry['agreement'] = float(np.mean([a == b for a, b in zip(expected, actual)])) if images else 1.0
+        else:
+            same = [sorted(c for _, c in a) == sorted(c for _, c in b) for a, b in zip(expected, actual)]
+            ious = [max((_box_iou(box, other) for other, other_cls in b if other_cls == cls), default=0.0)
+                    for a, b in zip(expected, actual) for box, cls in a]
+            entry['agreement'] = float(np.mean(same)) if images else 1.0
+            entry['mean_iou'] = float(np.mean(ious)) if ious else 1.0
+        report[model] = entry
+    return report
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Export models and check inference backends')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='Export all five models')
+    export_parser.add_argument('--backend', choices=tuple(EXPORT_SUFFIX), required=True)
+    export_parser.add_argument('--int8', action='store_true', help='Dynamic int8 quantization')
+
+    parity_parser = subparsers.add_parser('parity', help='Compare a backend with eager PyTorch')
+    parity_parser.add_argument('--backend', choices=BACKENDS, required=True)
+    parity_parser.add_argument('--int8', action='store_true', help='Check the quantized variant')
+    parity_parser.add_argument('--images', required=True, help='Folder of validation images')
+    parity_parser.add_argument('--no-detectors', action='store_true', help='Only check the classifiers')
+    parity_parser.add_argument('--batch-size', type=int, default=16, help='Batch size (default: 16)')
+    return parser.parse_args()
+
+
+def main():
+    """Main program entry point"""
+    args = parse_arguments()
+    if args.command == 'export':
+        export_all(args.backend, args.int8)
+        return
+
+    report = parity_check(args.images, args.backend, args.int8, not args.no_detectors, args.batch_size)
+    print(f"{'model':<12} {'agree':>6} {'IoU':>6} {'eager ms':>9} {'backend ms':>10} {'speedup':>7}")
+    for model, entry in report.items():
+        iou = f"{entry['mean_iou']:.3f}" if 'mean_iou' in entry else '-'
+        print(f"{model:<12} {entry['agreement']:>6.1%} {iou:>6} {entry['eager_ms']:>9.1f} "
+              f"{entry['backend_ms']:>10.1f} {entry['speedup']:>6.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""
+Persistent, content-addressed record of which PDFs have been processed and
+with which model weights, so re-runs only redo what changed.
+"""
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from project_function import config
+
+# Config attributes of the weight files a document's outputs depend on: the three YOLO detectors
+# (figure, TEM/description, sub-TEM) and the two classifiers that label the sub-TEM crops
+DETECTOR_WEIGHTS = ['CROP_IMAGES', 'IMAGE_DESCRIPTION', 'TEM_IMAGE_CROP']
+CLASSIFIER_WEIGHTS = ['BINARY_CLASSIFIER', 'FIVE_CLASS_CLASSIFIER']
+WEIGHTS = DETECTOR_WEIGHTS + CLASSIFIER_WEIGHTS
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Hash a file in chunks so large PDFs/weights are never fully in memory."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _combine(*parts):
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+class Manifest:
+    """
+    SQLite manifest keyed by PDF content hash.
+
+    Each processed document stores two keys. The detection key combines its
+    content hash, the rendering settings and the detector weights; the
+    document key adds the classification/output settings and the classifier
+    weights. Detector outputs are stored per detection key (see
+    `detection_store`), so a document whose detection key is unchanged is
+    only classified and written again.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.MANIFEST_PATH
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS documents (
+                content_hash TEXT PRIMARY KEY,
+                file TEXT NOT NULL,
+                document_key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                rows TEXT,
+                captions TEXT,
+                outputs TEXT,
+                error TEXT,
+                updated REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS documents_file ON documents(file);
+            CREATE TABLE IF NOT EXISTS file_hashes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                content_hash TEXT NOT NULL
+            );
+        ''')
+
+        # Manifests created before caption text / output shards / detection keys were stored lack these columns
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(documents)')]
+        if 'stage_keys' in columns:
+            # Older manifests stored per-stage keys; they never match a document key, so those PDFs are redone once
+            self.conn.execute('ALTER TABLE documents RENAME COLUMN stage_keys TO document_key')
+        for column in ('captions', 'outputs', 'detection_key'):
+            if column not in columns:
+                self.conn.execute(f'ALTER TABLE documents ADD COLUMN {column} TEXT')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # === Hashing (cached by path, size and mtime) ===
+    def content_hash(self, path):
+        """
+        Return the SHA-256 of `path`, reusing the stored hash if size and mtime are unchanged.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self.conn.execute(
+            'SELECT size, mtime, content_hash FROM file_hashes WHERE path = ?', (path,)
+        ).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return row[2]
+
+        content_hash = file_sha256(path)
+        self.conn.execute(
+            'INSERT OR REPLACE INTO file_hashes (path, size, mtime, content_hash) VALUES (?, ?, ?, ?)',
+            (path, stat.st_size, stat.st_mtime, content_hash)
+        )
+        self.conn.commit()
+        return content_hash
+
+    def model_fingerprints(self):
+        """Return {config attribute: content hash} for every weight file in `WEIGHTS`."""
+        fingerprints = {}
+        for name in WEIGHTS:
+            path = getattr(config, name)
+            fingerprints[name] = self.content_hash(path) if os.path.exists(path) else 'missing'
+        return fingerprints
+
+    def detection_key(self, content_hash, settings, fingerprints):
+        """
+        Key identifying one document's detector outputs.
+
+        Args:
+            content_hash (str): PDF content hash
+            settings (dict): Settings that affect rendering and detection (e.g., zoom factor)
+            fingerprints (dict): Output of `model_fingerprints()`
+
+        Returns:
+            str: Key that changes whenever the PDF, a rendering setting or a detector weight file changes
+        """
+        return _combine(content_hash, json.dumps(settings, sort_keys=True),
+                        *(fingerprints[name] for name in DETECTOR_WEIGHTS))
+
+    def document_key(self, detection_key, settings, fingerprints):
+        """
+        Key identifying one document's outputs.
+
+        Args:
+            detection_key (str): Output of `detection_key()`
+            settings (dict): Settings that affect classification and the written outputs (e.g., image format)
+            fingerprints (dict): Output of `model_fingerprints()`
+
+        Returns:
+            str: Key that changes whenever the detections, a setting or a classifier weight file changes
+        """
+        return _combine(detection_key, json.dumps(settings, sort_keys=True),
+                        *(fingerprints[name] for name in CLASSIFIER_WEIGHTS))
+
+    # === Document state ===
+    def is_done(self, content_hash, key):
+        """Return True if the document finished with the same `document_key`, so it needs no work."""
+        row = self.conn.execute(
+            'SELECT document_key, status FROM documents WHERE content_hash = ?', (content_hash,)
+        ).fetchone()
+        return row is not None and row[1] == 'done' and row[0] == key
+
+    def outputs(self, content_hash):
+        """Return the output files (e.g., shard names) recorded for a finished document."""
+        row = self.conn.execute('SELECT outputs FROM documents WHERE content_hash = ?', (content_hash,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else []
+
+    def mark_running(self, content_hash, file, key, detection_key=None):
+        """Record that a document is in progress; a crash leaves it in this state and it is redone."""
+        self._upsert(content_hash, file, key, detection_key, 'running', None, None, None, None)
+
+    def mark_done(self, content_hash, file, key, rows, captions=None, outputs=None, detection_key=None):
+        """Store a finished document and drop older entries for the same file name."""
+        self.conn.execute('DELETE FROM documents WHERE file = ? AND content_hash != ?', (file, content_hash))
+        self._upsert(content_hash, file, key, detection_key, 'done', json.dumps(rows), json.dumps(captions or []),
+                     json.dumps(outputs or []), None)
+
+    def mark_failed(self, content_hash, file, key, error, detection_key=None):
+        self._upsert(content_hash, file, key, detection_key, 'failed', None, None, None, error)
+
+    def _upsert(self, content_hash, file, key, detection_key, status, rows, captions, outputs, error):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO documents (content_hash, file, document_key, detection_key, status, rows, captions, '
+            'outputs, error, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (content_hash, file, key, detection_key, status, rows, captions, outputs, error, time.time())
+        )
+        self.conn.commit()
+
+    def prune_detections(self, directory):
+        """
+        Delete stored detections (see `detection_store`) that no document refers to any more.
+
+        Returns:
+            int: Number of deleted files
+        """
+        if not os.path.isdir(directory):
+            return 0
+        keys = {key for (key,) in self.conn.execute('SELECT detection_key FROM documents WHERE detection_key IS NOT NULL')}
+        removed = 0
+        for name in os.listdir(directory):
+            if name.endswith('.npz') and name[:-len('.npz')] not in keys:
+                os.remove(os.path.join(directory, name))
+                removed += 1
+        return removed
+
+    def status_counts(self):
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM documents GROUP BY status').fetchall())
+
+    # === Output ===
+    def export_csv(self, csv_path, columns, field='rows'):
+        """
+        Rewrite `csv_path` from all finished documents, ordered by file name.
+        The file is written to a temporary path and renamed, so it is never half-written.
+
+        Args:
+            csv_path (str): Output CSV
+            columns (List[str]): CSV header
+            field (str): Stored record list to export ('rows' or 'captions')
+        """
+        if field not in ('rows', 'captions'):
+            raise ValueError(f"Unknown manifest field '{field}'")
+
+        tmp_path = f"{csv_path}.tmp"
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            for (records,) in self.conn.execute(f"SELECT {field} FROM documents WHERE status = 'done' ORDER BY file"):
+                writer.writerows(json.loads(records or '[]'))
+        os.replace(tmp_path, csv_path)
@@ -0,0 +1,122 @@
+import gc
+import threading
+import time
+
+
+class ModelRegistry:
+    """
+    Thread-safe registry of lazily loaded models.
+
+    Each model is registered with a zero-argument loader and built on first
+    `get()`. Concurrent first calls for the same model load it only once.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._load_times = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader):
+        """
+        Register a loader under `name` (replaces any previous loader and drops its model).
+
+        Args:
+            name (str): Model key (e.g., 'crop')
+            loader (Callable[[], Any]): Builds and returns the model
+        """
+        with self._lock:
+            self._loaders[name] = loader
+            self._locks.setdefault(name, threading.Lock())
+            self._models.pop(name, None)
+            self._load_times.pop(name, None)
+
+    def names(self):
+        """Return the registered model names."""
+        return list(self._loaders)
+
+    def is_loaded(self, name):
+        """Return True if `name` is currently held in memory."""
+        return name in self._models
+
+    def get(self, name):
+        """
+        Return the model registered as `name`, loading it on first use.
+
+        Args:
+            name (str): Model key
+
+        Returns:
+            Any: The loaded model
+
+        Raises:
+            KeyError: If no loader is registered under `name`
+        """
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        if name not in self._loaders:
+            raise KeyError(f"No model registered as '{name}'")
+
+        # Per-model lock: loading one model does not block the others
+        with self._locks[name]:
+            model = self._models.get(name)
+            if model is None:
+                start = time.perf_counter()
+                model = self._loaders[name]()
+                self._load_times[name] = time.perf_counter() - start
+                self._models[name] = model
+        return model
+
+    def warmup(self, names=None):
+        """
+        Load the given models (all registered models by default) ahead of first use.
+
+        Args:
+            names (Iterable[str] or None): Models to load
+
+        Returns:
+            dict: Load time in seconds per model loaded by this registry
+        """
+        for name in (names if names is not None else self.names()):
+            self.get(name)
+        return self.load_times()
+
+    def unload(self, names=None):
+        """
+        Drop the given models (all by default) so their memory can be reclaimed.
+        They are loaded again on next `get()`.
+
+        Args:
+            names (Iterable[str] or None): Models to drop
+        """
+        for name in list(names if names is not None else self.names()):
+            with self._locks.get(name, self._lock):
+                self._models.pop(name, None)
+                self._load_times.pop(name, None)
+        gc.collect()
+
+    def load_times(self):
+        """Return {model name: load time in seconds} for the models currently loaded."""
+        return dict(self._load_times)
+
+    def preload_for_fork(self, names=None):
+        """
+        Load models in the parent process before forking worker processes.
+
+        After loading, live objects are moved to the GC's permanent generation
+        (`gc.freeze`), so the collector in forked children does not write to
+        them and the model pages stay shared copy-on-write.
+
+        Args:
+            names (Iterable[str] or None): Models to load
+
+        Returns:
+            dict: Load time in seconds per loaded model
+        """
+        times = self.warmup(names)
+        gc.collect()
+        gc.freeze()
+        return times
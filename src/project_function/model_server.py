@@ -0,0 +1,404 @@
+"""
+Local inference server: one process hosts the five vision_crop models and
+serves every pipeline worker.
+
+Workers write their images into a per-worker shared-memory arena and send
+only offsets and shapes through a queue. The server coalesces requests from
+all workers into micro-batches bounded by `max_batch_size` and
+`max_wait_ms`, so the models are held in RAM once and run on larger batches
+than any single worker produces. If the server process dies (e.g. killed for
+memory), waiting clients raise instead of hanging.
+
+    server = ModelServer(num_clients=8).start()
+    ... ProcessPoolExecutor(initializer=connect, initargs=(server.handles(),)) ...
+    print(server.metrics())
+    server.stop()
+"""
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from collections import defaultdict
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+
+from project_function import config
+
+DETECTOR_NAMES = ('crop', 'description', 'tem')
+CLASSIFIER_NAMES = ('binary_classifier', 'five_class_classifier')
+
+
+def _attach(name):
+    """
+    Attach to a segment created by `ModelServer`. The server and workers are
+    spawned from the parent and share its resource tracker, so the segment is
+    only unlinked by the parent in `ModelServer.stop()`.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no `track` argument
+        return shared_memory.SharedMemory(name=name)
+
+
+def _pipe_open(conn):
+    """
+    Whether the writing end of a liveness pipe is still open. Only the server
+    process holds it, so it closes (EOF) when the server exits or is killed.
+    """
+    try:
+        return not conn.poll()
+    except (EOFError, OSError):
+        return False
+
+
+def _read_arrays(buffer, layout):
+    """Return views into `buffer` for a [(offset, shape, dtype)] layout."""
+    return [np.ndarray(shape, dtype=np.dtype(dtype), buffer=buffer, offset=offset) for offset, shape, dtype in layout]
+
+
+# === Server process ===
+class _MicroBatcher:
+    """Collects requests and runs them per model in batches of at most `max_batch_size` images."""
+
+    def __init__(self, registry, arenas, response_queues, max_batch_size, device):
+        self.registry = registry
+        self.device = device
+        self.arenas = arenas
+        self.response_queues = response_queues
+        self.max_batch_size = max_batch_size
+        self.requests = 0
+        self.images = 0
+        self.batch_sizes = defaultdict(int)   # images per forward pass → count
+        self.queue_depths = defaultdict(int)  # queued requests when a batch closes → count
+        self.busy_seconds = 0.0
+
+    def run(self, pending, queue_depth):
+        self.queue_depths[queue_depth] += 1
+        by_model = defaultdict(list)
+        for request in pending:
+            by_model[request[2]].append(request)
+
+        start = time.perf_counter()
+        for name, requests in by_model.items():
+            try:
+                self._run_model(name, requests)
+            except Exception as e:
+                for client_id, request_id, *_ in requests:
+                    self.response_queues[client_id].put((request_id, 'error', f"{type(e).__name__}: {e}"))
+        self.busy_seconds += time.perf_counter() - start
+
+    def _run_model(self, name, requests):
+        model = self.registry.get(name)
+        inputs = [_read_arrays(self.arenas[client_id].buf, layout) for client_id, _, _, layout in requests]
+        flat = [array for arrays in inputs for array in arrays]
+
+        outputs = []
+        for start in range(0, len(flat), self.max_batch_size):
+            chunk = flat[start:start + self.max_batch_size]
+            self.batch_sizes[len(chunk)] += 1
+            if name in CLASSIFIER_NAMES:
+                with torch.no_grad():
+                    logits = model(torch.from_numpy(np.stack(chunk)).to(self.device))
+                outputs.extend(logits.cpu().numpy())
+            else:
+                for result in model(chunk, verbose=False):
+                    boxes = result.boxes
+                    outputs.append((boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(), boxes.cls.cpu().numpy()))
+
+        position = 0
+        for (client_id, request_id, _, _), arrays in zip(requests, inputs):
+            self.response_queues[client_id].put((request_id, 'ok', outputs[position:position + len(arrays)]))
+            position += len(arrays)
+        self.requests += len(requests)
+        self.images += len(flat)
+
+    def metrics(self):
+        batches = sum(self.batch_sizes.values())
+        return {
+            'requests': self.requests,
+            'images': self.images,
+            'batches': batches,
+            'mean_batch_size': self.images / batches if batches else 0.0,
+            'batch_sizes': dict(sorted(self.batch_sizes.items())),
+            'queue_depths': dict(sorted(self.queue_depths.items())),
+            'busy_seconds': self.busy_seconds,
+        }
+
+
+def _serve(request_queue, response_queues, arena_names, max_batch_size, max_wait_ms, backend, num_threads, ready,
+           alive):
+    """
+    Server process entry point: load models once, then batch requests until a stop message.
+    `alive` (the writing end of the liveness pipe) is only held open, never written to.
+    """
+    from project_function import vision_crop
+
+    config.INFERENCE_BACKEND, config.QUANTIZE_INT8 = backend
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    vision_crop.registry.warmup()
+    vision_crop._load_classifiers()
+
+    arenas = [_attach(name) for name in arena_names]
+    batcher = _MicroBatcher(vision_crop.registry, arenas, response_queues, max_batch_size,
+                            vision_crop.TEM_classifier.device)
+    ready.set()
+
+    try:
+        stop = False
+        while not stop:
+            # The first request opens a batch window of `max_wait_ms`
+            message = request_queue.get()
+            deadline = time.perf_counter() + max_wait_ms / 1000
+            pending = []
+            while True:
+                if message[2] == '__stop__':
+                    stop = True
+                    break
+                if message[2] == '__metrics__':
+                    response_queues[message[0]].put((message[1], 'ok', batcher.metrics()))
+                else:
+                    pending.append(message)
+                if sum(len(request[3]) for request in pending) >= max_batch_size:
+                    break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    message = request_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if pending:
+                try:
+                    depth = request_queue.qsize()
+                except NotImplementedError:
+                    depth = -1
+                batcher.run(pending, depth)
+    finally:
+        for arena in arenas:
+            arena.close()
+
+
+class ModelServer:
+    """
+    Parent-side handle of the server process and the shared-memory arenas.
+
+    Args:
+        num_clients (int): Number of worker processes that will connect (one arena each)
+        max_batch_size (int): Maximum images per forward pass
+        max_wait_ms (float): Longest time the first queued request waits for others to join its batch
+        arena_bytes (int): Shared memory per client; one request must fit (a page at zoom 5 is ~36 MB)
+        num_threads (int or None): torch threads in the server process (default: torch default)
+    """
+
+    def __init__(self, num_clients, max_batch_size=32, max_wait_ms=5, arena_bytes=256 << 20, num_threads=None):
+        self.num_clients = num_clients
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.arena_bytes = arena_bytes
+        self.num_threads = num_threads
+        self._context = multiprocessing.get_context('spawn')
+        self._process = None
+        self._alive = None
+        self._arenas = []
+        self._client = None
+
+    def start(self, timeout=600):
+        """Create the arenas, start the server process and wait until its models are loaded."""
+        self._arenas = [shared_memory.SharedMemory(create=True, size=self.arena_bytes) for _ in range(self.num_clients + 1)]
+        self._request_queue = self._context.Queue()
+        # The last slot is reserved for the parent (metrics, shutdown)
+        self._response_queues = [self._context.Queue() for _ in range(self.num_clients + 1)]
+        self._next_client = self._context.Value('i', 0)
+        ready = self._context.Event()
+        self._alive, alive_writer = self._context.Pipe(duplex=False)
+
+        self._process = self._context.Process(
+            target=_serve, name='model-server', daemon=True,
+            args=(self._request_queue, self._response_queues, [arena.name for arena in self._arenas],
+                  self.max_batch_size, self.max_wait_ms, (config.INFERENCE_BACKEND, config.QUANTIZE_INT8),
+                  self.num_threads, ready, alive_writer))
+        self._process.start()
+        # From here on only the server holds the writing end
+        alive_writer.close()
+        if not ready.wait(timeout):
+            self.stop()
+            raise RuntimeError("Model server did not start in time")
+        self._client = ModelClient(self.num_clients, self._arenas[-1].name, self._request_queue,
+                                   self._response_queues[-1], alive=self._process.is_alive)
+        logging.info(f"Model server ready ({self.num_clients} clients, max batch {self.max_batch_size}, "
+                     f"max wait {self.max_wait_ms} ms)")
+        return self
+
+    def handles(self):
+        """Picklable connection data for `connect` in worker processes."""
+        return {
+            'request_queue': self._request_queue,
+            'response_queues': self._response_queues[:-1],
+            'arena_names': [arena.name for arena in self._arenas[:-1]],
+            'next_client': self._next_client,
+            'alive': self._alive,
+        }
+
+    def metrics(self):
+        """
+        Return server counters: 'requests', 'images', 'batches', 'mean_batch_size',
+        'batch_sizes' ({images per forward pass: count}), 'queue_depths'
+        ({requests still queued when a batch closed: count}) and 'busy_seconds'.
+        """
+        return self._client.control('__metrics__')
+
+    def stop(self):
+        """Stop the server process and free the shared memory."""
+        if self._process is not None and self._process.is_alive():
+            self._request_queue.put((self.num_clients, -1, '__stop__', []))
+            self._process.join(timeout=30)
+            if self._process.is_alive():
+                self._process.terminate()
+        self._process = None
+        if self._alive is not None:
+            self._alive.close()
+            self._alive = None
+        for arena in self._arenas:
+            arena.close()
+            arena.unlink()
+        self._arenas = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# === Client side (worker processes) ===
+class ModelClient:
+    """
+    Sends arrays through one shared-memory arena and waits for the server's answer.
+
+    Args:
+        alive (Callable[[], bool] or None): Whether the server process still runs; checked
+            every `poll_interval` seconds while waiting (None: wait indefinitely)
+        poll_interval (float): Seconds between liveness checks
+    """
+
+    def __init__(self, client_id, arena_name, request_queue, response_queue, alive=None, poll_interval=1.0):
+        self.client_id = client_id
+        self.arena = _attach(arena_name)
+        self.request_queue = request_queue
+        self.response_queue = response_queue
+        self.alive = alive
+        self.poll_interval = poll_interval
+        self._request_id = 0
+        self._lock = threading.Lock()
+
+    def call(self, name, arrays):
+        """
+        Run model `name` on `arrays`, splitting them into requests that fit the arena.
+
+        Returns:
+            list: One output per input array (or the server's reply for control messages)
+        """
+        if not arrays:
+            return []
+
+        with self._lock:
+            outputs = []
+            layout = []
+            offset = 0
+            for array in arrays:
+                array = np.ascontiguousarray(array)
+                if array.nbytes > self.arena.size:
+                    raise ValueError(f"Array of {array.nbytes} bytes does not fit the {self.arena.size}-byte arena")
+                if offset + array.nbytes > self.arena.size:
+                    outputs.extend(self._send(name, layout))
+                    layout, offset = [], 0
+                np.ndarray(array.shape, array.dtype, buffer=self.arena.buf, offset=offset)[...] = array
+                layout.append((offset, array.shape, array.dtype.str))
+                offset += -(-array.nbytes // 64) * 64  # keep arrays 64-byte aligned
+            outputs.extend(self._send(name, layout))
+            return outputs
+
+    def control(self, name):
+        """Send a control message ('__metrics__') and return the reply."""
+        with self._lock:
+            return self._send(name, [])
+
+    def _send(self, name, layout):
+        self._request_id += 1
+        self.request_queue.put((self.client_id, self._request_id, name, layout))
+        while True:
+            try:
+                request_id, status, payload = self.response_queue.get(timeout=self.poll_interval)
+                break
+            except queue.Empty:
+                if self.alive is not None and not self.alive():
+                    raise RuntimeError(f"Model server process exited while '{name}' was pending")
+        if status != 'ok':
+            raise RuntimeError(f"Model server failed on '{name}': {payload}")
+        return payload
+
+
+class _Boxes:
+    __slots__ = ('xyxy', 'conf', 'cls')
+
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy, self.conf, self.cls = xyxy, conf, cls
+
+
+class _Result:
+    """Stand-in for an ultralytics Results object with the `boxes` fields vision_crop reads."""
+    __slots__ = ('boxes',)
+
+    def __init__(self, xyxy, conf, cls):
+        self.boxes = _Boxes(xyxy, conf, cls)
+
+
+class RemoteDetector:
+    """Callable like an ultralytics YOLO model (`model(images, verbose=False)`)."""
+
+    def __init__(self, client, name):
+        self.client, self.name = client, name
+
+    def __call__(self, source, verbose=False, **kwargs):
+        images = source if isinstance(source, list) else [source]
+        return [_Result(*output) for output in self.client.call(self.name, images)]
+
+
+class RemoteClassifier:
+    """Callable like the ResNet classifiers (N×3×224×224 tensor in, logits out)."""
+
+    def __init__(self, client, name):
+        self.client, self.name = client, name
+
+    def __call__(self, input_tensor):
+        array = input_tensor.detach().cpu().numpy().astype(np.float32, copy=False)
+        return torch.from_numpy(np.stack(self.client.call(self.name, list(array))))
+
+
+def connect(handles):
+    """
+    Point this process's vision_crop registry at the model server.
+    Use as (part of) a pool initializer with `ModelServer.handles()`.
+    """
+    from project_function import vision_crop
+
+    with handles['next_client'].get_lock():
+        client_id = handles['next_client'].value
+        handles['next_client'].value += 1
+    if client_id >= len(handles['arena_names']):
+        raise RuntimeError(f"More workers than the {len(handles['arena_names'])} clients the model server was started for")
+
+    alive = handles['alive']
+    client = ModelClient(client_id, handles['arena_names'][client_id], handles['request_queue'],
+                         handles['response_queues'][client_id], alive=lambda: _pipe_open(alive))
+    for name in DETECTOR_NAMES:
+        vision_crop.registry.register(name, lambda name=name: RemoteDetector(client, name))
+    for name in CLASSIFIER_NAMES:
+        vision_crop.registry.register(name, lambda name=name: RemoteClassifier(client, name))
+    return client
@@ -0,0 +1,1077 @@
+"""
+End-to-end extraction driver: PDF pages → figure crops → TEM/caption split →
+sub-TEM crops → classification → images + CSV rows.
+
+Run from the `src` directory:
+
+    python -m project_function.pipeline --workers 8 --zoom 5
+"""
+import argparse
+import csv
+import logging
+import multiprocessing
+import multiprocessing.util
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
+from dataclasses import dataclass, field, replace
+
+import cv2
+import torch
+
+from project_function import (config, convert_images, detection_store, image_writer, inference_backends,
+                              model_server, shards, telemetry, vision_crop)
+from project_function.dedup import PHashIndex, phash
+from project_function.manifest import Manifest
+from project_function.stage_executor import Stage, StageExecutor
+
+CSV_COLUMNS = ['parent_image', 'sub_image', 'TEM_type']
+CAPTION_COLUMNS = ['image_name', 'caption_text', 'caption_source']
+SKIP_TEM_TYPES = ('None', 'SEM')
+
+
+# === Settings ===
+@dataclass
+class PipelineSettings:
+    """
+    Options of `process_pdf`. The driver resolves them once (`resolved`) and sends
+    the same object to every worker, so all workers use the driver's config values.
+
+    Attributes:
+        pdf_path (str or None): Input directory (default: config.PDF_PATH)
+        output_dirs (dict or None): 'pdf_image', 'tem_image' and 'description' folders
+            (default: the matching config paths)
+        zoom_factor (float): Rendering zoom for every page (output zoom of the regions in two-pass mode)
+        batch_size (int): Batch size for the YOLO and classifier stages
+        two_pass (bool): Detect figures on pages rendered at `detect_zoom` and
+            re-render only the detected regions at `zoom_factor`
+        detect_zoom (float): Detection zoom used in two-pass mode
+        prefilter (bool): Skip pages without images or vector graphics before rendering
+        conservative (bool): Use the conservative pre-filter thresholds
+        text_captions (bool): Extract caption text from the PDF text layer
+        dedup (bool): Skip near-duplicate sub-TEM images
+        dedup_path (str or None): Perceptual-hash index (default: config.PHASH_INDEX_PATH)
+        stat_prefilter (bool): Label obvious non-micrographs 'None' from image statistics, skipping the ResNet
+        stat_threshold (float or None): Pre-filter reject threshold (default: config.STAT_PREFILTER_THRESHOLD)
+        pipelined (bool): Overlap rendering, detection, classification and writing (see `_run_pipelined`)
+        queue_size (int): Pages buffered between two pipelined stages
+        stage_workers (dict or None): Threads for the 'detect' and 'classify' stages (default: 1 each)
+        output_mode (str or None): 'files' (image per file in `output_dirs`) or 'shards' (tar shards in
+            `shard_path`) (default: config.OUTPUT_MODE)
+        shard_path (str or None): Shard directory (default: config.SHARD_PATH)
+        image_format (str or None): 'png', 'webp' (lossless) or 'jpeg' (default: config.IMAGE_FORMAT)
+        image_quality (int or None): Format quality (default: config.IMAGE_QUALITY, else the format default)
+        writer_threads (int or None): Background encoding threads, 0 to encode in the caller
+            (default: config.IMAGE_WRITER_THREADS)
+    """
+    pdf_path: str = None
+    output_dirs: dict = None
+    zoom_factor: float = 5
+    batch_size: int = 16
+    two_pass: bool = False
+    detect_zoom: float = 1.5
+    prefilter: bool = False
+    conservative: bool = False
+    text_captions: bool = True
+    dedup: bool = False
+    dedup_path: str = None
+    stat_prefilter: bool = False
+    stat_threshold: float = None
+    pipelined: bool = False
+    queue_size: int = 4
+    stage_workers: dict = None
+    output_mode: str = None
+    shard_path: str = None
+    image_format: str = None
+    image_quality: int = None
+    writer_threads: int = None
+
+    def resolved(self):
+        """Return a copy with every config-backed default filled in."""
+        return replace(
+            self,
+            pdf_path=self.pdf_path or config.PDF_PATH,
+            output_dirs=self.output_dirs or default_output_dirs(),
+            dedup_path=self.dedup_path or config.PHASH_INDEX_PATH,
+            stat_threshold=config.STAT_PREFILTER_THRESHOLD if self.stat_threshold is None else self.stat_threshold,
+            stage_workers={'detect': 1, 'classify': 1, **(self.stage_workers or {})},
+            output_mode=self.output_mode or config.OUTPUT_MODE,
+            shard_path=self.shard_path or config.SHARD_PATH,
+            image_format=self.image_format or config.IMAGE_FORMAT,
+            image_quality=config.IMAGE_QUALITY if self.image_quality is None else self.image_quality,
+            writer_threads=config.IMAGE_WRITER_THREADS if self.writer_threads is None else self.writer_threads,
+        )
+
+
+@dataclass
+class RunOptions:
+    """
+    Driver options of `run` (everything the workers do not need).
+
+    Attributes:
+        csv_path (str or None): Metadata CSV (default: config.CSV_PATH)
+        caption_csv_path (str or None): Caption text CSV (default: config.CAPTION_TEXT_PATH)
+        workers (int or None): Number of processes (default: os.cpu_count())
+        threads_per_worker (int or None): torch/OpenCV threads per process
+            (default: cpu_count // workers, at least 1)
+        start (int): Index of the first file to process (in sorted order)
+        stop (int or None): Index after the last file to process
+        preload (bool): Load the models in the parent and fork workers from it
+            (shares model memory copy-on-write; requires the 'fork' start method)
+        chunksize (int): Files handed to a worker at a time
+        manifest_path (str or None): SQLite manifest (default: config.MANIFEST_PATH)
+        use_manifest (bool): Skip up-to-date PDFs and rebuild the CSV from the manifest
+        backend (str or None): Inference backend for all models (default: config.INFERENCE_BACKEND)
+        int8 (bool or None): Dynamic int8 quantization (default: config.QUANTIZE_INT8)
+        use_model_server (bool): Host the models once in a local server process shared by all workers
+            (workers then hold no models; `preload` is ignored)
+        server_batch_size (int): Maximum images per forward pass in the model server
+        server_wait_ms (float): Longest time the model server waits to fill a batch
+        ray_address (str or None): Run on a Ray cluster instead of a local process pool: 'local' starts
+            a single-node cluster, anything else is passed to `ray.init` (e.g., 'auto'); `workers` is then
+            the number of PDF workers per node (see `ray_pipeline`)
+        ray_model_threads (int or None): torch threads of each node's model actor (default: remaining CPUs)
+        ray_locality (dict or None): {node IP address, hostname or ID: node-local PDF directory}; PDFs
+            found there are processed on that node and read from its local copy
+        detections_path (str or None): Directory of stored detector outputs (default: config.DETECTIONS_PATH)
+        store_detections (bool): With the manifest, store each document's detector outputs, so a change
+            of classifier weights or output settings only classifies and writes again
+        trace_path (str or None): Append per-document/page/stage spans and a final metrics snapshot
+            to this JSONL file (see `telemetry`)
+        metrics_port (int or None): Serve live Prometheus metrics of all workers on this port
+    """
+    csv_path: str = None
+    caption_csv_path: str = None
+    workers: int = None
+    threads_per_worker: int = None
+    start: int = 0
+    stop: int = None
+    preload: bool = False
+    chunksize: int = 1
+    manifest_path: str = None
+    use_manifest: bool = True
+    backend: str = None
+    int8: bool = None
+    use_model_server: bool = False
+    server_batch_size: int = 32
+    server_wait_ms: float = 5
+    ray_address: str = None
+    ray_model_threads: int = None
+    ray_locality: dict = None
+    detections_path: str = None
+    store_detections: bool = True
+    trace_path: str = None
+    metrics_port: int = None
+
+
+@dataclass
+class DocumentState:
+    """
+    State of one document shared by its page steps (see `open_document` and `process_page`).
+
+    Attributes:
+        file (str): PDF file name
+        settings (PipelineSettings): Resolved settings
+        writer (image_writer.ImageWriter): Background image writer of this process
+        stats (dict): Page, duplicate and pre-filter counts (see `process_pdf`)
+        captions (list or None): Caption records, or None when captions are not collected
+        dedup (PHashIndex or None): Perceptual-hash index with `settings.dedup`
+        shard_writer (shards.ShardWriter or None): Shard writer in shard output mode
+        rows (list): CSV rows written so far, in page order
+        cut_num (int): Figures written so far (numbers the output images)
+        detections (list or None): (page number, regions) of the pages detected so far, collected
+            when the document's detections are stored (see `detection_store`)
+    """
+    file: str
+    settings: PipelineSettings
+    writer: image_writer.ImageWriter
+    stats: dict = field(default_factory=dict)
+    captions: list = None
+    dedup: PHashIndex = None
+    shard_writer: shards.ShardWriter = None
+    rows: list = field(default_factory=list)
+    cut_num: int = 0
+    detections: list = None
+
+    @property
+    def filename(self):
+        return os.path.splitext(self.file)[0]
+
+    @property
+    def prefilter_threshold(self):
+        return self.settings.stat_threshold if self.settings.stat_prefilter else None
+
+
+# === Per-worker setup ===
+def _init_worker(num_threads, warmup, backend, server_handles=None, telemetry_settings=None):
+    """
+    Pin intra-op threads so `workers * num_threads` does not exceed the core count,
+    apply the parent's (backend, int8) inference settings, and load the models
+    once for the lifetime of the worker process.
+
+    With `server_handles`, the models are not loaded here; the registry is
+    pointed at the shared model server instead. With `telemetry_settings`
+    (the parent's `telemetry.settings()`), the worker records spans and metrics too.
+    """
+    if telemetry_settings is not None:
+        telemetry.enable(**telemetry_settings)
+    config.INFERENCE_BACKEND, config.QUANTIZE_INT8 = backend
+    torch.set_num_threads(num_threads)
+    cv2.setNumThreads(num_threads)
+    if server_handles is not None:
+        model_server.connect(server_handles)
+    elif warmup:
+        vision_crop.registry.warmup()
+
+
+# === Process a single PDF ===
+def process_pdf(file, settings=None, stats=None, captions=None, detections_path=None):
+    """
+    Run the full extraction chain over one PDF and write its images to disk.
+
+    Caption text is read from the PDF text layer inside the detected
+    description box. Captions whose text layer is missing or garbled are
+    marked 'needs_ocr' so only those description crops go through OCR.
+
+    With `settings.dedup`, the document's entries from earlier runs are first
+    removed from the perceptual-hash index, then every sub-TEM crop is looked
+    up right after cropping and indexed at once if it is new; near-duplicates
+    of an indexed image (also one from the same page or another page still in
+    flight) are not classified or written and are only linked to it.
+
+    With `detections_path`, the detector outputs are stored in that file once
+    the document is done. If the file exists already, the PDF is not rendered
+    and the detectors do not run: the stored crops are only classified and
+    written again (see `detection_store`).
+
+    Args:
+        file (str): PDF file name inside `settings.pdf_path`
+        settings (PipelineSettings or None): Processing options (default: `PipelineSettings()`)
+        stats (dict or None): Filled with page counts ('pages', 'skipped'), 'duplicates', 'prefiltered',
+            'images_written', 'bytes_written' and 'encode_seconds'; pipelined runs add per-stage
+            utilization in 'stages', shard output the names of the shards used in 'shards', and
+            'detections_reused' is 1 when stored detections were used
+        captions (list or None): Filled with caption records (image_name, caption_text, caption_source)
+        detections_path (str or None): .npz file of the document's stored detector outputs
+
+    Returns:
+        List[dict]: CSV rows (parent_image, sub_image, TEM_type) for this PDF, in page order
+    """
+    doc = open_document(file, settings, stats=stats, captions=captions)
+    stored = _load_detections(detections_path)
+    written_before = doc.writer.stats()
+    try:
+        if stored is not None:
+            _replay_detections(*stored, doc)
+        else:
+            if detections_path is not None:
+                doc.detections = []
+            if doc.settings.pipelined:
+                _run_pipelined(iter_pages(doc), doc)
+            else:
+                for page_num, page, text_layer in iter_pages(doc):
+                    process_page(page_num, page, text_layer, doc)
+    finally:
+        # Every image of the document is on disk (or in its shard) before it is reported done
+        doc.writer.flush()
+
+    if doc.detections is not None:
+        # Pipelined classification may finish pages out of order
+        detection_store.save(detections_path, sorted(doc.detections, key=lambda page: page[0]), doc.stats)
+
+    written = doc.writer.stats()
+    for key, counter in (('images_written', 'images'), ('bytes_written', 'bytes'), ('encode_seconds', 'encode_seconds')):
+        doc.stats[key] = doc.stats.get(key, 0) + written[counter] - written_before[counter]
+    if doc.shard_writer is not None:
+        doc.stats['shards'] = sorted(doc.stats.get('shards', set()))
+    return doc.rows
+
+
+# === Page steps, shared with the benchmark ===
+def open_document(file, settings=None, stats=None, captions=None, writer=None):
+    """
+    Set up the per-document state that the page steps share.
+
+    With `settings.dedup`, the document's entries from earlier runs are
+    removed from the perceptual-hash index here, so a re-run (changed
+    settings or weights, or after a crash) does not match its own crops.
+
+    Args:
+        file (str): PDF file name inside `settings.pdf_path`
+        settings (PipelineSettings or None): Processing options (default: `PipelineSettings()`)
+        stats (dict or None): Filled in by the page steps (see `process_pdf`)
+        captions (list or None): Filled with caption records; None skips caption extraction
+        writer (image_writer.ImageWriter or None): Image writer (default: the one of this process)
+
+    Returns:
+        DocumentState: State to pass to `iter_pages` and `process_page`
+    """
+    settings = (settings or PipelineSettings()).resolved()
+    doc = DocumentState(
+        file=file,
+        settings=settings,
+        writer=writer or _get_image_writer(settings.image_format, settings.image_quality, settings.writer_threads),
+        stats=stats if stats is not None else {},
+        captions=captions,
+        dedup=_get_dedup_index(settings.dedup_path) if settings.dedup else None,
+        shard_writer=_get_shard_writer(settings.shard_path) if settings.output_mode == 'shards' else None,
+    )
+    if doc.dedup is not None:
+        doc.dedup.purge(file)
+    return doc
+
+
+def iter_pages(doc):
+    """
+    Yield (page number, page, text layer) for every page of the document that is
+    rendered (see `_iter_pages`); pages feed `process_page` or the pipelined stages.
+    """
+    settings = doc.settings
+    page_filter = {'prefilter': settings.prefilter, 'conservative': settings.conservative, 'stats': doc.stats}
+    return _iter_pages(doc.file, settings.pdf_path, settings.zoom_factor, settings.two_pass, settings.detect_zoom,
+                       page_filter, text_captions=settings.text_captions)
+
+
+@contextmanager
+def _timed(timings, stage):
+    """Add the block's wall time to `timings[stage]` when `timings` is given."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def process_page(page_num, page, text_layer, doc, timings=None):
+    """
+    Detect, classify and write the figures of one page from `iter_pages`.
+
+    Args:
+        page_num (int): Page number
+        page (vision_crop.Detection or list): Page from `iter_pages`
+        text_layer (list or None): Text layer from `iter_pages`
+        doc (DocumentState): State from `open_document`
+        timings (dict or None): Accumulates seconds per stage ('crop', 'description', 'tem',
+            'classify', 'write')
+
+    Returns:
+        dict or None: The page plan (see `_classify_page`), or None when the page has no figures
+    """
+    with telemetry.span('page', page=page_num):
+        with _timed(timings, 'crop'):
+            figures = _detect_page(page)
+        if not figures:
+            return None
+        plan = _classify_page(figures, doc, timings)
+        with telemetry.span('write', page=page_num), _timed(timings, 'write'):
+            _write_page(plan, text_layer, doc)
+    return plan
+
+
+def _run_pipelined(pages, doc):
+    """
+    Overlap rendering, figure detection, classification and writing of one document.
+
+    Rendering and text-layer reads run in the source thread, the only one
+    that touches PyMuPDF (it is not thread-safe); the other steps are thread
+    stages (OpenCV and torch release the GIL) that see only arrays and plain
+    text data. Pages reach the writer in page order, so file numbering and
+    CSV rows match the sequential path.
+    """
+    workers = doc.settings.stage_workers
+
+    def detect(item):
+        page_num, payload, text_layer = item
+        return page_num, _detect_page(payload), text_layer
+
+    def classify(item):
+        page_num, figures, text_layer = item
+        return page_num, _classify_page(figures, doc) if figures else None, text_layer
+
+    def write(item):
+        page_num, plan, text_layer = item
+        if plan is not None:
+            with telemetry.span('write', page=page_num):
+                _write_page(plan, text_layer, doc)
+
+    executor = StageExecutor([
+        Stage('detect', detect, workers=workers['detect']),
+        Stage('classify', classify, workers=workers['classify']),
+        Stage('write', write, ordered=True),
+    ], queue_size=doc.settings.queue_size)
+    for _ in executor.run(pages):
+        pass
+    doc.stats['stages'] = executor.stats()
+
+
+# One index connection per worker process
+_dedup_indexes = {}
+
+
+def _get_dedup_index(path=None):
+    path = path or config.PHASH_INDEX_PATH
+    if path not in _dedup_indexes:
+        _dedup_indexes[path] = PHashIndex(path)
+    return _dedup_indexes[path]
+
+
+# One shard writer per worker process; its last shard is finished when the process exits
+_shard_writers = {}
+
+
+def _get_shard_writer(path=None):
+    path = path or config.SHARD_PATH
+    if path not in _shard_writers:
+        writer = shards.ShardWriter(path)
+        multiprocessing.util.Finalize(writer, writer.close, exitpriority=10)
+        _shard_writers[path] = writer
+    return _shard_writers[path]
+
+
+# One image writer per worker process, flushed and stopped when the process exits
+_image_writers = {}
+
+
+def _get_image_writer(fmt=None, quality=None, threads=None):
+    fmt = fmt or config.IMAGE_FORMAT
+    threads = config.IMAGE_WRITER_THREADS if threads is None else threads
+    if (fmt, quality, threads) not in _image_writers:
+        writer = image_writer.ImageWriter(threads, fmt, quality)
+        # Higher priority than the shard writers, so queued samples reach their shard before it is closed
+        multiprocessing.util.Finalize(writer, writer.close, exitpriority=20)
+        _image_writers[fmt, quality, threads] = writer
+    return _image_writers[fmt, quality, threads]
+
+
+def _save_image(doc, kind, name, image, meta=None):
+    """
+    Queue one output image on the background writer: a file in `output_dirs[kind]`
+    or a sample in the current shard.
+    """
+    if doc.shard_writer is None:
+        doc.writer.save(os.path.join(doc.settings.output_dirs[kind], name), image)
+        return
+
+    meta = {'pdf': doc.file, **(meta or {})}
+    shard_names = doc.stats.setdefault('shards', set())
+
+    def to_shard(data):
+        shard_names.add(doc.shard_writer.write_encoded(kind, name, data, meta))
+    doc.writer.submit(image, to_shard)
+
+
+def _drop_duplicates(subs, doc):
+    """
+    Split sub-TEM detections into new images and near-duplicates of indexed ones.
+
+    New images are indexed right away under a name derived from their page
+    box, so later crops of the same page or of pages in flight match them;
+    `_write_page` renames the entry once the output name and label are known,
+    or removes it if the crop is valid but was not written.
+
+    Returns:
+        Tuple[List[Detection], dict, int]: (subs that still need classification,
+            {id(sub): provisional index name}, number of duplicates)
+    """
+    indexed = {}
+    fresh = []
+    for sub in subs:
+        x1, y1, x2, y2 = sub.page_bbox
+        name = f"{doc.file}#p{sub.page}@{x1},{y1},{x2},{y2}"
+        if doc.dedup.add_or_link(phash(sub.image), name, pdf=doc.file) is None:
+            indexed[id(sub)] = name
+            fresh.append(sub)
+    return fresh, indexed, len(subs) - len(fresh)
+
+
+def _classify_page(figures, doc, timings=None):
+    """
+    Run description split, sub-TEM cropping and classification over the figures of one page.
+
+    All images are BGR views into the page buffer (see `vision_crop.Detection`),
+    so nothing is converted or copied until the crops are encoded to disk.
+    Nothing is written here; see `_write_page`.
+
+    Args:
+        figures (List[vision_crop.Detection]): Figure detections of the page
+        doc (DocumentState): Per-document state from `open_document` (settings, dedup index)
+        timings (dict or None): Accumulates seconds for 'description', 'tem' and 'classify'
+
+    Returns:
+        dict: 'figures' ([(tem, description, subs, labels)] per figure), 'indexed' ({id(sub): provisional
+            index name} of the subs added to the dedup index), 'duplicates' and 'prefiltered' counts
+    """
+    return _classify_regions(_detect_regions(figures, doc, timings), doc, timings)
+
+
+def _detect_regions(figures, doc, timings=None):
+    """
+    Split the figures of one page into TEM and description crops and detect the sub-TEM crops.
+    The page's regions are also collected in `doc.detections` when they are stored.
+
+    Returns:
+        List[Tuple]: (tem or None, description or None, subs) per figure
+    """
+    batch_size = doc.settings.batch_size
+    with _timed(timings, 'description'):
+        pairs = vision_crop.detect_tem_and_description(figures, batch_size=batch_size)
+    tems = [tem for tem, _ in pairs if tem is not None]
+    with _timed(timings, 'tem'):
+        sub_lists = iter(vision_crop.detect_sub_tems(tems, batch_size=batch_size))
+    regions = [(tem, description, next(sub_lists) if tem is not None else []) for tem, description in pairs]
+    if doc.detections is not None:
+        doc.detections.append((figures[0].page, regions))
+    return regions
+
+
+def _classify_regions(regions, doc, timings=None):
+    """Drop near-duplicates among the sub-TEM crops of one page and classify the rest (see `_classify_page`)."""
+    # Classify every sub-TEM image of this page in one batched cascade
+    batch_size = doc.settings.batch_size
+    per_figure = []
+    all_subs = []
+    indexed = {}
+    duplicates = 0
+    for tem, description, subs in regions:
+        if doc.dedup is not None and subs:
+            subs, sub_names, dropped = _drop_duplicates(subs, doc)
+            indexed.update(sub_names)
+            duplicates += dropped
+        per_figure.append((tem, description, subs))
+        all_subs.extend(subs)
+    with _timed(timings, 'classify'):
+        classified = vision_crop.TEM_classifier_batch([sub.image for sub in all_subs], batch_size=batch_size,
+                                                      prefilter_threshold=doc.prefilter_threshold)
+    labels = iter([entry['label'] for entry in classified])
+
+    return {
+        'figures': [(tem, description, subs, [next(labels) for _ in subs]) for tem, description, subs in per_figure],
+        'indexed': indexed,
+        'duplicates': duplicates,
+        'prefiltered': sum(entry['prefiltered'] for entry in classified),
+    }
+
+
+def _write_page(plan, text_layer, doc):
+    """
+    Write the kept figures, captions and sub-TEM images of one classified page, numbering them
+    after the figures already written for this document.
+
+    Args:
+        plan (dict): Output of `_classify_page`
+        text_layer (list or None): The page's `convert_images.page_text_layer` for caption text
+        doc (DocumentState): Per-document state from `open_document` (output lists, counters, settings)
+    """
+    filename = doc.filename
+    stats = doc.stats
+    image_ext = doc.writer.ext
+    stats['duplicates'] = stats.get('duplicates', 0) + plan['duplicates']
+    stats['prefiltered'] = stats.get('prefiltered', 0) + plan['prefiltered']
+
+    for tem, description, subs, tem_types in plan['figures']:
+        kept = any(tem_type not in SKIP_TEM_TYPES for tem_type in tem_types) and description is not None
+
+        cut_image_filename = f"PDF{filename}_Image{doc.cut_num + 1}{image_ext}"
+        if kept:
+            _save_image(doc, 'pdf_image', cut_image_filename, tem.image, {'page': tem.page})
+            _save_image(doc, 'description', cut_image_filename, description.image, {'page': description.page})
+
+        tem_num = 0
+        for sub, tem_type in zip(subs, tem_types):
+            image_name = None
+            if kept and tem_type not in SKIP_TEM_TYPES:
+                image_name = f"PDF{filename}_Image{doc.cut_num + 1}_{tem_num + 1}{image_ext}"
+                _save_image(doc, 'tem_image', image_name, sub.image,
+                            {'page': sub.page, 'parent_image': cut_image_filename, 'TEM_type': tem_type})
+                doc.rows.append({
+                    'parent_image': cut_image_filename,
+                    'sub_image': image_name,
+                    'TEM_type': tem_type
+                })
+                tem_num += 1
+
+            # Rejected crops stay indexed under their page box, so later copies of them are skipped too;
+            # a valid crop that was not written (its figure was not kept) must not hide later copies
+            if id(sub) in plan['indexed']:
+                name = plan['indexed'][id(sub)]
+                if image_name is not None or tem_type in SKIP_TEM_TYPES:
+                    doc.dedup.assign(name, image_name or name, tem_type)
+                else:
+                    doc.dedup.remove(name)
+
+        if not kept:
+            continue
+
+        if text_layer is not None and doc.captions is not None:
+            # page_bbox is in page pixels at zoom_factor in both rendering modes
+            caption = convert_images.extract_caption_text(
+                text_layer, convert_images.region_to_rect((0, 0), description.page_bbox, doc.settings.zoom_factor))
+            doc.captions.append({
+                'image_name': cut_image_filename,
+                'caption_text': caption['text'] if caption['usable'] else '',
+                'caption_source': 'text_layer' if caption['usable'] else 'needs_ocr'
+            })
+
+        doc.cut_num += 1
+
+
+def _iter_pages(file, pdf_path, zoom_factor, two_pass, detect_zoom, page_filter, text_captions=False):
+    """
+    Yield (page number, page, text layer) using either full-page or two-pass rendering.
+    Each rendered image is converted to BGR exactly once, here, into an array
+    that no longer depends on the PyMuPDF Pixmap.
+
+    The page is the root `Detection` of the full page, or in two-pass mode the
+    list of figure detections (the re-rendered regions); see `_detect_page`.
+    With `text_captions`, the text layer (`convert_images.page_text_layer`) is
+    read here too, so every PyMuPDF call stays on the thread that iterates
+    the pages; it is None otherwise and for pages without figure regions.
+    """
+    pages = _render_pages(file, pdf_path, zoom_factor, two_pass, detect_zoom, page_filter)
+    if not text_captions:
+        for page_num, page in pages:
+            yield page_num, page, None
+        return
+
+    with convert_images.open_text_layer(pdf_path, file) as text_doc:
+        for page_num, page in pages:
+            has_text = not isinstance(page, list) or bool(page)
+            yield page_num, page, convert_images.page_text_layer(text_doc[page_num]) if has_text else None
+
+
+def _render_pages(file, pdf_path, zoom_factor, two_pass, detect_zoom, page_filter):
+    """Yield (page number, page) for `_iter_pages`."""
+    if two_pass:
+        for page_num, regions in convert_images.iter_pdf_regions(
+                pdf_path, file, vision_crop.figure_boxes, detect_zoom=detect_zoom, output_zoom=zoom_factor,
+                **page_filter):
+            # Each re-rendered region is itself the figure; offset places it in page pixels
+            yield page_num, [vision_crop.Detection.from_page(region, page_num,
+                                                             offset=(rect.x0 * zoom_factor, rect.y0 * zoom_factor))
+                             for rect, region in regions]
+    else:
+        for page_num, image in convert_images.iter_pdf_to_image(pdf_path, file, zoom_factor, **page_filter):
+            yield page_num, vision_crop.Detection.from_page(image, page_num)
+
+
+def _load_detections(path):
+    """Stored detections of a document (see `detection_store.load`), or None when there are none to use."""
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        return detection_store.load(path)
+    except Exception as e:
+        logging.warning(f"Stored detections {path} are unreadable, detecting again: {type(e).__name__}: {e}")
+        return None
+
+
+def _replay_detections(pages, counts, doc):
+    """
+    Classify and write a document from its stored detections, without rendering the
+    PDF or running the detectors. Only the text layer of pages with figures is read.
+    """
+    doc.stats.update(counts, detections_reused=1)
+    settings = doc.settings
+    text_doc = convert_images.open_text_layer(settings.pdf_path, doc.file) if settings.text_captions else nullcontext()
+    with text_doc:
+        for page_num, regions in pages:
+            with telemetry.span('page', page=page_num):
+                plan = _classify_regions(regions, doc)
+                text_layer = convert_images.page_text_layer(text_doc[page_num]) if settings.text_captions else None
+                with telemetry.span('write', page=page_num):
+                    _write_page(plan, text_layer, doc)
+
+
+def _detect_page(page):
+    """Return the figure detections of a page from `_iter_pages` (already detected in two-pass mode)."""
+    if isinstance(page, list):
+        return page
+    return vision_crop.detect_figures([page])[0]
+
+
+def _process_pdf_safe(args):
+    """
+    Worker entry point for (file, settings, detections path or None): never raises, so one
+    bad PDF cannot stop the pool. With telemetry on, the document's metrics are returned in
+    `stats['telemetry']`.
+    """
+    file, settings, detections_path = args
+    stats = {}
+    captions = []
+    try:
+        with telemetry.span('document', file=file) as span:
+            rows = process_pdf(file, settings, stats=stats, captions=captions, detections_path=detections_path)
+            span.set(pages=stats.get('pages', 0), rows=len(rows))
+        telemetry.count('documents', outcome='done')
+        return file, rows, captions, stats, None
+    except Exception as e:
+        telemetry.count('documents', outcome='failed')
+        return file, [], [], stats, f"{type(e).__name__}: {e}"
+    finally:
+        if telemetry.enabled():
+            stats['telemetry'] = telemetry.drain()
+
+
+def _append_csv(csv_path, columns, rows):
+    """Append `rows` to `csv_path`, writing the header first if the file does not exist."""
+    new_file = not os.path.isfile(csv_path)
+    with open(csv_path, 'a', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        if new_file:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
+def default_output_dirs():
+    return {
+        'pdf_image': config.PDF_IMAGE_PATH,
+        'tem_image': config.TEM_IMAGE_PATH,
+        'description': config.DESCRIPTION_PATH,
+    }
+
+
+# === Multi-process driver ===
+def run(settings=None, options=None):
+    """
+    Process every PDF under `settings.pdf_path` with a pool of worker processes.
+
+    Files are sorted by name and results are appended to the CSV in that
+    order regardless of which worker finishes first, so the CSV is identical
+    for any number of workers.
+
+    With the manifest enabled, PDFs whose content and model weights are
+    unchanged since their last successful run are skipped, documents left
+    unfinished by a crash are redone, and the CSV is rewritten from the
+    manifest at the end of the run. Documents whose PDF, rendering settings
+    and detector weights are unchanged reuse their stored detections and are
+    only classified and written again. In shard output mode a Parquet index of
+    all finished shards is rebuilt at the end of the run.
+
+    Args:
+        settings (PipelineSettings or None): Per-document options, sent to every worker
+        options (RunOptions or None): Driver options (pool, manifest, model server, Ray, telemetry)
+
+    Returns:
+        dict: {'processed': int, 'skipped': int, 'failed': List[str], 'rows': int,
+               'pages': int, 'pages_skipped': int, 'duplicates': int,
+               'prefiltered': int, 'model_server': dict or None,
+               'images_written': int, 'bytes_written': int, 'encode_seconds': float, 'ray': dict or None,
+               'detections_reused': int,
+               'stages': {stage: {'busy_seconds', 'starved_seconds', 'blocked_seconds'}} (pipelined runs)}
+    """
+    options = options or RunOptions()
+    settings = (settings or PipelineSettings()).resolved()
+    csv_path = options.csv_path or config.CSV_PATH
+    caption_csv_path = options.caption_csv_path or config.CAPTION_TEXT_PATH
+    if options.backend is not None:
+        config.INFERENCE_BACKEND = options.backend
+    if options.int8 is not None:
+        config.QUANTIZE_INT8 = options.int8
+    backend = (config.INFERENCE_BACKEND, config.QUANTIZE_INT8)
+    if settings.output_mode == 'files':
+        for folder in settings.output_dirs.values():
+            os.makedirs(folder, exist_ok=True)
+
+    cpu_count = os.cpu_count() or 1
+    workers = options.workers or cpu_count
+    threads_per_worker = options.threads_per_worker or max(1, cpu_count // workers)
+    preload = options.preload
+    use_model_server = options.use_model_server
+
+    files = sorted(f for f in os.listdir(settings.pdf_path) if f.lower().endswith('.pdf'))[options.start:options.stop]
+    summary = {'processed': 0, 'skipped': 0, 'failed': [], 'rows': 0, 'pages': 0, 'pages_skipped': 0,
+               'duplicates': 0, 'prefiltered': 0, 'model_server': None, 'stages': {},
+               'images_written': 0, 'bytes_written': 0, 'encode_seconds': 0.0, 'ray': None, 'detections_reused': 0}
+
+    # === Decide which files need work ===
+    manifest = Manifest(options.manifest_path) if options.use_manifest else None
+    detections_dir = options.detections_path or config.DETECTIONS_PATH
+    doc_keys = {}
+    detection_paths = {}
+    if manifest is not None:
+        fingerprints = manifest.model_fingerprints()
+        # Settings of the rendering and detection stage, and of classification and writing
+        render_settings = {'zoom_factor': settings.zoom_factor}
+        output_settings = {}
+        if settings.two_pass:
+            render_settings.update(two_pass=True, detect_zoom=settings.detect_zoom)
+        if settings.prefilter:
+            render_settings.update(prefilter='conservative' if settings.conservative else 'default')
+        if backend != ('eager', False):
+            render_settings.update(backend=backend[0], int8=backend[1])
+            output_settings.update(backend=backend[0], int8=backend[1])
+        if settings.stat_prefilter:
+            output_settings.update(stat_threshold=settings.stat_threshold)
+        if settings.output_mode != 'files':
+            output_settings.update(output_mode=settings.output_mode)
+        if (settings.image_format, settings.image_quality) != ('png', None):
+            output_settings.update(image_format=settings.image_format, image_quality=settings.image_quality)
+        if settings.dedup:
+            output_settings.update(dedup=os.path.abspath(settings.dedup_path))
+        pending = []
+        seen = set()
+        for file in files:
+            content_hash = manifest.content_hash(os.path.join(settings.pdf_path, file))
+            if content_hash in seen:
+                logging.info(f"{file}: identical content already listed, skipping")
+                summary['skipped'] += 1
+                continue
+            seen.add(content_hash)
+            detection_key = manifest.detection_key(content_hash, render_settings, fingerprints)
+            key = manifest.document_key(detection_key, output_settings, fingerprints)
+            done = manifest.is_done(content_hash, key)
+            if done and settings.output_mode == 'shards' and not all(
+                    os.path.exists(os.path.join(settings.shard_path, shard)) for shard in manifest.outputs(content_hash)):
+                # The worker stopped before finishing the shard holding this document's images
+                done = False
+            if done:
+                summary['skipped'] += 1
+                continue
+            if options.store_detections:
+                detection_paths[file] = os.path.join(detections_dir, f"{detection_key}.npz")
+            if file in detection_paths and os.path.exists(detection_paths[file]):
+                logging.info(f"{file}: classifiers or output settings changed, reusing stored detections")
+            else:
+                logging.info(f"{file}: new or changed, reprocessing")
+            doc_keys[file] = (content_hash, key, detection_key)
+            manifest.mark_running(content_hash, file, key, detection_key)
+            pending.append(file)
+        files = pending
+
+    logging.info(f"Processing {len(files)} PDFs ({summary['skipped']} up to date) "
+                 f"with {workers} workers x {threads_per_worker} threads")
+
+    if options.trace_path is not None or options.metrics_port is not None:
+        telemetry.enable(options.trace_path)
+        if options.metrics_port is not None:
+            telemetry.serve(options.metrics_port)
+            logging.info(f"Metrics at http://127.0.0.1:{options.metrics_port}/metrics")
+
+    server = None
+    if options.ray_address is not None and (use_model_server or preload):
+        logging.warning("--model-server and --preload are ignored with Ray (models live in one actor per node)")
+        use_model_server = preload = False
+    if use_model_server:
+        if preload:
+            logging.warning("--preload is ignored with the model server")
+            preload = False
+        server = model_server.ModelServer(workers, max_batch_size=options.server_batch_size,
+                                          max_wait_ms=options.server_wait_ms).start()
+
+    if preload:
+        torch.set_num_threads(threads_per_worker)
+        vision_crop.registry.preload_for_fork()
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context('spawn')
+
+    try:
+        with ExitStack() as stack:
+            # Both executors yield results in submission order → deterministic CSV
+            if options.ray_address is not None:
+                from project_function import ray_pipeline
+
+                summary['ray'] = {}
+                address = None if options.ray_address == 'local' else options.ray_address
+                results = ray_pipeline.map_pdfs(files, settings, address=address, workers_per_node=options.workers,
+                                                model_threads=options.ray_model_threads,
+                                                backend=backend, metrics=summary['ray'],
+                                                telemetry_settings=telemetry.settings(),
+                                                locality=options.ray_locality, detection_paths=detection_paths)
+                # Shuts Ray down even if the loop below stops early
+                stack.callback(results.close)
+            else:
+                executor = stack.enter_context(ProcessPoolExecutor(
+                    max_workers=workers, mp_context=context, initializer=_init_worker,
+                    initargs=(threads_per_worker, not preload, backend, server.handles() if server is not None else None,
+                              telemetry.settings())))
+                results = executor.map(_process_pdf_safe,
+                                       [(file, settings, detection_paths.get(file)) for file in files],
+                                       chunksize=options.chunksize)
+            for file, rows, captions, stats, error in results:
+                if 'telemetry' in stats:
+                    telemetry.merge(stats.pop('telemetry'))
+                if error:
+                    logging.error(f"Error processing {file}: {error}")
+                    summary['failed'].append(file)
+                    if manifest is not None:
+                        content_hash, key, detection_key = doc_keys[file]
+                        manifest.mark_failed(content_hash, file, key, error, detection_key)
+                    continue
+
+                if manifest is not None:
+                    content_hash, key, detection_key = doc_keys[file]
+                    manifest.mark_done(content_hash, file, key, rows, captions, stats.get('shards'), detection_key)
+                else:
+                    # Without a manifest, rows are appended as documents finish
+                    _append_csv(csv_path, CSV_COLUMNS, rows)
+                    if settings.text_captions:
+                        _append_csv(caption_csv_path, CAPTION_COLUMNS, captions)
+                summary['processed'] += 1
+                summary['rows'] += len(rows)
+                summary['pages'] += stats.get('pages', 0)
+                summary['pages_skipped'] += stats.get('skipped', 0)
+                summary['duplicates'] += stats.get('duplicates', 0)
+                summary['prefiltered'] += stats.get('prefiltered', 0)
+                summary['detections_reused'] += stats.get('detections_reused', 0)
+                for key in ('images_written', 'bytes_written', 'encode_seconds'):
+                    summary[key] += stats.get(key, 0)
+                for stage, stage_stats in stats.get('stages', {}).items():
+                    totals = summary['stages'].setdefault(stage, dict.fromkeys(
+                        ('busy_seconds', 'starved_seconds', 'blocked_seconds'), 0.0))
+                    for key in totals:
+                        totals[key] += stage_stats[key]
+                logging.info(f"Processed {file}: {len(rows)} TEM images, "
+                             f"{stats.get('skipped', 0)}/{stats.get('pages', 0)} pages skipped by pre-filter")
+        if summary['ray'] is not None:
+            logging.info(f"Ray: {summary['ray']}")
+    finally:
+        if server is not None:
+            summary['model_server'] = server.metrics()
+            logging.info(f"Model server: {summary['model_server']}")
+            server.stop()
+        if settings.output_mode == 'shards':
+            # Workers have exited here, so every shard is finished
+            index = shards.build_index(settings.shard_path)
+            logging.info(f"Shard index: {index['key'].nunique()} images in {index['shard'].nunique()} shards")
+        if manifest is not None:
+            manifest.export_csv(csv_path, CSV_COLUMNS)
+            if settings.text_captions:
+                manifest.export_csv(caption_csv_path, CAPTION_COLUMNS, field='captions')
+            manifest.prune_detections(detections_dir)
+            manifest.close()
+        if telemetry.enabled():
+            telemetry.write_metrics()
+            telemetry.stop_server()
+            telemetry.disable()
+
+    return summary
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='TEM figure extraction pipeline')
+    parser.add_argument('--pdf-dir', default=None, help='Input PDF directory (default: config.PDF_PATH)')
+    parser.add_argument('--csv', default=None, help='Output CSV path (default: config.CSV_PATH)')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--threads-per-worker', type=int, default=None, help='torch threads per worker (default: CPU count / workers)')
+    parser.add_argument('--zoom', type=float, default=5, help='PDF rendering zoom factor (default: 5)')
+    parser.add_argument('--batch-size', type=int, default=16, help='Batch size for detection and classification (default: 16)')
+    parser.add_argument('--start', type=int, default=0, help='Index of the first PDF to process (default: 0)')
+    parser.add_argument('--stop', type=int, default=None, help='Index after the last PDF to process (default: all)')
+    parser.add_argument('--preload', action='store_true', help='Load models once in the parent and fork workers')
+    parser.add_argument('--two-pass', action='store_true', help='Detect at --detect-zoom, re-render only figure regions at --zoom')
+    parser.add_argument('--detect-zoom', type=float, default=1.5, help='Detection zoom for --two-pass (default: 1.5)')
+    parser.add_argument('--prefilter', action='store_true', help='Skip text-only pages before rendering')
+    parser.add_argument('--conservative', action='store_true', help='Only skip pages with no images and almost no vector graphics')
+    parser.add_argument('--no-text-captions', action='store_true', help='Do not read caption text from the PDF text layer')
+    parser.add_argument('--caption-csv', default=None, help='Caption text CSV (default: config.CAPTION_TEXT_PATH)')
+    parser.add_argument('--dedup', action='store_true', help='Skip near-duplicate TEM sub-images (perceptual hash index)')
+    parser.add_argument('--dedup-index', default=None, help='Perceptual hash index path (default: config.PHASH_INDEX_PATH)')
+    parser.add_argument('--stat-prefilter', action='store_true', help='Label obvious non-micrographs None without the ResNet')
+    parser.add_argument('--stat-threshold', type=float, default=None, help='Pre-filter reject threshold (default: config.STAT_PREFILTER_THRESHOLD)')
+    parser.add_argument('--backend', choices=inference_backends.BACKENDS, default=None,
+                        help='Inference backend (default: config.INFERENCE_BACKEND)')
+    parser.add_argument('--int8', action='store_true', default=None, help='Dynamic int8 quantization (default: config.QUANTIZE_INT8)')
+    parser.add_argument('--model-server', action='store_true', help='Host the models once in a shared local server process')
+    parser.add_argument('--server-batch-size', type=int, default=32, help='Model server max batch size (default: 32)')
+    parser.add_argument('--server-wait-ms', type=float, default=5, help='Model server max batching wait in ms (default: 5)')
+    parser.add_argument('--pipelined', action='store_true', help='Overlap rendering, detection, classification and writing')
+    parser.add_argument('--queue-size', type=int, default=4, help='Pages buffered between pipelined stages (default: 4)')
+    parser.add_argument('--classify-workers', type=int, default=1, help='Threads of the pipelined classification stage (default: 1)')
+    parser.add_argument('--output-mode', choices=('files', 'shards'), default=None,
+                        help='Loose PNG files or tar shards with a Parquet index (default: config.OUTPUT_MODE)')
+    parser.add_argument('--shard-dir', default=None, help='Shard directory (default: config.SHARD_PATH)')
+    parser.add_argument('--image-format', choices=tuple(image_writer.IMAGE_FORMATS), default=None,
+                        help='Output image format: png, lossless webp, or jpeg previews (default: config.IMAGE_FORMAT)')
+    parser.add_argument('--image-quality', type=int, default=None,
+                        help='PNG compression level 0-9, WebP quality (>100 lossless) or JPEG quality (default: format default)')
+    parser.add_argument('--writer-threads', type=int, default=None,
+                        help='Background image encoding threads per worker, 0 = inline (default: config.IMAGE_WRITER_THREADS)')
+    parser.add_argument('--ray', nargs='?', const='local', default=None, metavar='ADDRESS',
+                        help="Run on Ray: alone starts a local cluster, or give a cluster address such as 'auto' "
+                             "(--workers is then PDF workers per node)")
+    parser.add_argument('--ray-model-threads', type=int, default=None,
+                        help='torch threads of the model actor on each Ray node (default: CPUs not used by workers)')
+    parser.add_argument('--ray-locality', action='append', default=None, metavar='NODE=DIR',
+                        help='PDFs in this node-local directory are processed on that node (IP, hostname or node ID; repeatable)')
+    parser.add_argument('--manifest', default=None, help='SQLite manifest path (default: config.MANIFEST_PATH)')
+    parser.add_argument('--no-manifest', action='store_true', help='Reprocess every PDF and append to the CSV')
+    parser.add_argument('--detections-dir', default=None,
+                        help='Stored detector outputs per PDF (default: config.DETECTIONS_PATH)')
+    parser.add_argument('--no-store-detections', action='store_true',
+                        help='Do not store detector outputs; any model change then redoes the whole PDF')
+    parser.add_argument('--trace', default=None, metavar='FILE',
+                        help='Append document/page/stage spans and a metrics snapshot to this JSONL file')
+    parser.add_argument('--metrics-port', type=int, default=None, metavar='PORT',
+                        help='Serve live Prometheus metrics on http://127.0.0.1:PORT/metrics')
+    return parser.parse_args()
+
+
+def main():
+    """Main program entry point"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_arguments()
+
+    settings = PipelineSettings(
+        pdf_path=args.pdf_dir,
+        zoom_factor=args.zoom,
+        batch_size=args.batch_size,
+        two_pass=args.two_pass,
+        detect_zoom=args.detect_zoom,
+        prefilter=args.prefilter,
+        conservative=args.conservative,
+        text_captions=not args.no_text_captions,
+        dedup=args.dedup,
+        dedup_path=args.dedup_index,
+        stat_prefilter=args.stat_prefilter,
+        stat_threshold=args.stat_threshold,
+        pipelined=args.pipelined,
+        queue_size=args.queue_size,
+        stage_workers={'classify': args.classify_workers},
+        output_mode=args.output_mode,
+        shard_path=args.shard_dir,
+        image_format=args.image_format,
+        image_quality=args.image_quality,
+        writer_threads=args.writer_threads
+    )
+    options = RunOptions(
+        csv_path=args.csv,
+        caption_csv_path=args.caption_csv,
+        workers=args.workers,
+        threads_per_worker=args.threads_per_worker,
+        start=args.start,
+        stop=args.stop,
+        preload=args.preload,
+        manifest_path=args.manifest,
+        use_manifest=not args.no_manifest,
+        detections_path=args.detections_dir,
+        store_detections=not args.no_store_detections,
+        backend=args.backend,
+        int8=args.int8,
+        use_model_server=args.model_server,
+        server_batch_size=args.server_batch_size,
+        server_wait_ms=args.server_wait_ms,
+        ray_address=args.ray,
+        ray_model_threads=args.ray_model_threads,
+        ray_locality=dict(entry.split('=', 1) for entry in args.ray_locality) if args.ray_locality else None,
+        trace_path=args.trace,
+        metrics_port=args.metrics_port
+    )
+    summary = run(settings, options)
+    logging.info(f"Done: {summary['processed']} PDFs, {summary['skipped']} skipped, "
+                 f"{summary['rows']} TEM images, {len(summary['failed'])} failed, "
+                 f"{summary['pages_skipped']}/{summary['pages']} pages skipped by pre-filter, "
+                 f"{summary['duplicates']} duplicate sub-images, "
+                 f"{summary['prefiltered']} sub-images rejected by the statistical pre-filter")
+    logging.info(f"Images written: {summary['images_written']} "
+                 f"({summary['bytes_written'] / 1e6:.1f} MB, {summary['encode_seconds']:.1f}s encoding)")
+    for stage, totals in summary['stages'].items():
+        logging.info(f"Stage {stage}: busy {totals['busy_seconds']:.1f}s, "
+                     f"starved {totals['starved_seconds']:.1f}s, blocked {totals['blocked_seconds']:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
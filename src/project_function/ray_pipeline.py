@@ -0,0 +1,324 @@
+"""
+Ray execution mode: the extraction chain on a local or multi-node Ray cluster.
+
+Every node runs one `ModelActor` holding the five vision_crop models and a
+few `PdfWorker` actors. A worker renders its PDFs and runs
+`pipeline.process_pdf` with the model registry pointed at its node's model
+actor. Rendered pages and classifier batches reach the model actor through
+the node's shared-memory object store, where they are read without copying,
+instead of being pickled through a queue.
+
+PDFs are sharded across nodes by size (largest first onto the least loaded
+node). With a `locality` map, a node that keeps copies of some PDFs on a
+local disk gets those files in its shard and its workers read them from
+there; all other files are read from the shared filesystem. A node only
+takes files from another node's shard once its own shard is done. Actors
+are restarted and their calls retried when a worker process or a node dies.
+A document that still fails is reported like any other failed document, and
+the manifest redoes it on the next run; an error raised while processing a
+document fails only that document and leaves its worker running.
+
+On a multi-node cluster, every node needs the same checkout (model weights)
+and a shared filesystem for the PDFs and outputs:
+
+    ray start --head                       # first node
+    ray start --address=<head>:6379        # other nodes
+    python -m project_function.pipeline --ray auto
+    python -m project_function.pipeline --ray auto --ray-locality 10.0.0.2=/scratch/pdfs
+
+Without an address (`--ray`), a local single-node cluster is started.
+"""
+import logging
+import os
+from collections import deque
+from dataclasses import replace
+
+import cv2
+import numpy as np
+import ray
+import torch
+from ray.util.scheduling_strategies import NodeAffinitySchedulingStrategy
+
+from project_function import model_server, telemetry, vision_crop
+
+
+@ray.remote
+class ModelActor:
+    """Hosts the five vision_crop models of one node."""
+
+    def __init__(self, backend, num_threads):
+        from project_function import config
+
+        config.INFERENCE_BACKEND, config.QUANTIZE_INT8 = backend
+        torch.set_num_threads(num_threads)
+        vision_crop.registry.warmup()
+        vision_crop._load_classifiers()
+        self.device = vision_crop.TEM_classifier.device
+        self.calls = 0
+        self.images = 0
+
+    def run(self, name, arrays):
+        """
+        Run model `name` on a list of BGR images (detectors) or 3×224×224 input arrays (classifiers).
+
+        Returns:
+            list: (xyxy, conf, cls) arrays per image for detectors, logits per input for classifiers
+        """
+        model = vision_crop.registry.get(name)
+        self.calls += 1
+        self.images += len(arrays)
+        if name in model_server.CLASSIFIER_NAMES:
+            with torch.no_grad():
+                return list(model(torch.from_numpy(np.stack(arrays)).to(self.device)).cpu().numpy())
+        return [(result.boxes.xyxy.cpu().numpy(), result.boxes.conf.cpu().numpy(), result.boxes.cls.cpu().numpy())
+                for result in model(list(arrays), verbose=False)]
+
+    def metrics(self):
+        return {'calls': self.calls, 'images': self.images}
+
+
+class _ActorClient:
+    """`model_server.ModelClient` counterpart that sends each call to a ModelActor."""
+
+    def __init__(self, actor):
+        self.actor = actor
+
+    def call(self, name, arrays):
+        return ray.get(self.actor.run.remote(name, list(arrays)))
+
+
+@ray.remote
+class PdfWorker:
+    """
+    Processes whole PDFs in its own process, using the models of its node's ModelActor.
+    The model actor is looked up by name, so a restarted worker finds it again.
+    With `telemetry_settings`, its metrics are returned with each result.
+    """
+
+    def __init__(self, model_actor_name, num_threads, telemetry_settings=None):
+        if telemetry_settings is not None:
+            telemetry.enable(**telemetry_settings)
+        torch.set_num_threads(num_threads)
+        cv2.setNumThreads(num_threads)
+        client = _ActorClient(ray.get_actor(model_actor_name))
+        for name in model_server.DETECTOR_NAMES:
+            vision_crop.registry.register(name, lambda name=name: model_server.RemoteDetector(client, name))
+        for name in model_server.CLASSIFIER_NAMES:
+            vision_crop.registry.register(name, lambda name=name: model_server.RemoteClassifier(client, name))
+
+    def process(self, file, settings, detections_path=None):
+        """Same result tuple as `pipeline._process_pdf_safe`: (file, rows, captions, stats, error)."""
+        from project_function import pipeline
+
+        return pipeline._process_pdf_safe((file, settings, detections_path))
+
+    def finish(self):
+        """Flush queued images and finish open shards before the actor is killed."""
+        from project_function import pipeline
+
+        for writer in pipeline._image_writers.values():
+            writer.close()
+        for writer in pipeline._shard_writers.values():
+            writer.close()
+
+
+@ray.remote(num_cpus=0)
+def _list_local_pdfs(directory):
+    """PDF file names in a node-local directory (empty if the node does not have it)."""
+    if not os.path.isdir(directory):
+        return []
+    return [f for f in os.listdir(directory) if f.lower().endswith('.pdf')]
+
+
+def _node_matches(node, key):
+    """Whether a `locality` key names this node (IP address, hostname or node ID)."""
+    return key in (node['NodeManagerAddress'], node['NodeManagerHostname'], node['NodeID'])
+
+
+def find_local_files(files, nodes, locality):
+    """
+    Find the files each node keeps on a local disk.
+
+    Args:
+        files (List[str]): File names
+        nodes (List[dict]): Alive nodes as returned by `ray.nodes()`
+        locality (dict): {node IP address, hostname or ID: local directory holding copies of some of the PDFs}
+
+    Returns:
+        Tuple[dict, dict]: ({file: [indexes into `nodes`]}, {node index: local directory})
+    """
+    directories = {}
+    for key, directory in locality.items():
+        matches = [i for i, node in enumerate(nodes) if _node_matches(node, key)]
+        if not matches:
+            logging.warning(f"Ray locality: no alive node matches {key!r}, its files are read from the shared path")
+        for i in matches:
+            directories[i] = directory
+    listings = ray.get([
+        _list_local_pdfs.options(scheduling_strategy=NodeAffinitySchedulingStrategy(nodes[i]['NodeID'], soft=False))
+        .remote(directory) for i, directory in directories.items()])
+    wanted = set(files)
+    local = {}
+    for i, names in zip(directories, listings):
+        for name in wanted.intersection(names):
+            local.setdefault(name, []).append(i)
+    return local, directories
+
+
+def shard_by_size(files, sizes, num_shards, local=None):
+    """
+    Split files into `num_shards` lists of similar total size (largest file first onto
+    the lightest shard). A file stored on some nodes only goes to the lightest of those
+    nodes' shards. The result only depends on names, sizes and locations, so a rebuild
+    sends the same files to the same nodes.
+
+    Args:
+        files (List[str]): File names
+        sizes (dict): {file: bytes}
+        num_shards (int): Number of shards (nodes)
+        local (dict or None): {file: [shard indexes of the nodes that store it locally]}
+
+    Returns:
+        List[List[str]]: Files per shard, largest first
+    """
+    local = local or {}
+    shards = [[] for _ in range(num_shards)]
+    loads = [0] * num_shards
+    for file in sorted(files, key=lambda f: (-sizes[f], f)):
+        i = min(local.get(file) or range(num_shards), key=lambda s: (loads[s], s))
+        shards[i].append(file)
+        loads[i] += sizes[file]
+    return shards
+
+
+def map_pdfs(files, settings, address=None, workers_per_node=None, model_threads=None, backend=('eager', False),
+             max_retries=2, metrics=None, telemetry_settings=None, locality=None, detection_paths=None):
+    """
+    Process PDFs on a Ray cluster.
+
+    Args:
+        files (List[str]): PDF file names inside `settings.pdf_path`
+        settings (pipeline.PipelineSettings): Resolved settings of `pipeline.process_pdf` (paths must be
+            valid on every node)
+        address (str or None): Cluster address ('auto', 'ray://host:10001'), or None for a local cluster
+        workers_per_node (int or None): PdfWorker actors per node (default: half the node's CPUs)
+        model_threads (int or None): torch threads of each ModelActor (default: the remaining CPUs)
+        backend (Tuple[str, bool]): (inference backend, int8) of the model actors
+        max_retries (int): Restarts of a crashed actor, and resubmissions of a document whose
+            worker died for good
+        metrics (dict or None): Filled with 'nodes', 'workers', 'resubmitted', 'local_files' and per-node
+            'models' counters
+        telemetry_settings (dict or None): `telemetry.settings()` of the driver; the trace file must
+            then be on the shared filesystem
+        locality (dict or None): {node IP address, hostname or ID: node-local directory}. PDFs found in a
+            node's directory (same file names as in `settings.pdf_path`) are sharded onto that node and read
+            from that directory
+        detection_paths (dict or None): {file: stored detections of `pipeline.process_pdf`}, on the
+            shared filesystem
+
+    Yields:
+        Tuple: (file, rows, captions, stats, error) per file, in the order of `files`.
+        Closing the generator early still flushes the workers' queued images and shards.
+    """
+    ray.init(address=address, ignore_reinit_error=True, logging_level=logging.WARNING)
+    metrics = metrics if metrics is not None else {}
+    detection_paths = detection_paths or {}
+    workers = {}
+    try:
+        nodes = [node for node in ray.nodes() if node['Alive'] and node['Resources'].get('CPU')]
+        models = {}
+        for node in nodes:
+            cpus = int(node['Resources']['CPU'])
+            count = min(workers_per_node or max(1, cpus // 2), cpus)
+            threads = model_threads or max(1, cpus - count)
+            # Soft affinity: an actor whose node died is restarted elsewhere
+            placement = NodeAffinitySchedulingStrategy(node['NodeID'], soft=True)
+            name = f"tem-models-{node['NodeID']}"
+            model = ModelActor.options(name=name, num_cpus=0, scheduling_strategy=placement, max_restarts=max_retries,
+                                       max_task_retries=max_retries).remote(backend, threads)
+            models[node['NodeID']] = model
+            # Workers only render, crop and write; one thread each, the model actor gets the rest
+            workers[node['NodeID']] = [
+                PdfWorker.options(num_cpus=1, scheduling_strategy=placement, max_restarts=max_retries,
+                                  max_task_retries=max_retries).remote(name, 1, telemetry_settings)
+                for _ in range(count)]
+        metrics.update(nodes=len(nodes), workers=sum(len(w) for w in workers.values()), resubmitted=0)
+        logging.info(f"Ray: {len(nodes)} nodes, {metrics['workers']} PDF workers")
+
+        sizes = {file: os.path.getsize(os.path.join(settings.pdf_path, file)) for file in files}
+        local, directories = find_local_files(files, nodes, locality) if locality else ({}, {})
+        local_settings = {nodes[i]['NodeID']: replace(settings, pdf_path=directory)
+                          for i, directory in directories.items()}
+        local_nodes = {file: {nodes[i]['NodeID'] for i in indexes} for file, indexes in local.items()}
+        metrics['local_files'] = len(local)
+        queues = {node_id: deque(shard)
+                  for node_id, shard in zip(workers, shard_by_size(files, sizes, len(workers), local))}
+
+        def next_file(node_id):
+            if queues[node_id]:
+                return queues[node_id].popleft()
+            # Own shard done: take the smallest file of the node with the most work left
+            donor = max(queues, key=lambda n: len(queues[n]))
+            return queues[donor].pop() if queues[donor] else None
+
+        in_flight = {}   # ref → (file, worker, node id)
+        attempts = {}
+
+        def submit(worker, node_id):
+            file = next_file(node_id)
+            if file is not None:
+                # A file stored on this node is read from its local copy
+                file_settings = local_settings[node_id] if node_id in local_nodes.get(file, ()) else settings
+                in_flight[worker.process.remote(file, file_settings, detection_paths.get(file))] = (file, worker, node_id)
+
+        for node_id, node_workers in workers.items():
+            for worker in node_workers:
+                submit(worker, node_id)
+
+        results = {}
+        position = 0
+        while in_flight:
+            [ref], _ = ray.wait(list(in_flight), num_returns=1)
+            file, worker, node_id = in_flight.pop(ref)
+            try:
+                results[file] = ray.get(ref)
+                submit(worker, node_id)
+            except ray.exceptions.RayTaskError as e:
+                # Raised inside `process`: the worker is fine, only this document failed
+                logging.error(f"Ray worker failed on {file}: {e}")
+                results[file] = (file, [], [], {}, f"{type(e.cause).__name__}: {e.cause}")
+                submit(worker, node_id)
+            except ray.exceptions.RayError as e:
+                # The worker is gone for good (restarts used up or node lost): retire it and requeue the file
+                workers[node_id].remove(worker)
+                attempts[file] = attempts.get(file, 0) + 1
+                if attempts[file] <= max_retries and any(workers.values()):
+                    logging.warning(f"Ray worker lost while processing {file}, resubmitting: {e}")
+                    metrics['resubmitted'] += 1
+                    queues[node_id].appendleft(file)
+                    # Wake a worker that already ran out of files
+                    busy = [busy_worker for _, busy_worker, _ in in_flight.values()]
+                    idle = [(w, n) for n, node_workers in workers.items() for w in node_workers
+                            if all(w is not b for b in busy)]
+                    if idle:
+                        submit(*idle[0])
+                else:
+                    results[file] = (file, [], [], {}, f"{type(e).__name__}: {e}")
+
+            while position < len(files) and files[position] in results:
+                yield results.pop(files[position])
+                position += 1
+
+        # Files left over because every worker died
+        for file in files[position:]:
+            yield results.pop(file, (file, [], [], {}, "No Ray workers left"))
+
+        metrics['models'] = {node_id[:8]: counters for node_id, counters in
+                             zip(models, ray.get([model.metrics.remote() for model in models.values()]))}
+    finally:
+        # Also when the caller stops early: a worker finishes its current document first, then flushes
+        try:
+            ray.get([worker.finish.remote() for node_workers in workers.values() for worker in node_workers])
+        except ray.exceptions.RayError as e:
+            logging.warning(f"Ray workers could not flush their output: {e}")
+        ray.shutdown()
@@ -0,0 +1,236 @@
+"""
+Sharded dataset output: images and metadata packed into WebDataset-style tar
+shards with a Parquet index, instead of one file per image.
+
+Each sample is stored as `<kind>/<stem>.png` plus `<kind>/<stem>.json`
+(WebDataset groups members by key, here `<kind>/<stem>`). A shard is written
+to `<name>.tar.tmp` and renamed when it is closed, together with a
+`<name>.parquet` index of its members, so readers never see partial shards.
+`build_index` merges the per-shard indexes into `index.parquet`.
+"""
+import glob
+import io
+import json
+import mmap
+import os
+import tarfile
+import time
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from project_function import config
+
+INDEX_COLUMNS = ['key', 'kind', 'name', 'member', 'shard', 'offset', 'size', 'written', 'meta']
+
+
+class ShardWriter:
+    """
+    Append samples to size-bounded tar shards.
+
+    Args:
+        out_dir (str): Shard directory (default: config.SHARD_PATH)
+        max_bytes (int): Start a new shard once the current one reaches this size
+        max_samples (int): Start a new shard after this many samples
+        prefix (str): Shard file name prefix; the process id and start time are appended
+            so concurrent workers never share a shard
+    """
+
+    def __init__(self, out_dir=None, max_bytes=None, max_samples=None, prefix='tem'):
+        self.out_dir = out_dir or config.SHARD_PATH
+        self.max_bytes = max_bytes or config.SHARD_MAX_BYTES
+        self.max_samples = max_samples or config.SHARD_MAX_SAMPLES
+        self.prefix = f"{prefix}-{os.getpid()}-{time.time_ns()}"
+        os.makedirs(self.out_dir, exist_ok=True)
+
+        self._shard_num = 0
+        self._tar = None
+        self._name = None
+        self._entries = []
+        self._samples = 0
+
+    @property
+    def current_shard(self):
+        """Final file name of the shard being written (None if no shard is open)."""
+        return self._name
+
+    def _open(self):
+        self._name = f"{self.prefix}-{self._shard_num:06d}.tar"
+        self._tar = tarfile.open(os.path.join(self.out_dir, self._name + '.tmp'), 'w', format=tarfile.PAX_FORMAT)
+        self._entries = []
+        self._samples = 0
+        self._shard_num += 1
+
+    def write(self, key, members, meta=None):
+        """
+        Write one sample.
+
+        Args:
+            key (str): Sample key (e.g., 'tem_image/PDFpaper_Image1_1')
+            members (dict): {extension: bytes} (e.g., {'png': ..., 'json': ...})
+            meta (dict or None): Extra metadata stored in the index
+
+        Returns:
+            str: Final name of the shard the sample was written to
+        """
+        if self._tar is None:
+            self._open()
+
+        kind, _, name = key.rpartition('/')
+        written = time.time()
+        for ext, data in members.items():
+            info = tarfile.TarInfo(f"{key}.{ext}")
+            info.size = len(data)
+            info.mtime = int(written)
+            # Data starts after the header block(s) at the current end of the archive
+            offset = self._tar.offset + len(info.tobuf(self._tar.format, self._tar.encoding, self._tar.errors))
+            self._tar.addfile(info, io.BytesIO(data))
+            self._entries.append((key, kind, name, info.name, self._name, offset, len(data), written,
+                                  json.dumps(meta or {})))
+
+        shard = self._name
+        self._samples += 1
+        if self._tar.offset >= self.max_bytes or self._samples >= self.max_samples:
+            self.close()
+        return shard
+
+    def write_image(self, kind, name, image, meta=None):
+        """
+        Encode `image` in the format given by the extension of `name` and write it
+        with its metadata as sample '<kind>/<stem of name>'.
+
+        Returns:
+            str: Final name of the shard the sample was written to
+        """
+        ok, encoded = cv2.imencode(os.path.splitext(name)[1], image)
+        if not ok:
+            raise ValueError(f"Could not encode '{name}'")
+        return self.write_encoded(kind, name, encoded.tobytes(), meta)
+
+    def write_encoded(self, kind, name, data, meta=None):
+        """
+        Write an already encoded image (extension taken from `name`) and its metadata
+        as sample '<kind>/<stem of name>'.
+
+        Returns:
+            str: Final name of the shard the sample was written to
+        """
+        stem, ext = os.path.splitext(name)
+        meta = {'kind': kind, 'image_name': name, **(meta or {})}
+        return self.write(f"{kind}/{stem}", {ext[1:]: data, 'json': json.dumps(meta).encode('utf-8')}, meta)
+
+    def close(self):
+        """Finish the current shard: write its index, then atomically rename both into place."""
+        if self._tar is None:
+            return
+        self._tar.close()
+        base = os.path.join(self.out_dir, self._name)
+        index = pd.DataFrame(self._entries, columns=INDEX_COLUMNS)
+        index.to_parquet(base[:-len('.tar')] + '.parquet.tmp', index=False)
+        os.replace(base[:-len('.tar')] + '.parquet.tmp', base[:-len('.tar')] + '.parquet')
+        os.replace(base + '.tmp', base)
+        self._tar = None
+        self._name = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def build_index(out_dir=None):
+    """
+    Merge the per-shard indexes of finished shards into `<out_dir>/index.parquet`.
+    When a sample key was written more than once (a document processed again),
+    the latest copy wins.
+
+    Args:
+        out_dir (str or None): Shard directory (default: config.SHARD_PATH)
+
+    Returns:
+        pd.DataFrame: The merged index
+    """
+    out_dir = out_dir or config.SHARD_PATH
+    parts = [pd.read_parquet(path) for path in sorted(glob.glob(os.path.join(out_dir, '*.parquet')))
+             if os.path.basename(path) != 'index.parquet' and os.path.exists(path[:-len('.parquet')] + '.tar')]
+    index = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=INDEX_COLUMNS)
+    index = (index.sort_values('written', kind='stable')
+                  .drop_duplicates(['key', 'member'], keep='last')
+                  .sort_values(['kind', 'name', 'member'], kind='stable')
+                  .reset_index(drop=True))
+
+    tmp_path = os.path.join(out_dir, 'index.parquet.tmp')
+    index.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, os.path.join(out_dir, 'index.parquet'))
+    return index
+
+
+class ShardReader:
+    """
+    Random access to samples through the Parquet index and memory-mapped shards.
+
+    Args:
+        out_dir (str or None): Shard directory with an index.parquet (default: config.SHARD_PATH)
+    """
+
+    def __init__(self, out_dir=None):
+        self.out_dir = out_dir or config.SHARD_PATH
+        self.index = pd.read_parquet(os.path.join(self.out_dir, 'index.parquet'))
+        self._members = {member: i for i, member in enumerate(self.index['member'])}
+        # Sample key → image member extension (png, webp or jpg)
+        self._image_ext = {member.rsplit('.', 1)[0]: member.rsplit('.', 1)[1]
+                           for member in self.index['member'] if not member.endswith('.json')}
+        self._maps = {}
+
+    def __len__(self):
+        """Number of samples."""
+        return self.index['key'].nunique()
+
+    def keys(self, kind=None):
+        """Sample keys, optionally only of one kind ('tem_image', 'description' or 'pdf_image')."""
+        index = self.index if kind is None else self.index[self.index['kind'] == kind]
+        return list(dict.fromkeys(index['key']))
+
+    def _map(self, shard):
+        if shard not in self._maps:
+            with open(os.path.join(self.out_dir, shard), 'rb') as f:
+                self._maps[shard] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[shard]
+
+    def read(self, key, ext=None):
+        """
+        Return the bytes of member `<key>.<ext>` as a zero-copy view into the mapped shard
+        (valid until `close()`; release it before closing).
+
+        Args:
+            key (str): Sample key (e.g., 'tem_image/PDFpaper_Image1_1')
+            ext (str or None): Member extension (default: the sample's image)
+
+        Raises:
+            KeyError: If the member is not in the index
+        """
+        ext = ext or self._image_ext[key]
+        row = self.index.iloc[self._members[f"{key}.{ext}"]]
+        offset = int(row['offset'])
+        return memoryview(self._map(row['shard']))[offset:offset + int(row['size'])]
+
+    def read_image(self, key):
+        """Decode the image of sample `key` into a BGR array."""
+        return cv2.imdecode(np.frombuffer(self.read(key), dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def metadata(self, key):
+        """Return the JSON metadata stored with sample `key`."""
+        return json.loads(bytes(self.read(key, 'json')))
+
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
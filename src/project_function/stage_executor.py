@@ -0,0 +1,272 @@
+"""
+Stage-graph executor: runs a linear chain of stages concurrently, connected
+by bounded queues.
+
+Each stage has its own workers (threads, or threads driving a process pool
+for stages that hold the GIL). A full queue blocks the stage that feeds it,
+so at most `queue_size` items wait between two stages and memory stays
+bounded no matter how fast the source produces.
+
+    executor = StageExecutor([
+        Stage('detect', detect, workers=1),
+        Stage('classify', classify, workers=2),
+        Stage('write', write, workers=1, ordered=True),
+    ], queue_size=4)
+    for result in executor.run(pages):
+        ...
+    print(executor.stats())
+"""
+import heapq
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+_END = object()   # End-of-stream marker, one per downstream worker
+_POLL = 0.1       # Seconds between stop checks while blocked on a queue
+
+
+class Stage:
+    """
+    One step of the chain.
+
+    Args:
+        name (str): Stage name used in stats and errors
+        fn (Callable[[Any], Any]): Maps one item to the item passed downstream
+            (must be picklable for process stages)
+        workers (int): Concurrent workers
+        kind (str): 'thread' for I/O and GIL-releasing work (PyMuPDF, OpenCV, torch),
+            'process' for pure-Python work
+        ordered (bool): Receive items in source order (requires workers=1), e.g. for
+            a writer that numbers its outputs
+    """
+
+    def __init__(self, name, fn, workers=1, kind='thread', ordered=False):
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Stage '{name}': kind must be 'thread' or 'process', got '{kind}'")
+        if ordered and workers != 1:
+            raise ValueError(f"Stage '{name}': ordered stages must have exactly one worker")
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.kind = kind
+        self.ordered = ordered
+
+
+class _StageStats:
+    def __init__(self, workers):
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self.max_queue = 0
+        self.lock = threading.Lock()
+
+    def add(self, busy, starved, blocked):
+        with self.lock:
+            self.items += 1
+            self.busy += busy
+            self.starved += starved
+            self.blocked += blocked
+
+
+class StageExecutor:
+    """
+    Run items from a source iterator through `stages` with overlap between stages.
+
+    Args:
+        stages (List[Stage]): Stages in execution order
+        queue_size (int): Capacity of every queue between stages (backpressure bound)
+    """
+
+    def __init__(self, stages, queue_size=4):
+        if not stages:
+            raise ValueError("StageExecutor needs at least one stage")
+        self.stages = stages
+        self.queue_size = queue_size
+        self._stats = {}
+        self._source_stats = None
+        self._wall = 0.0
+        self._error = None
+        self._error_lock = threading.Lock()
+
+    def _fail(self, stage, error, stop):
+        """Keep the first error and stop every stage."""
+        with self._error_lock:
+            if self._error is None:
+                self._error = (stage, error)
+        stop.set()
+
+    # === Queue helpers that give up when the run is stopped ===
+    def _put(self, q, item, stop):
+        start = time.perf_counter()
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=_POLL)
+                return time.perf_counter() - start
+            except queue.Full:
+                continue
+        return time.perf_counter() - start
+
+    def _get(self, q, stop):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=_POLL)
+            except queue.Empty:
+                continue
+        return _END
+
+    # === Threads ===
+    def _feed(self, source, out_queue, end_count, stop):
+        stats = self._source_stats
+        iterator = None
+        try:
+            iterator = iter(source)
+            seq = 0
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                busy = time.perf_counter() - start
+                blocked = self._put(out_queue, (seq, item), stop)
+                stats.add(busy, 0.0, blocked)
+                stats.max_queue = max(stats.max_queue, out_queue.qsize())
+                seq += 1
+        except Exception as e:
+            self._fail('source', e, stop)
+        finally:
+            # Release generator resources (e.g., an open PDF) even when the run stopped early
+            if hasattr(iterator, 'close'):
+                iterator.close()
+            for _ in range(end_count):
+                self._put(out_queue, _END, stop)
+
+    def _work(self, stage, pool, in_queue, out_queue, end_count, remaining, stop):
+        stats = self._stats[stage.name]
+        pending = []      # Reorder heap for ordered stages
+        next_seq = 0
+
+        while True:
+            start = time.perf_counter()
+            message = self._get(in_queue, stop)
+            starved = time.perf_counter() - start
+            if message is _END:
+                break
+            if stage.ordered:
+                heapq.heappush(pending, message)
+                if pending[0][0] != next_seq:
+                    continue
+            ready = []
+            while pending and pending[0][0] == next_seq:
+                ready.append(heapq.heappop(pending))
+                next_seq += 1
+            if not stage.ordered:
+                ready = [message]
+
+            for seq, item in ready:
+                start = time.perf_counter()
+                try:
+                    item = pool.submit(stage.fn, item).result() if pool is not None else stage.fn(item)
+                except Exception as e:
+                    self._fail(stage.name, e, stop)
+                    break
+                busy = time.perf_counter() - start
+                blocked = self._put(out_queue, (seq, item), stop)
+                stats.add(busy, starved, blocked)
+                stats.max_queue = max(stats.max_queue, in_queue.qsize())
+                starved = 0.0
+
+        # The last worker of a stage closes the stream for the next one
+        with remaining[1]:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            for _ in range(end_count):
+                self._put(out_queue, _END, stop)
+
+    # === Public API ===
+    def run(self, source):
+        """
+        Run every item of `source` through the stages.
+
+        Yields:
+            Any: Output of the last stage per source item, in source order
+
+        Raises:
+            RuntimeError: If a stage (or the source) raised; the original exception is chained
+        """
+        stop = threading.Event()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        self._stats = {stage.name: _StageStats(stage.workers) for stage in self.stages}
+        self._source_stats = _StageStats(1)
+        self._error = None
+        pools = [ProcessPoolExecutor(max_workers=stage.workers) if stage.kind == 'process' else None
+                 for stage in self.stages]
+
+        threads = [threading.Thread(target=self._feed, name='stage-source', daemon=True,
+                                    args=(source, queues[0], self.stages[0].workers, stop))]
+        for i, stage in enumerate(self.stages):
+            end_count = self.stages[i + 1].workers if i + 1 < len(self.stages) else 1
+            remaining = [stage.workers, threading.Lock()]
+            for worker in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work, name=f"stage-{stage.name}-{worker}", daemon=True,
+                    args=(stage, pools[i], queues[i], queues[i + 1], end_count, remaining, stop)))
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        # Results leave in source order
+        pending = []
+        next_seq = 0
+        try:
+            while True:
+                message = self._get(queues[-1], stop)
+                if message is _END:
+                    break
+                heapq.heappush(pending, message)
+                while pending and pending[0][0] == next_seq:
+                    _, item = heapq.heappop(pending)
+                    next_seq += 1
+                    yield item
+            if self._error is not None:
+                stage, error = self._error
+                raise RuntimeError(f"Stage '{stage}' failed: {type(error).__name__}: {error}") from error
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            for pool in pools:
+                if pool is not None:
+                    pool.shutdown()
+            self._wall = time.perf_counter() - start
+
+    def stats(self):
+        """
+        Per-stage counters of the last run.
+
+        Returns:
+            dict: {stage name: {'items', 'workers', 'busy_seconds', 'starved_seconds', 'blocked_seconds',
+                   'utilization' (busy / (wall time × workers)), 'max_queue' (input queue high-water mark)}}.
+                   High 'starved_seconds' means the stage waits on its upstream; high 'blocked_seconds'
+                   means its downstream is the bottleneck. The source is reported as 'source'.
+        """
+        wall = max(self._wall, 1e-9)
+        result = {}
+        for name, stats in [('source', self._source_stats), *self._stats.items()]:
+            if stats is None:
+                continue
+            result[name] = {
+                'items': stats.items,
+                'workers': stats.workers,
+                'busy_seconds': stats.busy,
+                'starved_seconds': stats.starved,
+                'blocked_seconds': stats.blocked,
+                'utilization': stats.busy / (wall * stats.workers),
+                'max_queue': stats.max_queue,
+            }
+        return result
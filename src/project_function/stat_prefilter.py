@@ -0,0 +1,220 @@
+"""
+Cheap image statistics that reject obvious non-micrographs (colour plots,
+schematics, spectra) before the ResNet classifier runs.
+
+Validate a threshold against the binary classifier from the `src` directory:
+
+    python -m project_function.stat_prefilter path/to/sub_images --thresholds 0.6 0.7 0.8 0.9
+"""
+import argparse
+import os
+
+import cv2
+import numpy as np
+
+from project_function import config
+
+FEATURE_SIZE = 128   # Images are resized to FEATURE_SIZE × FEATURE_SIZE before computing statistics
+HIST_BINS = 64       # Gray-level bins for the histogram entropy (maximum entropy: 6 bits)
+
+
+# === Vectorized feature extraction ===
+def _stack(images, size=FEATURE_SIZE):
+    """Resize BGR, BGRA or grayscale images into one N×size×size×3 float32 array."""
+    batch = np.empty((len(images), size, size, 3), dtype=np.uint8)
+    for i, image in enumerate(images):
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        elif image.shape[2] == 4:
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+        batch[i] = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA)
+    return batch.astype(np.float32)
+
+
+def image_features(images):
+    """
+    Compute per-image statistics over a list of sub-images in one vectorized pass.
+
+    Args:
+        images (List[np.ndarray]): Sub-images in BGR, BGRA or grayscale
+
+    Returns:
+        dict: Arrays of shape (N,) with keys
+            'colorfulness' (Hasler–Süsstrunk metric, 0 for gray images),
+            'grayscale' (fraction of pixels whose channels differ by at most 10 levels),
+            'entropy' (gray-level histogram entropy in bits),
+            'edge_density' (fraction of pixels with a strong gradient),
+            'brightness' (mean gray level),
+            'aspect_ratio' (long side / short side of the original image)
+    """
+    n = len(images)
+    if n == 0:
+        return {key: np.empty(0, dtype=np.float32) for key in
+                ('colorfulness', 'grayscale', 'entropy', 'edge_density', 'brightness', 'aspect_ratio')}
+
+    batch = _stack(images)
+    b, g, r = batch[..., 0], batch[..., 1], batch[..., 2]
+
+    # Colorfulness: spread and mean of the opponent colour channels
+    rg = r - g
+    yb = 0.5 * (r + g) - b
+    colorfulness = (np.sqrt(rg.std(axis=(1, 2)) ** 2 + yb.std(axis=(1, 2)) ** 2)
+                    + 0.3 * np.sqrt(rg.mean(axis=(1, 2)) ** 2 + yb.mean(axis=(1, 2)) ** 2))
+    grayscale = ((batch.max(axis=3) - batch.min(axis=3)) <= 10).mean(axis=(1, 2))
+
+    # Histogram entropy: one bincount over all images, offset by image index
+    gray = 0.114 * b + 0.587 * g + 0.299 * r
+    bins = np.minimum(gray * (HIST_BINS / 256.0), HIST_BINS - 1).astype(np.int64).reshape(n, -1)
+    hist = np.bincount((bins + HIST_BINS * np.arange(n)[:, None]).ravel(), minlength=n * HIST_BINS)
+    p = hist.reshape(n, HIST_BINS) / bins.shape[1]
+    entropy = -(p * np.log2(p, where=p > 0, out=np.zeros_like(p))).sum(axis=1)
+
+    # Edge density: forward differences, thresholded gradient magnitude
+    gx = np.abs(np.diff(gray, axis=2))[:, :-1, :]
+    gy = np.abs(np.diff(gray, axis=1))[:, :, :-1]
+    edge_density = ((gx + gy) > 40).mean(axis=(1, 2))
+
+    shapes = np.array([image.shape[:2] for image in images], dtype=np.float32)
+    aspect_ratio = shapes.max(axis=1) / np.maximum(shapes.min(axis=1), 1)
+
+    return {
+        'colorfulness': colorfulness,
+        'grayscale': grayscale,
+        'entropy': entropy,
+        'edge_density': edge_density,
+        'brightness': gray.mean(axis=(1, 2)),
+        'aspect_ratio': aspect_ratio,
+    }
+
+
+# === Reject score ===
+def _ramp(x, lo, hi):
+    """0 at or below `lo`, 1 at or above `hi`, linear in between (use lo > hi for a falling ramp)."""
+    return np.clip((x - lo) / (hi - lo), 0.0, 1.0)
+
+
+def reject_scores(features):
+    """
+    Combine the statistics into a score in [0, 1]; high means "clearly not a micrograph".
+
+    Micrographs and diffraction patterns are gray, tonally rich or dark, and
+    roughly square. The score is the strongest of three pieces of evidence:
+        - colour: high colorfulness over a large non-gray area (colour plots, maps, photos)
+        - drawing: few gray levels, sparse edges on a bright background (line plots, schematics)
+        - shape: very elongated crops (spectra, colour bars, axis strips)
+
+    Args:
+        features (dict): Output of `image_features`
+
+    Returns:
+        np.ndarray: Reject score per image
+    """
+    colour = np.minimum(_ramp(features['colorfulness'], 15, 40),
+                        _ramp(1 - features['grayscale'], 0.1, 0.4))
+    drawing = np.minimum.reduce([
+        _ramp(features['entropy'], 3.5, 2.0),
+        _ramp(features['edge_density'], 0.15, 0.03),
+        _ramp(features['brightness'], 150, 220),
+    ])
+    shape = _ramp(features['aspect_ratio'], 3, 6)
+    return np.maximum.reduce([colour, drawing, shape])
+
+
+def confident_rejects(images, threshold=None):
+    """
+    Flag sub-images that can be labelled 'None' without running the classifier.
+
+    Args:
+        images (List[np.ndarray]): Sub-images in BGR format
+        threshold (float or None): Reject when the score is at or above this value
+            (default: config.STAT_PREFILTER_THRESHOLD)
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (boolean reject mask, reject scores)
+    """
+    threshold = config.STAT_PREFILTER_THRESHOLD if threshold is None else threshold
+    scores = reject_scores(image_features(images))
+    return scores >= threshold, scores
+
+
+# === Agreement with the binary classifier ===
+def agreement_report(scores, binary_none, thresholds):
+    """
+    Compare pre-filter rejects with binary-classifier decisions at several thresholds.
+
+    Args:
+        scores (np.ndarray): Reject scores from `reject_scores`
+        binary_none (np.ndarray): True where the binary classifier predicts 'None'
+        thresholds (Iterable[float]): Thresholds to evaluate
+
+    Returns:
+        List[dict]: Per threshold:
+            'threshold', 'rejected' (count), 'reject_rate' (share of all images),
+            'agreement' (share of rejects the binary model also calls 'None'),
+            'false_rejects' (rejects the binary model calls 'NotNone'),
+            'none_coverage' (share of the binary model's 'None' images caught, i.e. forward passes saved)
+    """
+    scores = np.asarray(scores)
+    binary_none = np.asarray(binary_none, dtype=bool)
+    report = []
+    for threshold in thresholds:
+        rejected = scores >= threshold
+        both = np.count_nonzero(rejected & binary_none)
+        n_rejected = int(np.count_nonzero(rejected))
+        report.append({
+            'threshold': float(threshold),
+            'rejected': n_rejected,
+            'reject_rate': n_rejected / max(len(scores), 1),
+            'agreement': both / n_rejected if n_rejected else 1.0,
+            'false_rejects': n_rejected - both,
+            'none_coverage': both / max(np.count_nonzero(binary_none), 1),
+        })
+    return report
+
+
+def validate(image_dir, thresholds, batch_size=64):
+    """
+    Run the pre-filter and the binary classifier over every image in `image_dir`.
+
+    Args:
+        image_dir (str): Folder of sub-images (e.g., a validation copy of TEM_IMAGE_PATH)
+        thresholds (Iterable[float]): Thresholds to evaluate
+        batch_size (int): Classifier batch size
+
+    Returns:
+        List[dict]: Output of `agreement_report`
+    """
+    from project_function import vision_crop
+
+    names = sorted(name for name in os.listdir(image_dir)
+                   if name.lower().endswith(('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')))
+    images = [image for image in (cv2.imread(os.path.join(image_dir, name)) for name in names) if image is not None]
+
+    scores = reject_scores(image_features(images))
+    results = vision_crop.TEM_classifier_batch(images, batch_size=batch_size)
+    binary_none = [entry['binary_probs']['None'] >= entry['binary_probs']['NotNone'] for entry in results]
+    return agreement_report(scores, binary_none, thresholds)
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Check the statistical pre-filter against the binary classifier')
+    parser.add_argument('image_dir', help='Folder of validation sub-images')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.5, 0.6, 0.7, 0.8, 0.9, 1.0],
+                        help='Reject thresholds to evaluate')
+    parser.add_argument('--batch-size', type=int, default=64, help='Classifier batch size (default: 64)')
+    return parser.parse_args()
+
+
+def main():
+    """Main program entry point"""
+    args = parse_arguments()
+    report = validate(args.image_dir, args.thresholds, args.batch_size)
+    print(f"{'threshold':>9} {'rejected':>8} {'rate':>6} {'agree':>6} {'false':>5} {'coverage':>8}")
+    for row in report:
+        print(f"{row['threshold']:>9.2f} {row['rejected']:>8d} {row['reject_rate']:>6.1%} "
+              f"{row['agreement']:>6.1%} {row['false_rejects']:>5d} {row['none_coverage']:>8.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""
+Tracing and metrics for the extraction pipeline and the crawlers.
+
+Everything is off by default; `span`, `count` and `observe` then return after
+one flag check, so instrumented code runs as before. Once `enable` is called:
+
+- `span(name, **attrs)` times a block. Spans nest per thread (document → page →
+  stage), every finished span is added to the `span_seconds{span=<name>}`
+  latency histogram and, with a trace file, written to it as one JSON line.
+- `count(name, value, **labels)` and `observe(name, value, **labels)` keep
+  labelled counters and histograms in memory.
+
+Export:
+
+- `serve(port)`: Prometheus text format at http://127.0.0.1:<port>/metrics
+- JSONL trace file: one line per span ({'type': 'span', ...}) plus a metrics
+  snapshot ({'type': 'metrics', ...}) from `write_metrics`
+
+Worker processes enable telemetry with the parent's `settings()`, and return
+`drain()` (their metrics since the last drain) with each result; the parent
+`merge`s them, so its endpoint covers the whole pool.
+"""
+import bisect
+import http.server
+import itertools
+import json
+import os
+import threading
+import time
+
+PREFIX = 'tem_'
+# Histogram bucket upper bounds (seconds for latencies)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_enabled = False
+_trace_path = None
+_trace_fd = None
+_server = None
+_lock = threading.Lock()
+_counters = {}     # (name, labels) → value
+_histograms = {}   # (name, labels) → [count per bucket ..., count above the last bucket, sum]
+_local = threading.local()
+_ids = itertools.count(1)
+
+
+# === Switch ===
+def enabled():
+    return _enabled
+
+
+def enable(trace_path=None):
+    """
+    Turn instrumentation on.
+
+    Args:
+        trace_path (str or None): Append spans to this JSONL file (several processes may share it)
+    """
+    global _enabled, _trace_path, _trace_fd
+    if trace_path is not None and trace_path != _trace_path:
+        if _trace_fd is not None:
+            os.close(_trace_fd)
+        # O_APPEND: every span is one write() call, so lines from several processes never interleave
+        _trace_fd = os.open(trace_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        _trace_path = trace_path
+    _enabled = True
+
+
+def disable():
+    """Turn instrumentation off and close the trace file (collected metrics are kept)."""
+    global _enabled, _trace_path, _trace_fd
+    _enabled = False
+    if _trace_fd is not None:
+        os.close(_trace_fd)
+    _trace_path = _trace_fd = None
+
+
+def settings():
+    """Arguments for `enable` in a worker process, or None if instrumentation is off."""
+    return {'trace_path': _trace_path} if _enabled else None
+
+
+# === Spans ===
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """A timed block; use through `span`."""
+    __slots__ = ('name', 'attrs', 'id', 'parent', 'wall_start', 'start')
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.id = f"{os.getpid():x}-{next(_ids)}"
+        self.parent = None
+
+    def set(self, **attrs):
+        """Add attributes known only inside the block (e.g., number of detections)."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = _stack()
+        self.parent = stack[-1].id if stack else None
+        stack.append(self)
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        stack = _stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        observe('span_seconds', seconds, span=self.name)
+        if _trace_fd is not None:
+            _write({'type': 'span', 'name': self.name, 'id': self.id, 'parent': self.parent,
+                    'start': self.wall_start, 'seconds': seconds, 'pid': os.getpid(),
+                    'thread': threading.current_thread().name, 'attrs': self.attrs})
+        return False
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def span(name, **attrs):
+    """
+    Time a block: `with telemetry.span('page', page=3): ...`
+
+    Args:
+        name (str): Span name (also the `span` label of the latency histogram)
+        **attrs: Attributes written to the trace file
+
+    Returns:
+        Span or a shared no-op context when instrumentation is off
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, attrs)
+
+
+# === Counters and histograms ===
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def count(name, value=1, **labels):
+    """Add `value` to counter `name` with the given labels."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Record `value` (e.g., a latency in seconds) in histogram `name` with the given labels."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+        histogram[bisect.bisect_left(BUCKETS, value)] += 1
+        histogram[-1] += value
+
+
+def _export():
+    # Caller holds _lock
+    return {'counters': [[name, dict(labels), value] for (name, labels), value in _counters.items()],
+            'histograms': [[name, dict(labels), values[:-1], values[-1]] for (name, labels), values in _histograms.items()]}
+
+
+def snapshot():
+    """
+    Current metrics as plain data (JSON- and pickle-friendly).
+
+    Returns:
+        dict: 'counters' ([name, labels, value]) and 'histograms' ([name, labels, bucket counts, sum])
+    """
+    with _lock:
+        return _export()
+
+
+def drain():
+    """Return `snapshot()` and reset the metrics (for sending a worker's share to the parent)."""
+    with _lock:
+        data = _export()
+        _counters.clear()
+        _histograms.clear()
+    return data
+
+
+def merge(data):
+    """Add metrics from `drain()` or `snapshot()` of another process."""
+    with _lock:
+        for name, labels, value in data['counters']:
+            key = _key(name, labels)
+            _counters[key] = _counters.get(key, 0) + value
+        for name, labels, buckets, total in data['histograms']:
+            key = _key(name, labels)
+            histogram = _histograms.setdefault(key, [0] * (len(BUCKETS) + 1) + [0.0])
+            for i, value in enumerate(buckets):
+                histogram[i] += value
+            histogram[-1] += total
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+# === Export ===
+def _write(record):
+    os.write(_trace_fd, (json.dumps(record, default=str) + '\n').encode('utf-8'))
+
+
+def write_metrics():
+    """Append a metrics snapshot to the trace file (if one is open)."""
+    if _trace_fd is not None:
+        _write({'type': 'metrics', 'time': time.time(), 'pid': os.getpid(), **snapshot()})
+
+
+def _labels_text(labels, extra=()):
+    pairs = list(labels.items()) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def prometheus_text():
+    """Metrics in the Prometheus text exposition format."""
+    data = snapshot()
+    lines = []
+    for name in sorted({name for name, _, _ in data['counters']}):
+        metric = PREFIX + (name if name.endswith('_total') else name + '_total')
+        lines.append(f"# TYPE {metric} counter")
+        for _, labels, value in sorted((c for c in data['counters'] if c[0] == name), key=lambda c: sorted(c[1].items())):
+            lines.append(f"{metric}{_labels_text(labels)} {value}")
+    for name in sorted({name for name, _, _, _ in data['histograms']}):
+        metric = PREFIX + name
+        lines.append(f"# TYPE {metric} histogram")
+        for _, labels, buckets, total in sorted((h for h in data['histograms'] if h[0] == name),
+                                                key=lambda h: sorted(h[1].items())):
+            cumulative = 0
+            for bound, value in zip(BUCKETS + ('+Inf',), buckets):
+                cumulative += value
+                lines.append(f"{metric}_bucket{_labels_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{metric}_sum{_labels_text(labels)} {total}")
+            lines.append(f"{metric}_count{_labels_text(labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port, host='127.0.0.1'):
+    """
+    Serve `prometheus_text()` at http://<host>:<port>/metrics from a daemon thread.
+
+    Returns:
+        http.server.ThreadingHTTPServer: The running server (port 0 picks a free port)
+    """
+    global _server
+    stop_server()
+    _server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True).start()
+    return _server
+
+
+def stop_server():
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
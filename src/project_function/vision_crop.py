@@ -1,6 +1,3 @@
-# === YOLO object detection ===
-from ultralytics import YOLO
-
 # === Image classification ===
 import torch
 from torchvision import models, transforms
@@ -11,12 +8,214 @@ from PIL import Image
 import cv2
 
 # === Project configuration (custom paths, weights, settings) ===
-from project_function import config
+from project_function import config, inference_backends, stat_prefilter, telemetry
+from project_function.model_registry import ModelRegistry
+
+
+# === Model loaders (run on first use, not at import time) ===
+def _load_yolo(weights):
+    """
+    Build a YOLO model from `weights` (or its export for config.INFERENCE_BACKEND);
+    ultralytics is imported only when needed.
+    """
+    from ultralytics import YOLO
+    return YOLO(inference_backends.detector_weights(weights))
+
+
+def _classifier_device():
+    # ONNX Runtime sessions and int8 kernels run on CPU
+    if config.INFERENCE_BACKEND == 'onnx' or config.QUANTIZE_INT8:
+        return torch.device('cpu')
+    return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+
+def _build_resnet(weights, num_classes, device):
+    """Build an eager ResNet-18 with a `num_classes` head and load `weights` into it."""
+    model = models.resnet18(pretrained=False)
+    model.fc = torch.nn.Linear(model.fc.in_features, num_classes)
+    model.load_state_dict(torch.load(weights, map_location=device))
+    return model.to(device).eval()
+
+
+def _load_resnet(weights, num_classes):
+    """Build a ResNet-18 classifier for config.INFERENCE_BACKEND."""
+    device = _classifier_device()
+    return inference_backends.wrap_classifier(_build_resnet(weights, num_classes, device), weights, device)
+
+
+# vision_crop.py (module-level lazy cache)
+registry = ModelRegistry()
+registry.register('crop', lambda: _load_yolo(config.CROP_IMAGES))             # YOLO model for figure-region detection
+registry.register('description', lambda: _load_yolo(config.IMAGE_DESCRIPTION)) # YOLO model for TEM image vs. caption
+registry.register('tem', lambda: _load_yolo(config.TEM_IMAGE_CROP))           # YOLO model for extracting TEM sub-regions
+registry.register('binary_classifier', lambda: _load_resnet(config.BINARY_CLASSIFIER, 2))        # None vs NotNone
+registry.register('five_class_classifier', lambda: _load_resnet(config.FIVE_CLASS_CLASSIFIER, 5)) # CTEM, Diffraction, etc.
+
+
+# === Shared post-processing for YOLO results ===
+def _to_bgr(image):
+    """Convert a 3-channel RGB image to BGR (YOLO expects BGR for NumPy input)."""
+    if image.ndim == 3 and image.shape[2] == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    return image
+
+
+def _scored_boxes(result, score_threshold):
+    """
+    Return ((x1, y1, x2, y2), score) of every class-0 detection above `score_threshold`.
+
+    Args:
+        result (ultralytics.engine.results.Results): YOLO result
+        score_threshold (float): Minimum confidence to keep a detection
+
+    Returns:
+        List[Tuple[Tuple[int, int, int, int], float]]: Integer boxes and scores in detection order
+    """
+    # Extract detection results
+    boxes = result.boxes.xyxy.tolist()  # Bounding boxes (x1, y1, x2, y2)
+    scores = result.boxes.conf.tolist() # Confidence scores
+    classes = result.boxes.cls.tolist() # Detected class indices
+
+    # Only keep detections of class 0 with high confidence
+    return [(tuple(map(int, box)), score) for box, score, cls in zip(boxes, scores, classes)
+            if cls == 0 and score > score_threshold]
+
+
+def _detection_boxes(result, score_threshold):
+    """Return the integer (x1, y1, x2, y2) boxes of `_scored_boxes`."""
+    return [box for box, _ in _scored_boxes(result, score_threshold)]
+
+
+def _crop_detections(result, image, score_threshold):
+    """
+    Crop every class-0 detection above `score_threshold` from `image`.
+
+    Args:
+        result (ultralytics.engine.results.Results): YOLO result for `image`
+        image (np.ndarray): Image the detections refer to
+        score_threshold (float): Minimum confidence to keep a detection
+
+    Returns:
+        List[np.ndarray]: Cropped regions in detection order
+    """
+    # Crop the detected regions from the image
+    return [image[y1:y2, x1:x2] for x1, y1, x2, y2 in _detection_boxes(result, score_threshold)]
+
+
+def _largest_boxes(result, shape):
+    """
+    Find the largest TEM region (class 0) and the largest caption region (class 1).
+
+    Args:
+        result (ultralytics.engine.results.Results): YOLO result
+        shape (tuple): Shape of the image the detections refer to (used for clipping)
+
+    Returns:
+        dict: {class index: ((x1, y1, x2, y2), score)} for classes 0 and 1 that were detected
+    """
+    best = {}
+    largest_area = {0: 0, 1: 0}   # Tracks the largest region area per class
+
+    boxes = result.boxes.xyxy.tolist()  # Bounding boxes
+    scores = result.boxes.conf.tolist() # Confidence scores
+    classes = result.boxes.cls.tolist() # Class indices (0 = TEM, 1 = caption)
+
+    # Iterate over all detected boxes
+    for box, score, cls in zip(boxes, scores, classes):
+        x1, y1, x2, y2 = box
+
+        # Clip coordinates to image boundaries
+        x1 = max(0, int(x1))
+        y1 = max(0, int(y1))
+        x2 = min(shape[1], int(x2))
+        y2 = min(shape[0], int(y2))
+
+        # Compute area of the detection
+        area = (x2 - x1) * (y2 - y1)
+
+        # If it's a TEM or caption region and the largest of its class so far → update
+        cls = int(cls)
+        if cls in largest_area and area > largest_area[cls]:
+            largest_area[cls] = area
+            best[cls] = ((x1, y1, x2, y2), score)
+
+    return best
+
+
+def _largest_tem_and_description(result, crop_image):
+    """
+    Pick the largest TEM region (class 0) and the largest caption region (class 1).
+
+    Args:
+        result (ultralytics.engine.results.Results): YOLO result for `crop_image`
+        crop_image (np.ndarray): Image the detections refer to
+
+    Returns:
+        Tuple[np.ndarray or None, np.ndarray or None]: (TEM image, description image)
+    """
+    best = _largest_boxes(result, crop_image.shape)
+
+    regions = []
+    for cls in (0, 1):  # 0 = TEM, 1 = caption
+        if cls in best:
+            x1, y1, x2, y2 = best[cls][0]
+            regions.append(crop_image[y1:y2, x1:x2])
+        else:
+            regions.append(None)
+
+    best_TEM_image, best_description_image = regions
+    return best_TEM_image, best_description_image
+
+
+def _batched_predict(model, images, batch_size):
+    """
+    Run `model` over `images` in chunks of `batch_size`, one YOLO call per chunk.
+
+    Args:
+        model (YOLO): Detector to run
+        images (List[np.ndarray]): BGR images
+        batch_size (int): Maximum number of images per forward pass
+
+    Returns:
+        List[ultralytics.engine.results.Results]: One result per input image, in order
+    """
+    results = []
+    for start in range(0, len(images), batch_size):
+        chunk = images[start:start + batch_size]
+        results.extend(model(chunk, verbose=False))
+    return results
+
+
+# === Telemetry for the detection stages ===
+def _record_detections(span, stage, results, kept):
+    """
+    Count the class-0 detections of a stage that passed (kept) or failed (filtered) its score threshold.
+
+    Args:
+        span (telemetry.Span): Stage span, gets the number of kept detections
+        stage (str): 'crop' or 'tem'
+        results (List[ultralytics.engine.results.Results]): YOLO results of the stage
+        kept (List[list]): Kept detections per result
+    """
+    if not telemetry.enabled():
+        return
+    detected = sum(cls == 0 for result in results for cls in result.boxes.cls.tolist())
+    total = sum(map(len, kept))
+    span.set(detections=total)
+    telemetry.count('detections', total, model=stage, outcome='kept')
+    telemetry.count('detections', detected - total, model=stage, outcome='filtered')
+
+
+def _record_regions(span, pairs):
+    """Count found and missing TEM/caption regions of `image_description`-style (TEM, caption) pairs."""
+    if not telemetry.enabled():
+        return
+    for kind, index in (('tem', 0), ('caption', 1)):
+        found = sum(pair[index] is not None for pair in pairs)
+        span.set(**{kind: found})
+        telemetry.count('regions', found, kind=kind, outcome='found')
+        telemetry.count('regions', len(pairs) - found, kind=kind, outcome='missing')
 
-# vision_crop.py (module-level cache)
-_yolo_crop_model = YOLO(config.CROP_IMAGES) # Load YOLO model for figure-region detection (path is defined in config.CROP_IMAGES)
-_yolo_desc_model = YOLO(config.IMAGE_DESCRIPTION) # Load YOLO model for classifying figure components (e.g., TEM image vs. caption)
-_yolo_tem_model = YOLO(config.TEM_IMAGE_CROP) # Load YOLO model trained specifically for extracting TEM sub-regions
 
 # === Crop target regions from an image using YOLO (e.g., figure panel detector) ===
 def crop_images(image):
@@ -29,35 +228,39 @@ def crop_images(image):
     Returns:
         List[np.ndarray]: List of cropped image regions corresponding to valid detections
     """
-    return_images = []
-
-    
-    model = _yolo_crop_model
+    model = registry.get('crop')
 
     # Convert image from RGB to BGR format if necessary (YOLO expects BGR format for OpenCV input)
     if image.ndim == 3 and image.shape[2] == 3:
         image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
 
-    # Perform object detection (disable verbose output)
-    results = model(image, verbose=False)
+    with telemetry.span('crop', images=1) as span:
+        # Perform object detection (disable verbose output)
+        results = model(image, verbose=False)
+        crops = _crop_detections(results[0], image, score_threshold=0.9)
+        _record_detections(span, 'crop', results, [crops])
 
-    # Extract detection results
-    boxes = results[0].boxes.xyxy.tolist()  # Bounding boxes (x1, y1, x2, y2)
-    scores = results[0].boxes.conf.tolist() # Confidence scores
-    classes = results[0].boxes.cls.tolist() # Detected class indices
+    return crops
 
-    # Loop through each detection
-    for box, score, cls in zip(boxes, scores, classes):
-        # Only keep detections of class 0 with high confidence ( > 0.9 )
-        if cls == 0 and score > 0.9:
-            x1, y1, x2, y2 = box
-            x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
 
-            # Crop the detected region from the image
-            crop_object = image[y1:y2, x1:x2]
-            return_images.append(crop_object)
+# === Figure-region boxes only (for two-pass rendering) ===
+def figure_boxes(image):
+    """
+    Run the figure detector and return the boxes `crop_images` would crop,
+    without cropping. Used to re-render only the detected regions at high zoom.
+
+    Args:
+        image (np.ndarray): Input image (RGB, converted to BGR internally for YOLO)
+
+    Returns:
+        List[Tuple[int, int, int, int]]: (x1, y1, x2, y2) pixel boxes on `image`
+    """
+    with telemetry.span('crop', images=1) as span:
+        results = registry.get('crop')(_to_bgr(image), verbose=False)
+        boxes = _detection_boxes(results[0], score_threshold=0.9)
+        _record_detections(span, 'crop', results, [boxes])
+    return boxes
 
-    return return_images
 
 # === Extract the main TEM region and its corresponding description from a cropped image ===
 def image_description(crop_image):
@@ -73,49 +276,19 @@ def image_description(crop_image):
         best_TEM_image (np.ndarray or None): Largest detected TEM sub-image
         best_description_image (np.ndarray or None): Largest detected caption/description sub-image
     """
-    best_TEM_image = None
-    best_description_image = None
-
-    largest_area_TEM = 0           # Tracks the largest TEM region area
-    largest_area_description = 0   # Tracks the largest description region area
-
-    
-    model = _yolo_desc_model
+    model = registry.get('description')
 
     # Convert to BGR if in RGB format (YOLO requires BGR when using OpenCV)
     if crop_image.ndim == 3 and crop_image.shape[2] == 3:
         crop_image = cv2.cvtColor(crop_image, cv2.COLOR_RGB2BGR)
 
-    # Run YOLO inference (suppress terminal output)
-    results = model(crop_image, verbose=False)
-    boxes = results[0].boxes.xyxy.tolist()  # Bounding boxes
-    scores = results[0].boxes.conf.tolist() # Confidence scores
-    classes = results[0].boxes.cls.tolist() # Class indices (0 = TEM, 1 = caption)
+    with telemetry.span('description', images=1) as span:
+        # Run YOLO inference (suppress terminal output)
+        results = model(crop_image, verbose=False)
+        pair = _largest_tem_and_description(results[0], crop_image)
+        _record_regions(span, [pair])
 
-    # Iterate over all detected boxes
-    for box, score, cls in zip(boxes, scores, classes):
-        x1, y1, x2, y2 = box
-
-        # Clip coordinates to image boundaries
-        x1 = max(0, int(x1))
-        y1 = max(0, int(y1))
-        x2 = min(crop_image.shape[1], int(x2))
-        y2 = min(crop_image.shape[0], int(y2))
-
-        # Compute area of the detection
-        area = (x2 - x1) * (y2 - y1)
-
-        # If it's a TEM region and largest seen so far → update
-        if cls == 0 and area > largest_area_TEM:
-            largest_area_TEM = area
-            best_TEM_image = crop_image[y1:y2, x1:x2]
-
-        # If it's a caption/description and largest seen so far → update
-        elif cls == 1 and area > largest_area_description:
-            largest_area_description = area
-            best_description_image = crop_image[y1:y2, x1:x2]
-
-    return best_TEM_image, best_description_image
+    return pair
 
 
 # === Crop all valid sub-TEM images from a larger TEM image using YOLO ===
@@ -129,73 +302,243 @@ def tem_images_crop(image):
     Returns:
         List[np.ndarray]: List of cropped sub-TEM images
     """
-    return_images = []
-
-    model = _yolo_tem_model
+    model = registry.get('tem')
 
     # Convert image from RGB to BGR if needed (YOLO via OpenCV expects BGR)
     if image.ndim == 3 and image.shape[2] == 3:
         image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
 
-    # Run object detection (suppress verbose output)
-    results = model(image, verbose=False)
-    boxes = results[0].boxes.xyxy.tolist()
-    scores = results[0].boxes.conf.tolist()
-    classes = results[0].boxes.cls.tolist()
+    with telemetry.span('tem', images=1) as span:
+        # Run object detection (suppress verbose output)
+        results = model(image, verbose=False)
+        crops = _crop_detections(results[0], image, score_threshold=0.7)
+        _record_detections(span, 'tem', results, [crops])
 
-    # Iterate through each detected object
-    for box, score, cls in zip(boxes, scores, classes):
-        # Only consider class 0 (TEM sub-image) with high confidence
-        if cls == 0 and score > 0.7:
-            x1, y1, x2, y2 = map(int, box)
-            crop_object = image[y1:y2, x1:x2]
-            return_images.append(crop_object)
+    return crops
 
-    return return_images
 
+# === Batched variants: one YOLO call per chunk of images ===
+def crop_images_batch(images, batch_size=16):
+    """
+    Batched version of `crop_images` for many pages at once.
 
-# === Unified classifier for TEM sub-images ===
-def TEM_classifier(image: np.ndarray) -> str:
+    Args:
+        images (List[np.ndarray]): Input images (RGB, converted to BGR internally)
+        batch_size (int): Maximum number of pages per YOLO call
+
+    Returns:
+        List[List[np.ndarray]]: Per-image crop lists, same order as `images`
     """
-    Performs two-stage classification for a given TEM sub-image:
-    1. Binary classification: 'None' vs 'NotNone'
-    2. If classified as 'NotNone', further classify into 5 categories:
-       ['CTEM', 'Diffraction', 'HR-TEM', 'SEM', 'STEM']
+    with telemetry.span('crop', images=len(images)) as span:
+        images = [_to_bgr(image) for image in images]
+        results = _batched_predict(registry.get('crop'), images, batch_size)
+        crops = [_crop_detections(result, image, score_threshold=0.9) for result, image in zip(results, images)]
+        _record_detections(span, 'crop', results, crops)
+    return crops
+
+
+def image_description_batch(crop_images, batch_size=16):
+    """
+    Batched version of `image_description` for many figure crops at once.
 
     Args:
-        image (np.ndarray): Input image in RGB or BGR format.
+        crop_images (List[np.ndarray]): Figure crops (RGB, converted to BGR internally)
+        batch_size (int): Maximum number of crops per YOLO call
 
     Returns:
-        str: One of the labels: 'None', 'CTEM', 'Diffraction', 'HR-TEM', 'SEM', 'STEM'
+        List[Tuple[np.ndarray or None, np.ndarray or None]]: Per-crop (TEM image, description image)
     """
-    binary_classifier = config.BINARY_CLASSIFIER
-    five_class_classifier = config.FIVE_CLASS_CLASSIFIER
+    with telemetry.span('description', images=len(crop_images)) as span:
+        crop_images = [_to_bgr(crop_image) for crop_image in crop_images]
+        results = _batched_predict(registry.get('description'), crop_images, batch_size)
+        pairs = [_largest_tem_and_description(result, crop_image) for result, crop_image in zip(results, crop_images)]
+        _record_regions(span, pairs)
+    return pairs
 
-    # === Static model cache to avoid reloading ===
-    if not hasattr(TEM_classifier, "device"):
-        TEM_classifier.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
+def tem_images_crop_batch(images, batch_size=16):
+    """
+    Batched version of `tem_images_crop` for many TEM regions at once.
+
+    Args:
+        images (List[np.ndarray]): TEM regions (RGB, converted to BGR internally)
+        batch_size (int): Maximum number of regions per YOLO call
+
+    Returns:
+        List[List[np.ndarray]]: Per-image sub-TEM crop lists, same order as `images`
+    """
+    with telemetry.span('tem', images=len(images)) as span:
+        images = [_to_bgr(image) for image in images]
+        results = _batched_predict(registry.get('tem'), images, batch_size)
+        crops = [_crop_detections(result, image, score_threshold=0.7) for result, image in zip(results, images)]
+        _record_detections(span, 'tem', results, crops)
+    return crops
+
+
+# === Structured detections ===
+# Colour contract: every image handled by the Detection API is BGR uint8 (OpenCV
+# and YOLO order). Pages are converted once on entry with `Detection.from_page`;
+# all crops below are NumPy views into that buffer and are never converted again.
+class Detection:
+    """
+    One detected region with its provenance.
+
+    Attributes:
+        image (np.ndarray): BGR view into the parent's buffer (no copy)
+        bbox (tuple): (x1, y1, x2, y2) in parent pixel coordinates
+        page_bbox (tuple): (x1, y1, x2, y2) in page pixel coordinates
+        score (float): Detector confidence (1.0 for page roots)
+        cls (int): Detector class index (-1 for page roots)
+        page (int or None): Source page number
+        parent (Detection or None): Region this one was cropped from
+    """
+    __slots__ = ('image', 'bbox', 'page_bbox', 'score', 'cls', 'page', 'parent')
+
+    def __init__(self, image, bbox, page_bbox, score, cls, page=None, parent=None):
+        self.image = image
+        self.bbox = bbox
+        self.page_bbox = page_bbox
+        self.score = score
+        self.cls = cls
+        self.page = page
+        self.parent = parent
+
+    @classmethod
+    def from_page(cls, image, page=None, rgb=True, offset=(0, 0)):
+        """
+        Wrap a rendered page (or a rendered page region) as the root of a detection tree.
+
+        Args:
+            image (np.ndarray): Page image
+            page (int or None): Page number
+            rgb (bool): `image` is RGB (as rendered by PyMuPDF) and is converted to BGR once here
+            offset (tuple): Page pixel coordinates of the image's top-left corner
+                (non-zero for regions rendered with a clip)
+
+        Returns:
+            Detection: Root record covering the whole image
+        """
+        if rgb and image.ndim == 3 and image.shape[2] == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        h, w = image.shape[:2]
+        x0, y0 = offset
+        return cls(image, (0, 0, w, h), (x0, y0, x0 + w, y0 + h), 1.0, -1, page)
+
+    def child(self, bbox, score, cls):
+        """Create a sub-detection whose image is a view into this one."""
+        x1, y1, x2, y2 = bbox
+        px, py = self.page_bbox[0], self.page_bbox[1]
+        return Detection(self.image[y1:y2, x1:x2], bbox, (px + x1, py + y1, px + x2, py + y2),
+                         score, cls, self.page, self)
+
+    def __repr__(self):
+        return (f"Detection(page={self.page}, cls={self.cls}, score={self.score:.3f}, "
+                f"bbox={self.bbox}, page_bbox={self.page_bbox})")
+
+
+def detect_figures(pages, batch_size=16):
+    """
+    Detect figure regions (class 0, score > 0.9) on page roots, like `crop_images`.
+
+    Args:
+        pages (List[Detection]): Page roots from `Detection.from_page`
+        batch_size (int): Maximum number of pages per YOLO call
+
+    Returns:
+        List[List[Detection]]: Figure detections per page, in input order
+    """
+    with telemetry.span('crop', images=len(pages)) as span:
+        results = _batched_predict(registry.get('crop'), [page.image for page in pages], batch_size)
+        figures = [[page.child(box, score, 0) for box, score in _scored_boxes(result, score_threshold=0.9)]
+                   for result, page in zip(results, pages)]
+        _record_detections(span, 'crop', results, figures)
+    return figures
+
+
+def detect_tem_and_description(figures, batch_size=16):
+    """
+    Split figure detections into their largest TEM and caption regions, like `image_description`.
+
+    Args:
+        figures (List[Detection]): Figure detections
+        batch_size (int): Maximum number of figures per YOLO call
+
+    Returns:
+        List[Tuple[Detection or None, Detection or None]]: (TEM region, caption region) per figure
+    """
+    with telemetry.span('description', images=len(figures)) as span:
+        results = _batched_predict(registry.get('description'), [figure.image for figure in figures], batch_size)
+        pairs = []
+        for result, figure in zip(results, figures):
+            best = _largest_boxes(result, figure.image.shape)
+            pairs.append(tuple(figure.child(*best[cls], cls) if cls in best else None for cls in (0, 1)))
+        _record_regions(span, pairs)
+    return pairs
+
+
+def detect_sub_tems(tems, batch_size=16):
+    """
+    Detect sub-TEM images (class 0, score > 0.7) inside TEM regions, like `tem_images_crop`.
+
+    Args:
+        tems (List[Detection]): TEM region detections
+        batch_size (int): Maximum number of regions per YOLO call
+
+    Returns:
+        List[List[Detection]]: Sub-TEM detections per region, in input order
+    """
+    with telemetry.span('tem', images=len(tems)) as span:
+        results = _batched_predict(registry.get('tem'), [tem.image for tem in tems], batch_size)
+        subs = [[tem.child(box, score, 0) for box, score in _scored_boxes(result, score_threshold=0.7)]
+                for result, tem in zip(results, tems)]
+        _record_detections(span, 'tem', results, subs)
+    return subs
+
+
+# === Fetch both ResNet-18 classifiers from the registry ===
+def _load_classifiers():
+    """
+    Return (binary_model, five_model), loading them on first use, and populate
+    the static preprocessing/label cache used by `TEM_classifier`.
+    """
+    if not hasattr(TEM_classifier, "device"):
         # Define preprocessing pipeline (Resize → ToTensor → Normalize)
         TEM_classifier.transform = transforms.Compose([
             transforms.Resize((224, 224)),
             transforms.ToTensor(),
             transforms.Normalize([0.5]*3, [0.5]*3)
         ])
+        TEM_classifier.binary_labels = ['None', 'NotNone']
+        TEM_classifier.five_labels = ['CTEM', 'Diffraction', 'HR-TEM', 'SEM', 'STEM']
+        TEM_classifier.device = _classifier_device()
 
-        # === Load Binary Classifier: None vs NotNone ===
-        binary_model = models.resnet18(pretrained=False)
-        binary_model.fc = torch.nn.Linear(binary_model.fc.in_features, 2)
-        binary_model.load_state_dict(torch.load(binary_classifier, map_location=TEM_classifier.device))
-        TEM_classifier.binary_model = binary_model.to(TEM_classifier.device).eval()
+    return registry.get('binary_classifier'), registry.get('five_class_classifier')
 
-        # === Load 5-Class Classifier: CTEM, Diffraction, etc. ===
-        five_model = models.resnet18(pretrained=False)
-        five_model.fc = torch.nn.Linear(five_model.fc.in_features, 5)
-        five_model.load_state_dict(torch.load(five_class_classifier, map_location=TEM_classifier.device))
-        TEM_classifier.five_model = five_model.to(TEM_classifier.device).eval()
 
-        TEM_classifier.binary_labels = ['None', 'NotNone']
-        TEM_classifier.five_labels = ['CTEM', 'Diffraction', 'HR-TEM', 'SEM', 'STEM']
+# === Unified classifier for TEM sub-images ===
+def TEM_classifier(image: np.ndarray) -> str:
+    """
+    Performs two-stage classification for a given TEM sub-image:
+    1. Binary classification: 'None' vs 'NotNone'
+    2. If classified as 'NotNone', further classify into 5 categories:
+       ['CTEM', 'Diffraction', 'HR-TEM', 'SEM', 'STEM']
+
+    Args:
+        image (np.ndarray): Input image in RGB or BGR format.
+
+    Returns:
+        str: One of the labels: 'None', 'CTEM', 'Diffraction', 'HR-TEM', 'SEM', 'STEM'
+    """
+    with telemetry.span('classify', images=1):
+        label = _classify_one(image)
+    telemetry.count('classified', label=label, source='model')
+    return label
+
+
+def _classify_one(image):
+    """Two-stage cascade of `TEM_classifier` for one image."""
+    # === Models are loaded once and cached by the registry ===
+    binary_model, five_model = _load_classifiers()
 
     # === Preprocess input image ===
     if image.ndim == 3 and image.shape[2] == 3:
@@ -205,15 +548,127 @@ def TEM_classifier(image: np.ndarray) -> str:
 
     # === Stage 1: Binary Classification ===
     with torch.no_grad():
-        out_bin = TEM_classifier.binary_model(input_tensor)
+        out_bin = binary_model(input_tensor)
         pred_bin = torch.argmax(out_bin, dim=1).item()
         if TEM_classifier.binary_labels[pred_bin] == 'None':
             return 'None'
 
     # === Stage 2: 5-Class Classification (only if NotNone) ===
     with torch.no_grad():
-        out_five = TEM_classifier.five_model(input_tensor)
+        out_five = five_model(input_tensor)
         pred_five = torch.argmax(out_five, dim=1).item()
         return TEM_classifier.five_labels[pred_five]
 
-        
\ No newline at end of file
+
+# === Vectorized preprocessing for a list of sub-images ===
+def _preprocess_batch(images, size=224):
+    """
+    Resize a list of BGR images into one normalized N×3×size×size tensor,
+    equal to stacking `TEM_classifier.transform` of each image.
+
+    Each image is resized on its own (sizes differ) with the same antialiased
+    PIL bilinear `transforms.Resize` as `TEM_classifier` and the training
+    transforms; scaling and normalization then run once over the stacked array.
+
+    Args:
+        images (List[np.ndarray]): Sub-images in BGR, BGRA or grayscale
+        size (int): Square input size of the classifier
+
+    Returns:
+        torch.Tensor: Float tensor normalized like `transforms.Normalize([0.5]*3, [0.5]*3)`
+    """
+    resize = transforms.Resize((size, size))
+    batch = np.empty((len(images), size, size, 3), dtype=np.uint8)
+    for i, image in enumerate(images):
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        elif image.shape[2] == 4:
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
+        else:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        batch[i] = np.asarray(resize(Image.fromarray(image)))
+
+    # HWC → CHW, then `ToTensor` and `Normalize` in the same order of operations
+    tensor = torch.from_numpy(batch).permute(0, 3, 1, 2).float()
+    return tensor.div_(255).sub_(0.5).div_(0.5)
+
+
+# === Batched two-stage cascade ===
+def TEM_classifier_batch(images, batch_size=64, prefilter_threshold=None):
+    """
+    Batched version of `TEM_classifier`.
+
+    The binary model runs over every image; only the 'NotNone' subset is
+    passed to the five-class model in a second batched pass.
+
+    With `prefilter_threshold`, images that `stat_prefilter` confidently
+    rejects (colour plots, schematics, spectra) are labelled 'None' without
+    any forward pass.
+
+    Args:
+        images (List[np.ndarray]): Sub-images in BGR format (as returned by `tem_images_crop`)
+        batch_size (int): Maximum number of images per forward pass
+        prefilter_threshold (float or None): Statistical pre-filter reject threshold (None: disabled)
+
+    Returns:
+        List[dict]: One entry per input image, in input order, with keys
+            'label' (str): Final label, as returned by `TEM_classifier`
+            'binary_probs' (dict or None): Probability of 'None' and 'NotNone', None if pre-filtered
+            'five_class_probs' (dict or None): Probability per five-class label, None if rejected
+            'prefiltered' (bool): True if the statistical pre-filter rejected the image
+    """
+    if prefilter_threshold is not None and len(images) > 0:
+        rejected, _ = stat_prefilter.confident_rejects(images, prefilter_threshold)
+        telemetry.count('classified', int(sum(rejected)), label='None', source='prefilter')
+        kept = iter(TEM_classifier_batch([image for image, skip in zip(images, rejected) if not skip],
+                                         batch_size=batch_size))
+        return [{'label': 'None', 'binary_probs': None, 'five_class_probs': None, 'prefiltered': True}
+                if skip else next(kept) for skip in rejected]
+
+    with telemetry.span('classify', images=len(images)):
+        results = _classify_batch(images, batch_size)
+    if telemetry.enabled():
+        for entry in results:
+            telemetry.count('classified', label=entry['label'], source='model')
+    return results
+
+
+def _classify_batch(images, batch_size):
+    """Batched two-stage cascade of `TEM_classifier_batch`, without the pre-filter."""
+    binary_model, five_model = _load_classifiers()
+    device = TEM_classifier.device
+    binary_labels = TEM_classifier.binary_labels
+    five_labels = TEM_classifier.five_labels
+
+    results = []
+    for start in range(0, len(images), batch_size):
+        input_tensor = _preprocess_batch(images[start:start + batch_size]).to(device)
+
+        with torch.no_grad():
+            # === Stage 1: Binary Classification over the whole chunk ===
+            bin_probs = torch.softmax(binary_model(input_tensor), dim=1)
+            keep = torch.nonzero(bin_probs.argmax(dim=1) == binary_labels.index('NotNone')).flatten()
+
+            # === Stage 2: 5-Class Classification on the NotNone subset only ===
+            five_probs = None
+            if keep.numel() > 0:
+                five_probs = torch.softmax(five_model(input_tensor[keep]), dim=1).cpu().numpy()
+
+        bin_probs = bin_probs.cpu().numpy()
+        five_rows = {idx: row for idx, row in zip(keep.tolist(), five_probs if five_probs is not None else [])}
+
+        for i, probs in enumerate(bin_probs):
+            entry = {
+                'label': 'None',
+                'binary_probs': dict(zip(binary_labels, probs.tolist())),
+                'five_class_probs': None,
+                'prefiltered': False,
+            }
+            if i in five_rows:
+                row = five_rows[i]
+                entry['label'] = five_labels[int(row.argmax())]
+                entry['five_class_probs'] = dict(zip(five_labels, row.tolist()))
+            results.append(entry)
+
+    return results
+
@@ -0,0 +1,91 @@
+"""
+Shared fixtures. Run from the repository root:
+
+    python -m pytest tests
+"""
+import http.server
+import os
+import sys
+import threading
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(ROOT, 'src')
+SCRIPTS_DIR = os.path.join(ROOT, 'scripts')
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# The package is run from `src` and the crawlers from `scripts`
+for path in (SRC_DIR, SCRIPTS_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture(scope='session')
+def corpus(tmp_path_factory):
+    """Small synthetic PDF corpus of `benchmark.make_corpus` ('small' profile): (directory, file names)."""
+    from project_function import benchmark
+
+    pdf_dir = str(tmp_path_factory.mktemp('corpus'))
+    return pdf_dir, benchmark.make_corpus(pdf_dir, 'small', seed=0)['files']
+
+
+class _NatureSite(http.server.BaseHTTPRequestHandler):
+    """
+    Stand-in for nature.com serving the saved pages in `fixtures/nature`:
+        /search                   result page 1, or page 2 with `page=2` (the bot check if `server.blocked`)
+        /articles/<id>            `server.articles[id]`; 403 with the bot check if `id` is in `server.forbidden`
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        with self.server.lock:
+            self.server.requests.append(self.path)
+        if url.path == '/search':
+            if self.server.blocked:
+                return self._send(200, 'bot_check.html')
+            page = parse_qs(url.query).get('page', ['1'])[0]
+            return self._send(200, f'search_page{page}.html')
+        article = url.path[len('/articles/'):] if url.path.startswith('/articles/') else None
+        if article in self.server.forbidden:
+            return self._send(403, 'bot_check.html')
+        if article in self.server.articles:
+            return self._send(200, self.server.articles[article])
+        self.send_error(404)
+
+    def _send(self, status, fixture):
+        path = os.path.join(FIXTURES_DIR, 'nature', fixture)
+        if not os.path.exists(path):
+            return self.send_error(404)
+        with open(path, 'rb') as f:
+            body = f.read()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def nature_site():
+    """Local stand-in for nature.com (see `_NatureSite`), with `.url`, `.requests`, `.articles`, `.forbidden` and `.blocked`."""
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _NatureSite)
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    httpd.articles = {
+        's41467-020-00001-1': 'article_citation_meta.html',
+        's41467-020-00002-2': 'article_entitlement_box.html',
+        's41467-020-00003-3': 'article_no_pdf.html',
+    }
+    httpd.forbidden = set()
+    httpd.blocked = False
+    httpd.url = f'http://127.0.0.1:{httpd.server_address[1]}'
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
@@ -0,0 +1,124 @@
+"""
+`crawl_frontier` shared by two crawlers: leases on years and articles, their
+expiry, and handing claims back.
+"""
+import time
+
+import pytest
+
+from crawl_frontier import CrawlFrontier, doi_file_name, doi_from_url
+
+LEASE = 0.3
+URLS = [f'https://www.nature.com/articles/s41467-020-0000{i}-{i}' for i in range(1, 4)]
+
+
+@pytest.fixture
+def frontiers(tmp_path):
+    """Two crawlers ('a', 'b') sharing one frontier database."""
+    path = str(tmp_path / 'frontier.sqlite')
+    a = CrawlFrontier(path, worker_id='a', lease=LEASE)
+    b = CrawlFrontier(path, worker_id='b', lease=LEASE)
+    yield a, b
+    a.close()
+    b.close()
+
+
+def test_doi_of_article_urls():
+    assert doi_from_url('https://www.nature.com/articles/S41467-020-00001-1?error=cookies') == '10.1038/s41467-020-00001-1'
+    assert doi_from_url('https://doi.org/10.1038%2Fs41467-020-00001-1') == '10.1038/s41467-020-00001-1'
+    assert doi_from_url('https://www.nature.com/subjects/materials') is None
+    assert doi_file_name('10.1038/s41467-020-00001-1') == '10.1038_s41467-020-00001-1.pdf'
+
+
+def test_articles_are_recorded_once_per_doi(frontiers):
+    a, b = frontiers
+    assert a.add(URLS, 2020) == 3
+    # The same article under another URL or year, or found by another crawler
+    assert b.add(['https://doi.org/10.1038/s41467-020-00001-1', URLS[1]], 2021) == 0
+    assert a.count() == 3 and a.count(2020, 'discovered') == 3
+
+
+def test_claimed_article_is_not_handed_out_twice(frontiers):
+    a, b = frontiers
+    a.add(URLS[:2], 2020)
+    assert a.claim_article(2020)['url'] == URLS[0]
+    assert b.claim_article(2020)['url'] == URLS[1]
+    assert a.claim_article(2020) is None and b.claim_article(2020) is None
+
+
+def test_article_lease_expires(frontiers):
+    a, b = frontiers
+    a.add(URLS[:1], 2020)
+    a.claim_article(2020)
+    assert b.claim_article(2020) is None
+    time.sleep(LEASE + 0.1)
+    assert b.claim_article(2020)['url'] == URLS[0]
+
+
+def test_released_article_can_be_claimed_at_once(frontiers):
+    a, b = frontiers
+    a.add(URLS[:1], 2020)
+    a.claim_article(2020)
+    # Only the holder's release counts
+    b.release_article(URLS[0])
+    assert b.claim_article(2020) is None
+
+    a.release_article(URLS[0])
+    article = b.claim_article(2020)
+    assert article['url'] == URLS[0] and article['state'] == 'discovered'
+    # Releasing is not a failed attempt
+    assert b.conn.execute('SELECT attempts FROM articles WHERE url = ?', (URLS[0],)).fetchone()[0] == 0
+
+
+def test_pdf_found_article_stays_claimed_until_downloaded(frontiers):
+    a, b = frontiers
+    a.add(URLS[:1], 2020)
+    a.claim_article(2020)
+    a.mark_pdf_found(URLS[0], URLS[0] + '.pdf')
+    assert b.claim_article(2020) is None
+    a.mark_downloaded(URLS[0], 'paper.pdf')
+    assert b.claim_article(2020) is None
+    assert b.count(2020, 'downloaded') == 1
+
+
+def test_failed_article_is_retried_by_a_later_run_only(frontiers):
+    a, b = frontiers
+    a.add(URLS[:1], 2020)
+    for attempt in range(2):
+        later = CrawlFrontier(a.path, worker_id=f'run{attempt}', max_attempts=2)
+        assert later.claim_article(2020)['url'] == URLS[0]
+        later.mark_failed(URLS[0], 'No PDF download link found')
+        # Not again in the same run
+        assert later.claim_article(2020) is None
+        later.close()
+    # Failed `max_attempts` times: given up
+    with CrawlFrontier(a.path, worker_id='run2', max_attempts=2) as last:
+        assert last.claim_article(2020) is None
+
+
+def test_closing_releases_the_claims(frontiers):
+    a, b = frontiers
+    a.add(URLS[:1], 2020)
+    with CrawlFrontier(a.path, worker_id='c', lease=LEASE) as c:
+        c.claim_article(2020)
+        assert c.claim_year(2020) == 1
+        assert b.claim_article(2020) is None and b.claim_year(2020) is None
+    assert b.claim_article(2020)['url'] == URLS[0]
+    assert b.claim_year(2020) == 1
+
+
+def test_year_lease_resumes_from_the_next_page(frontiers):
+    a, b = frontiers
+    assert a.claim_year(2020) == 1
+    assert b.claim_year(2020) is None
+    # The holder itself continues
+    assert a.claim_year(2020) == 1
+
+    a.page_done(2020, 1)
+    time.sleep(LEASE + 0.1)
+    assert b.claim_year(2020) == 2
+    assert a.claim_year(2020) is None
+
+    b.page_done(2020, 2, last=True)
+    b.release()
+    assert a.claim_year(2020) is None and b.claim_year(2020) is None
@@ -0,0 +1,104 @@
+"""
+The perceptual-hash index: links of removed canonical entries, and which sub-TEM
+crops `pipeline._write_page` leaves indexed.
+"""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from project_function import pipeline
+from project_function.dedup import PHashIndex, phash
+
+
+def _micrograph(seed):
+    return np.random.default_rng(seed).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+
+
+@pytest.fixture
+def index(tmp_path):
+    with PHashIndex(str(tmp_path / 'phash.sqlite')) as index:
+        yield index
+
+
+class _Writer:
+    """Image writer stand-in that only records the names it was given."""
+    ext = '.png'
+
+    def __init__(self):
+        self.saved = []
+
+    def save(self, path, image):
+        self.saved.append(path)
+
+
+def _sub(image, box):
+    return SimpleNamespace(image=image, page=1, page_bbox=box)
+
+
+def _write(doc, figures):
+    """Index, then write, one page whose figures are [(description or None, [(image, label)])]."""
+    plan = {'figures': [], 'indexed': {}, 'duplicates': 0, 'prefiltered': 0}
+    for i, (description, crops) in enumerate(figures):
+        subs = [_sub(image, (i, j, i + 10, j + 10)) for j, (image, _) in enumerate(crops)]
+        fresh, indexed, dropped = pipeline._drop_duplicates(subs, doc)
+        plan['indexed'].update(indexed)
+        plan['duplicates'] += dropped
+        labels = [label for sub, (_, label) in zip(subs, crops) if any(sub is kept for kept in fresh)]
+        plan['figures'].append((_sub(None, (0, 0, 1, 1)), description, fresh, labels))
+    pipeline._write_page(plan, None, doc)
+    return plan
+
+
+def _document(index, file, tmp_path):
+    settings = pipeline.PipelineSettings(output_dirs={kind: str(tmp_path) for kind in
+                                                      ('pdf_image', 'tem_image', 'description')})
+    return pipeline.DocumentState(file=file, settings=settings.resolved(), writer=_Writer(), dedup=index)
+
+
+def test_purge_moves_links_to_a_surviving_entry(index):
+    value = phash(_micrograph(0))
+    index.add(value, 'PDFa_Image1_1.png', 'TEM', pdf='a.pdf')
+    index.add(value ^ 1, 'PDFb_Image1_1.png', 'TEM', pdf='b.pdf')
+    index.link('c.pdf#p1@0,0,9,9', 'PDFa_Image1_1.png', 1, pdf='c.pdf')
+
+    assert index.purge('a.pdf') == 1
+    assert index.canonical_of('c.pdf#p1@0,0,9,9') == 'PDFb_Image1_1.png'
+
+
+def test_purge_drops_links_without_a_surviving_entry(index):
+    index.add(phash(_micrograph(0)), 'PDFa_Image1_1.png', 'TEM', pdf='a.pdf')
+    index.add(phash(_micrograph(1)), 'PDFb_Image1_1.png', 'TEM', pdf='b.pdf')
+    index.link('c.pdf#p1@0,0,9,9', 'PDFa_Image1_1.png', 0, pdf='c.pdf')
+
+    index.purge('a.pdf')
+    assert index.canonical_of('c.pdf#p1@0,0,9,9') is None
+    assert len(index) == 1
+
+
+def test_valid_crop_of_a_figure_that_was_not_kept_is_not_indexed(index, tmp_path):
+    micrograph = _micrograph(0)
+    doc = _document(index, 'a.pdf', tmp_path)
+    # No description: nothing of this figure is written
+    _write(doc, [(None, [(micrograph, 'TEM')])])
+    assert not doc.rows and len(index) == 0
+
+    # A later copy of the micrograph is new, and written
+    other = _document(index, 'b.pdf', tmp_path)
+    plan = _write(other, [(_sub(None, (0, 0, 1, 1)), [(micrograph, 'TEM')])])
+    assert plan['duplicates'] == 0
+    assert [row['sub_image'] for row in other.rows] == ['PDFb_Image1_1.png']
+    assert index.lookup(phash(micrograph))[0] == 'PDFb_Image1_1.png'
+
+
+def test_written_and_rejected_crops_stay_indexed(index, tmp_path):
+    written, rejected = _micrograph(0), _micrograph(1)
+    doc = _document(index, 'a.pdf', tmp_path)
+    _write(doc, [(_sub(None, (0, 0, 1, 1)), [(written, 'TEM'), (rejected, 'None')])])
+
+    assert index.lookup(phash(written))[::2] == ('PDFa_Image1_1.png', 'TEM')
+    assert index.lookup(phash(rejected))[::2] == ('a.pdf#p1@0,1,10,11', 'None')
+    # Later copies of both are dropped
+    later = [(_sub(None, (0, 0, 1, 1)), [(written, 'TEM'), (rejected, 'SEM')])]
+    plan = _write(_document(index, 'b.pdf', tmp_path), later)
+    assert plan['duplicates'] == 2
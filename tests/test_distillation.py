@@ -0,0 +1,207 @@
+"""
+`distillation.distill` driving the OpenAI async client against the local `StandInServer`:
+rate limits, 429 retries, the response cache and resuming from the JSONL checkpoint.
+"""
+import asyncio
+import csv
+import json
+import time
+
+import pytest
+from PIL import Image
+
+from project_function import config, distillation
+from project_function.distillation import RateLimiter, StandInServer
+
+PARENTS = [f'PDFpaper{i}_Image1.png' for i in range(3)]
+
+
+class _FlakyServer(StandInServer):
+    """Stand-in that answers 429 (Retry-After 1 s) to its first `fail` requests."""
+
+    def __init__(self, fail, **kwargs):
+        super().__init__(0, **kwargs)
+        self.fail = fail
+
+    def allow(self):
+        with self._lock:
+            if self.fail > 0:
+                self.fail -= 1
+                self.rejected += 1
+                return False
+        return super().allow()
+
+
+@pytest.fixture
+def figures(tmp_path, monkeypatch):
+    """Pipeline outputs for `PARENTS` (two sub-images each, the last without caption text); returns distill() paths."""
+    folders = {name: tmp_path / name for name in ('TEM_images', 'PDF_images', 'TEM_descriptions')}
+    for folder in folders.values():
+        folder.mkdir()
+    monkeypatch.setattr(config, 'OUTPUT_MODE', 'files')
+    monkeypatch.setattr(config, 'TEM_IMAGE_PATH', str(folders['TEM_images']))
+    monkeypatch.setattr(config, 'PDF_IMAGE_PATH', str(folders['PDF_images']))
+    monkeypatch.setattr(config, 'DESCRIPTION_PATH', str(folders['TEM_descriptions']))
+
+    csv_path, caption_csv_path = tmp_path / 'metadata.csv', tmp_path / 'captions.csv'
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f, \
+            open(caption_csv_path, 'w', newline='', encoding='utf-8') as captions:
+        rows = csv.writer(f)
+        rows.writerow(['parent_image', 'sub_image', 'TEM_type'])
+        caption_rows = csv.writer(captions)
+        caption_rows.writerow(['image_name', 'caption_text', 'caption_source'])
+        for i, parent in enumerate(PARENTS):
+            Image.new('L', (96, 64), 40 * i).save(folders['PDF_images'] / parent)
+            for j in range(2):
+                sub = parent.replace('.png', f'_{j + 1}.png')
+                Image.new('L', (64, 64), 40 * i + j + 1).save(folders['TEM_images'] / sub)
+                rows.writerow([parent, sub, 'HRTEM'])
+            if i < len(PARENTS) - 1:
+                caption_rows.writerow([parent, f'Figure {i}: lattice fringes.', 'text_layer'])
+            else:
+                caption_rows.writerow([parent, '', 'needs_ocr'])
+                Image.new('L', (200, 20), 255).save(folders['TEM_descriptions'] / parent)
+
+    return {'output_path': str(tmp_path / 'vqa.jsonl'), 'csv_path': str(csv_path),
+            'caption_csv_path': str(caption_csv_path), 'cache_path': str(tmp_path / 'cache.sqlite')}
+
+
+@pytest.fixture
+def server():
+    server = StandInServer(0).start()
+    yield server
+    server.stop()
+
+
+def _distill(figures, server, **kwargs):
+    # One figure per request (parent + two sub-images)
+    options = dict(model='stand-in', base_url=server.url, max_images=3, max_tokens=256, max_retries=0, **figures)
+    options.update(kwargs)
+    return distillation.distill(**options)
+
+
+def _records(output_path):
+    with open(output_path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_every_sub_image_gets_a_record(figures, server):
+    summary = _distill(figures, server)
+    assert summary['figures'] == 3 and summary['requests'] == 3 and not summary['failed']
+    records = _records(figures['output_path'])
+    assert sorted(record['image'] for record in records) == sorted(
+        parent.replace('.png', f'_{j}.png') for parent in PARENTS for j in (1, 2))
+    assert all(len(record['conversations']) == 4 for record in records)
+    assert server.calls == 3
+
+
+def test_cached_replies_are_not_requested_again(figures, server):
+    first = _distill(figures, server)
+    expected = _records(figures['output_path'])
+    # A fresh checkpoint: every figure is pending again, but the cache has every reply
+    figures['output_path'] = figures['output_path'].replace('.jsonl', '_again.jsonl')
+    second = _distill(figures, server)
+
+    assert server.calls == first['requests'] == 3
+    assert second['requests'] == 0 and second['cached'] == 3
+    assert sorted(map(json.dumps, _records(figures['output_path']))) == sorted(map(json.dumps, expected))
+
+    # Another prompt is another cache key
+    assert _distill(figures, server, system_prompt='Only count the particles.',
+                    output_path=figures['output_path'] + '.other')['requests'] == 3
+
+
+def test_unreadable_image_fails_only_its_figure(figures, server, tmp_path):
+    (tmp_path / 'TEM_images' / PARENTS[1].replace('.png', '_2.png')).write_bytes(b'\x89PNG\r\n\x1a\n truncated')
+    summary = _distill(figures, server)
+    assert summary['failed'] == [PARENTS[1]] and summary['figures'] == 2
+    assert {record['parent_image'] for record in _records(figures['output_path'])} == {PARENTS[0], PARENTS[2]}
+
+
+def test_resume_after_a_torn_last_line(figures, server):
+    _distill(figures, server, limit=1)
+    with open(figures['output_path'], 'a', encoding='utf-8') as f:
+        f.write('{"id": "PDFpaper1_Image1_1", "image": "PDFpa')
+
+    summary = _distill(figures, server)
+    assert summary['figures'] == 2 and server.calls == 3
+    # The torn line is gone and every figure is in the checkpoint exactly once
+    records = _records(figures['output_path'])
+    assert sorted(record['image'] for record in records) == sorted(
+        parent.replace('.png', f'_{j}.png') for parent in PARENTS for j in (1, 2))
+
+    # Nothing left to do
+    assert _distill(figures, server)['figures'] == 0 and server.calls == 3
+
+
+def test_rate_limited_requests_are_retried(figures):
+    server = _FlakyServer(fail=2).start()
+    try:
+        start = time.monotonic()
+        summary = _distill(figures, server, max_retries=2)
+    finally:
+        server.stop()
+    assert summary['figures'] == 3 and not summary['failed']
+    assert server.rejected == 2 and server.calls == 3
+    # The client waited out the Retry-After
+    assert time.monotonic() - start >= 0.9
+
+
+def test_requests_above_the_server_limit_fail_and_are_retried_next_run(figures):
+    server = StandInServer(0, rpm=2).start()
+    try:
+        summary = _distill(figures, server, concurrency=1)
+        # Whichever request came third
+        assert summary['figures'] == 2 and len(summary['failed']) == 1 and server.rejected == 1
+
+        server.rpm = None
+        summary = _distill(figures, server)
+        assert summary['figures'] == 1 and summary['requests'] == 1
+    finally:
+        server.stop()
+    assert {record['parent_image'] for record in _records(figures['output_path'])} == set(PARENTS)
+
+
+def test_token_budget_holds_back_requests(figures):
+    # Two requests that together exceed the budget by 6000 tokens, i.e. 0.6 s at 600k tokens per minute
+    tpm = 600000
+    groups = distillation.load_groups(figures['csv_path'], figures['caption_csv_path'])[:2]
+    tokens = [distillation.build_request([group], distillation.image_loader())['tokens'] for group in groups]
+    max_tokens = (tpm + 6000 - sum(tokens)) // 2
+
+    # Both requests are budgeted before the first reply (and its refund) arrives
+    server = StandInServer(0, latency=1.0).start()
+    try:
+        summary = _distill(figures, server, limit=2, tpm=tpm, rpm=60, max_tokens=max_tokens)
+    finally:
+        server.stop()
+    assert summary['figures'] == 2 and server.calls == 2 and server.rejected == 0
+    assert 0.3 <= summary['rate_limit_wait'] <= 0.7
+
+
+def _timed(coroutine):
+    start = time.monotonic()
+    asyncio.run(coroutine)
+    return time.monotonic() - start
+
+
+def test_request_budget_refills_over_the_minute():
+    async def acquire(limiter, count):
+        for _ in range(count):
+            await limiter.acquire(0)
+
+    limiter = RateLimiter(rpm=600)
+    # A full bucket allows a burst, then 10 requests per second
+    assert _timed(acquire(limiter, 600)) < 0.1
+    assert 0.2 <= _timed(acquire(limiter, 3)) <= 0.6
+
+
+def test_token_budget_refunds_and_large_requests():
+    limiter = RateLimiter(tpm=60000)
+    assert _timed(limiter.acquire(60000)) < 0.1
+    assert 0.35 <= _timed(limiter.acquire(500)) <= 0.8
+    # Unused tokens (the reply was shorter than estimated) are given back
+    limiter.adjust(-30000)
+    assert _timed(limiter.acquire(30000)) < 0.1
+    # A request larger than the whole budget only waits for a full bucket
+    assert _timed(RateLimiter(tpm=60000).acquire(10 ** 6)) < 0.1
@@ -0,0 +1,104 @@
+"""
+Lexical scores of `evaluation.score_lexical` against the reference implementations:
+sacrebleu (13a tokens and clipped n-gram counts behind `evaluate`'s BLEU), rouge_score
+and NLTK's METEOR. Needs those packages; METEOR also needs the NLTK WordNet and punkt data.
+"""
+import pytest
+
+from project_function import evaluation
+from project_function.evaluation import BLEU_WEIGHTS, ReferenceSet, score_lexical
+
+sacrebleu = pytest.importorskip('sacrebleu')
+rouge_scorer = pytest.importorskip('rouge_score.rouge_scorer')
+nltk = pytest.importorskip('nltk')
+
+# (prediction, reference)
+PAIRS = [
+    ('The lattice spacing is 0.25 nm.', 'The measured lattice spacing is about 0.25 nm.'),
+    ('the the the the', 'the cat is on the mat'),
+    ('Dark particles on a film.\nA thin carbon film.', 'A thin carbon film supports the particles.\nDark particles are gold.'),
+    ('HRTEM image\n\nof grains', 'HRTEM image of grains\n\n'),
+    ('Bright-field TEM image of Au-Pd nanoparticles (5-10 nm), see Fig. 2a.',
+     'Bright-field TEM image showing Au-Pd nanoparticles of 5-10 nm.'),
+    # No ROUGE tokens in the prediction, but BLEU tokens
+    ('!!! ???', 'Bright-field TEM image'),
+    ('The lattice spacing is 0.25 nm.', 'The lattice spacing is 0.25 nm.'),
+]
+# Empty prediction or reference: every lexical score is 0
+EMPTY_PAIRS = [('', 'Some reference.'), ('Some prediction.', ''), ('   ', '\n')]
+
+
+def _nltk_data():
+    for path in ('corpora/wordnet', 'tokenizers/punkt_tab'):
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            return False
+    return True
+
+
+@pytest.fixture
+def without_meteor(monkeypatch):
+    """Score BLEU and ROUGE without the NLTK data METEOR needs (METEOR comes out 0)."""
+    monkeypatch.setattr(evaluation, '_nltk_resources', lambda: None)
+    monkeypatch.setattr(evaluation, 'tokenize_meteor', lambda text: tuple(text.lower().split()))
+    monkeypatch.setattr(evaluation, 'meteor', lambda reference, hypothesis, **params: 0.0)
+
+
+def _scores(pairs):
+    predictions = [prediction for prediction, _ in pairs]
+    references = ReferenceSet(reference for _, reference in pairs)
+    return score_lexical(predictions, references.index([reference for _, reference in pairs]), references)
+
+
+def test_bleu_matches_sacrebleu_counts(without_meteor):
+    scores = _scores(PAIRS)
+    bleu = sacrebleu.metrics.BLEU(tokenize='13a')
+    for k, (prediction, reference) in enumerate(PAIRS):
+        stats = bleu.corpus_score([prediction], [[reference]])
+        # evaluate's smoothed precisions: (matches + 1) / (n-grams + 1), every order
+        expected = [(stats.counts[n] + 1) / (stats.totals[n] + 1) for n in range(4)]
+        assert [scores[f'bleu_{n}'][k] for n in range(1, 5)] == pytest.approx(expected, abs=1e-12)
+        assert scores['bleu'][k] == pytest.approx(sum(w * p for w, p in zip(BLEU_WEIGHTS, expected)), abs=1e-12)
+
+
+def test_rouge_matches_rouge_score(without_meteor):
+    scores = _scores(PAIRS)
+    scorer = rouge_scorer.RougeScorer(['rouge1', 'rouge2', 'rougeL', 'rougeLsum'], use_stemmer=False)
+    for k, (prediction, reference) in enumerate(PAIRS):
+        expected = scorer.score(reference, prediction)
+        for column, name in (('rouge_1', 'rouge1'), ('rouge_2', 'rouge2'), ('rouge_l', 'rougeL'),
+                             ('rouge_lsum', 'rougeLsum')):
+            assert scores[column][k] == pytest.approx(expected[name].fmeasure, abs=1e-12), (k, column)
+        combined = (expected['rouge1'].fmeasure + expected['rouge2'].fmeasure
+                    + (expected['rougeL'].fmeasure + expected['rougeLsum'].fmeasure) / 2) / 3
+        assert scores['rouge'][k] == pytest.approx(combined, abs=1e-12)
+
+
+def test_empty_answers_score_zero(without_meteor):
+    scores = _scores(EMPTY_PAIRS + PAIRS[:1])
+    for column in evaluation.COMPONENT_COLUMNS + ('bleu', 'rouge', 'meteor', 'lexical'):
+        assert list(scores[column][:len(EMPTY_PAIRS)]) == [0.0] * len(EMPTY_PAIRS), column
+    assert scores['lexical'][-1] > 0
+
+
+@pytest.mark.skipif(not _nltk_data(), reason='NLTK WordNet/punkt data not installed')
+def test_meteor_matches_nltk():
+    from nltk.translate.meteor_score import single_meteor_score
+
+    scores = _scores(PAIRS)
+    for k, (prediction, reference) in enumerate(PAIRS):
+        expected = single_meteor_score(evaluation.tokenize_meteor(reference), evaluation.tokenize_meteor(prediction))
+        assert scores['meteor'][k] == pytest.approx(expected, abs=1e-12), k
+        assert scores['lexical'][k] == pytest.approx(0.3 * scores['rouge'][k] + 0.2 * scores['bleu'][k]
+                                                     + 0.5 * expected, abs=1e-12)
+
+
+@pytest.mark.parametrize('path, expected', [
+    ('preds.csv', 'preds_scored.csv'),
+    ('out/finetune_val_predict.CSV', 'out/finetune_val_predict_scored.csv'),
+    ('preds.tsv', 'preds_scored.csv'),
+    ('results.csv.d/preds', 'results.csv.d/preds_scored.csv'),
+])
+def test_scored_file_never_overwrites_the_input(path, expected):
+    assert evaluation.scored_path(path) == expected
@@ -0,0 +1,77 @@
+"""
+`http_harvester` against saved Nature pages served locally (`nature_site` in conftest):
+link extraction, result counts, pagination, PDF links and the bot-check detection
+that makes the crawler fall back to Selenium.
+"""
+import pytest
+
+from http_harvester import HarvestBlocked, HttpHarvester, parse_html
+
+
+@pytest.fixture
+def harvester(nature_site):
+    harvester = HttpHarvester(base_url=nature_site.url, max_retries=0, backoff=0.01)
+    yield harvester
+    harvester.close()
+
+
+def test_search_page_lists_only_result_titles(nature_site, harvester):
+    assert harvester.navigate_to_nature(2020)
+    assert harvester.get_total_results() == 2345
+    # Thumbnail, author and promoted links are not articles of the search
+    assert harvester.list_articles() == [
+        f'{nature_site.url}/articles/s41467-020-00001-1',
+        'https://www.nature.com/articles/s41467-020-00002-2',
+        f'{nature_site.url}/articles/s41467-020-00003-3',
+    ]
+
+
+def test_next_page_is_followed_until_the_last(nature_site, harvester):
+    harvester.navigate_to_nature(2020)
+    assert harvester.go_to_next_page()
+    assert harvester.list_articles() == [
+        f'{nature_site.url}/articles/s41467-020-00004-4',
+        f'{nature_site.url}/articles/s41467-020-00005-5',
+    ]
+    assert not harvester.go_to_next_page()
+    assert nature_site.requests[-1].endswith('date_range=2020-2020&page=2')
+
+
+def test_search_url_of_later_pages(nature_site, harvester):
+    harvester.navigate_to_nature(2020, page=2)
+    assert nature_site.requests == [
+        '/search?q=transmission%2Belectron%2Bmicroscopy&article_type=research&order=relevance&date_range=2020-2020&page=2'
+    ]
+    assert len(harvester.list_articles()) == 2
+
+
+def test_results_counter_with_text_around_the_number():
+    page = parse_html('<div id="search-article-list"></div><span data-test="results-data">'
+                      '<span>Showing 1&ndash;50 of</span><span>12,034 results</span></span>')
+    assert page.results_text[-1] == '12,034 results'
+
+
+@pytest.mark.parametrize('article, pdf_url', [
+    # The citation metadata wins over links on the page
+    ('s41467-020-00001-1', 'https://www.nature.com/articles/s41467-020-00001-1.pdf'),
+    # The entitlement box wins over other (supplementary) PDFs
+    ('s41467-020-00002-2', '{url}/articles/s41467-020-00002-2.pdf'),
+    ('s41467-020-00003-3', None),
+    # Missing pages are a failed article, not a blocked engine
+    ('s41467-020-00009-9', None),
+])
+def test_pdf_link_of_article_pages(nature_site, harvester, article, pdf_url):
+    expected = pdf_url.format(url=nature_site.url) if pdf_url else None
+    assert harvester.find_pdf_url(f'{nature_site.url}/articles/{article}') == expected
+
+
+def test_bot_check_instead_of_results_is_blocked(nature_site, harvester):
+    nature_site.blocked = True
+    with pytest.raises(HarvestBlocked):
+        harvester.navigate_to_nature(2020)
+
+
+def test_forbidden_article_page_is_blocked(nature_site, harvester):
+    nature_site.forbidden.add('s41467-020-00001-1')
+    with pytest.raises(HarvestBlocked):
+        harvester.find_pdf_url(f'{nature_site.url}/articles/s41467-020-00001-1')
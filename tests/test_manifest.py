@@ -0,0 +1,99 @@
+"""
+Incremental runs: which documents the manifest skips, and which stages a changed
+weight file redoes. Workers are forked after loading the stand-in models here.
+"""
+import csv
+import os
+
+import pytest
+
+from project_function import benchmark, config, pipeline, vision_crop
+
+
+class _Unusable:
+    """Detector that must not be called: the run is expected to reuse stored detections."""
+
+    def __call__(self, *args, **kwargs):
+        raise AssertionError('detector ran')
+
+
+class _Retrained(benchmark.StubClassifier):
+    """Five-class stand-in that orders the classes the other way round."""
+
+    def forward(self, x):
+        return super().forward(x).flip(1)
+
+
+@pytest.fixture
+def models():
+    loaders, loaded = dict(vision_crop.registry._loaders), dict(vision_crop.registry._models)
+    benchmark.use_stub_models(0)
+    yield
+    vision_crop.registry._loaders.clear()
+    vision_crop.registry._loaders.update(loaders)
+    vision_crop.registry._models.clear()
+    vision_crop.registry._models.update(loaded)
+
+
+@pytest.fixture
+def weights(tmp_path, monkeypatch):
+    """Stand-in weight files, so the manifest sees their content change."""
+    paths = {}
+    for name in ('CROP_IMAGES', 'IMAGE_DESCRIPTION', 'TEM_IMAGE_CROP', 'BINARY_CLASSIFIER', 'FIVE_CLASS_CLASSIFIER'):
+        paths[name] = tmp_path / 'weights' / name
+        paths[name].parent.mkdir(exist_ok=True)
+        paths[name].write_bytes(b'v1')
+        monkeypatch.setattr(config, name, str(paths[name]))
+    return paths
+
+
+def _run(pdf_dir, out_dir):
+    output_dirs = {kind: os.path.join(out_dir, kind) for kind in ('pdf_image', 'tem_image', 'description')}
+    settings = pipeline.PipelineSettings(pdf_path=pdf_dir, output_dirs=output_dirs, zoom_factor=2)
+    options = pipeline.RunOptions(csv_path=os.path.join(out_dir, 'rows.csv'),
+                                  caption_csv_path=os.path.join(out_dir, 'captions.csv'),
+                                  manifest_path=os.path.join(out_dir, 'manifest.sqlite'),
+                                  detections_path=os.path.join(out_dir, 'detections'), workers=1, preload=True)
+    summary = pipeline.run(settings, options)
+    with open(options.csv_path, newline='', encoding='utf-8') as f:
+        return summary, list(csv.DictReader(f))
+
+
+def test_classifier_change_reuses_detections(corpus, models, weights, tmp_path):
+    pdf_dir, files = corpus
+    summary, rows = _run(pdf_dir, str(tmp_path))
+    assert summary['processed'] == len(files) and not summary['failed'] and rows
+    assert len(os.listdir(tmp_path / 'detections')) == len(files)
+
+    # Nothing changed: every document is skipped
+    summary, _ = _run(pdf_dir, str(tmp_path))
+    assert summary['skipped'] == len(files) and summary['processed'] == 0
+
+    # A new classifier: documents are classified and written again from their stored detections,
+    # with the same rows as a run from scratch
+    weights['FIVE_CLASS_CLASSIFIER'].write_bytes(b'v2')
+    vision_crop.registry.register('five_class_classifier', lambda: _Retrained(5, 20))
+    _, expected = _run(pdf_dir, str(tmp_path / 'scratch'))
+    assert expected != rows
+    for name in ('crop', 'description', 'tem'):
+        vision_crop.registry.register(name, _Unusable)
+    summary, reclassified = _run(pdf_dir, str(tmp_path))
+    assert summary['processed'] == len(files) and not summary['failed']
+    assert summary['detections_reused'] == len(files)
+    assert summary['pages'] > 0
+    assert reclassified == expected
+    assert len(os.listdir(tmp_path / 'detections')) == len(files)
+
+
+def test_detector_change_detects_again(corpus, models, weights, tmp_path):
+    pdf_dir, files = corpus
+    _, rows = _run(pdf_dir, str(tmp_path))
+    before = set(os.listdir(tmp_path / 'detections'))
+
+    weights['TEM_IMAGE_CROP'].write_bytes(b'v2')
+    summary, redone = _run(pdf_dir, str(tmp_path))
+    assert summary['processed'] == len(files) and summary['detections_reused'] == 0
+    assert redone == rows
+    # The detections of the old weights are no longer referenced and were removed
+    after = set(os.listdir(tmp_path / 'detections'))
+    assert len(after) == len(files) and not before & after
@@ -0,0 +1,76 @@
+"""
+`model_server.ModelClient` when the server process dies: waiting clients raise
+instead of hanging (the server itself needs the real model weights).
+"""
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from project_function import model_server
+from project_function.model_server import ModelClient
+
+
+def _hold(alive_writer, seconds):
+    """Stand-in server process: holds the liveness pipe open and never answers."""
+    time.sleep(seconds)
+
+
+def _pipe_open_in_child(alive, results):
+    results.put(model_server._pipe_open(alive))
+
+
+@pytest.fixture
+def server_parts():
+    context = multiprocessing.get_context('spawn')
+    arena = shared_memory.SharedMemory(create=True, size=1 << 16)
+    alive, alive_writer = context.Pipe(duplex=False)
+    process = context.Process(target=_hold, args=(alive_writer, 60), daemon=True)
+    process.start()
+    alive_writer.close()
+    yield context, arena, alive, process
+    process.kill()
+    process.join()
+    alive.close()
+    arena.close()
+    arena.unlink()
+
+
+def test_reply_is_returned_while_the_server_runs(server_parts):
+    context, arena, alive, process = server_parts
+    request_queue, response_queue = context.Queue(), context.Queue()
+    client = ModelClient(0, arena.name, request_queue, response_queue,
+                         alive=lambda: model_server._pipe_open(alive), poll_interval=0.05)
+    # Answer after a few liveness checks
+    response_queue.put((1, 'ok', ['logits']))
+    assert client.call('binary_classifier', [np.zeros((3, 4, 4), np.float32)]) == ['logits']
+    assert request_queue.get(timeout=5)[:3] == (0, 1, 'binary_classifier')
+
+
+def test_waiting_client_raises_when_the_server_is_killed(server_parts):
+    context, arena, alive, process = server_parts
+    client = ModelClient(0, arena.name, context.Queue(), context.Queue(),
+                         alive=lambda: model_server._pipe_open(alive), poll_interval=0.05)
+    assert model_server._pipe_open(alive)
+    process.kill()
+    process.join()
+
+    start = time.monotonic()
+    with pytest.raises(RuntimeError, match='exited'):
+        client.call('tem', [np.zeros((8, 8, 3), np.uint8)])
+    assert time.monotonic() - start < 5
+
+
+def test_liveness_pipe_reaches_spawned_workers(server_parts):
+    # Workers get the pipe through `ModelServer.handles()`, pickled into spawned processes
+    context, arena, alive, process = server_parts
+    results = context.Queue()
+    for expected in (True, False):
+        worker = context.Process(target=_pipe_open_in_child, args=(alive, results))
+        worker.start()
+        assert results.get(timeout=60) is expected
+        worker.join()
+        process.kill()
+        process.join()
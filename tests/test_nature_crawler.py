@@ -0,0 +1,119 @@
+"""
+`NatureCrawler` engine choice: plain HTTP while it works, the Selenium browser once
+the harvester is blocked, and blocked articles handed straight to the fallback.
+"""
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from http_harvester import HarvestBlocked
+from nature_crawler import NatureCrawler
+
+ARTICLES = ['s41467-020-00001-1', 's41467-020-00002-2', 's41467-020-00003-3']
+
+
+@pytest.fixture
+def crawler(nature_site, tmp_path, monkeypatch):
+    # The crawler logs to ./logs
+    monkeypatch.chdir(tmp_path)
+    crawler = NatureCrawler(download_path=str(tmp_path / 'downloads'), start_year=2020, max_articles=10,
+                            min_delay=0, max_delay=0, http_workers=3, base_url=nature_site.url)
+    crawler.harvester.max_retries = 0
+    yield crawler
+    crawler.driver = None
+    crawler.cleanup()
+
+
+def _record_engines(crawler, monkeypatch, blocked=False, driver_starts=True):
+    """Replace the crawl and the browser start; returns the engines used (with their download lists) and the browser starts."""
+    engines, starts = [], []
+
+    def crawl_results(year, engine, downloads):
+        engines.append((engine, downloads))
+        if blocked and engine is crawler.harvester:
+            raise HarvestBlocked('bot check')
+        return True
+
+    def initialize_driver():
+        starts.append(True)
+        if driver_starts:
+            crawler.driver = object()
+        return driver_starts
+
+    monkeypatch.setattr(crawler, 'crawl_results', crawl_results)
+    monkeypatch.setattr(crawler, 'initialize_driver', initialize_driver)
+    return engines, starts
+
+
+def test_http_engine_is_used_while_it_works(crawler, monkeypatch):
+    engines, starts = _record_engines(crawler, monkeypatch)
+    assert crawler.crawl_year(2020)
+    assert [engine for engine, _ in engines] == [crawler.harvester] and not starts
+
+
+def test_blocked_harvest_falls_back_to_the_browser(crawler, monkeypatch):
+    engines, starts = _record_engines(crawler, monkeypatch, blocked=True)
+    assert crawler.crawl_year(2020)
+    assert [engine for engine, _ in engines] == [crawler.harvester, crawler] and len(starts) == 1
+    # Downloads queued over HTTP still count for the browser
+    assert engines[0][1] is engines[1][1]
+
+    # The browser is started once, later years reuse it
+    assert crawler.crawl_year(2021)
+    assert [engine for engine, _ in engines[2:]] == [crawler.harvester, crawler] and len(starts) == 1
+
+
+def test_year_is_given_up_if_the_browser_does_not_start(crawler, monkeypatch):
+    engines, starts = _record_engines(crawler, monkeypatch, blocked=True, driver_starts=False)
+    assert not crawler.crawl_year(2020)
+    assert [engine for engine, _ in engines] == [crawler.harvester] and len(starts) == 1
+
+
+def test_blocked_articles_are_handed_to_the_fallback(nature_site, crawler, monkeypatch):
+    urls = [f'{nature_site.url}/articles/{article}' for article in ARTICLES]
+    crawler.frontier.add(urls, 2020)
+    nature_site.forbidden.update(ARTICLES)
+    with pytest.raises(HarvestBlocked):
+        crawler.process_pending(2020, [], crawler.harvester)
+    assert crawler.frontier.count(2020, 'discovered') == len(urls)
+
+    # The browser takes over every article right away instead of after the lease
+    queued = []
+    monkeypatch.setattr(crawler, 'find_pdf_url', lambda url: url + '.pdf')
+    monkeypatch.setattr(crawler, 'download_pdf', lambda article, pdf_url: queued.append(article['url']))
+    crawler.process_pending(2020, [], crawler)
+    assert sorted(queued) == sorted(urls)
+
+
+def test_downloads_queued_before_the_fallback_count_towards_the_limit(nature_site, crawler, monkeypatch):
+    crawler.max_articles = 2
+    crawler.harvester.workers = 1
+    crawler.frontier.add([f'{nature_site.url}/articles/{article}' for article in ARTICLES], 2020)
+    # The first article is found over HTTP, the second one is refused
+    nature_site.forbidden.add(ARTICLES[1])
+    queued = []
+
+    def download_pdf(article, pdf_url):
+        # Still running when the browser takes over
+        future = Future()
+        queued.append(article['url'])
+
+        def finish():
+            crawler.frontier.mark_downloaded(article['url'], f'{len(queued)}.pdf')
+            future.set_result(True)
+        threading.Timer(1.0, finish).start()
+        return future
+
+    monkeypatch.setattr(crawler, 'download_pdf', download_pdf)
+    monkeypatch.setattr(crawler.harvester, 'list_articles', lambda: [])
+    # The browser engine, without a browser
+    monkeypatch.setattr(crawler, 'initialize_driver', lambda: True)
+    monkeypatch.setattr(crawler, 'navigate_to_nature', lambda year, page=1: True)
+    monkeypatch.setattr(crawler, 'get_total_results', lambda: 2345)
+    monkeypatch.setattr(crawler, 'list_articles', lambda: [])
+    monkeypatch.setattr(crawler, 'go_to_next_page', lambda: False)
+    monkeypatch.setattr(crawler, 'find_pdf_url', lambda url: url + '.pdf')
+
+    assert crawler.crawl_year(2020)
+    assert len(queued) == 2 and crawler.frontier.count(2020, 'downloaded') == 2
@@ -0,0 +1,198 @@
+"""
+`pdf_downloader` against a local `http.server`: Range resume, the PDF magic check,
+retries with backoff and the per-host `RateLimiter`.
+"""
+import http.server
+import os
+import re
+import threading
+import time
+
+import pytest
+
+import pdf_downloader
+from pdf_downloader import PdfDownloader, RateLimiter
+
+PDF = b'%PDF-1.4\n' + bytes(range(256)) * 64 + b'\n%%EOF\n'
+CUT = 8192  # Bytes sent before /cut.pdf breaks off, a multiple of the test chunk size
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves `PDF` with Range support. Behaviour per path:
+        /paper.pdf      whole file, Range honored
+        /cut.pdf        first response announces the full length but stops after `CUT` bytes
+        /paywall.pdf    an HTML page with status 200
+        /missing.pdf    404
+        /busy.pdf       `server.busy` responses of 503 (Retry-After `server.retry_after`), then the file
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.headers.get('Range'), time.monotonic()))
+            count = sum(1 for path, _, _ in server.requests if path == self.path)
+
+        if self.path == '/missing.pdf':
+            return self._send(404, b'not found', 'text/plain')
+        if self.path == '/paywall.pdf':
+            return self._send(200, b'<html><body>Please log in</body></html>', 'text/html')
+        if self.path == '/busy.pdf' and count <= server.busy:
+            headers = {'Retry-After': str(server.retry_after)} if server.retry_after is not None else {}
+            return self._send(503, b'busy', 'text/plain', headers)
+        if self.path == '/cut.pdf' and count == 1:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/pdf')
+            self.send_header('Content-Length', str(len(PDF)))
+            self.end_headers()
+            self.wfile.write(PDF[:CUT])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range') or '')
+        if match:
+            start = int(match.group(1))
+            return self._send(206, PDF[start:], 'application/pdf',
+                              {'Content-Range': f'bytes {start}-{len(PDF) - 1}/{len(PDF)}'})
+        return self._send(200, PDF, 'application/pdf')
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    httpd.busy = 2
+    httpd.retry_after = None
+    httpd.url = f'http://127.0.0.1:{httpd.server_address[1]}'
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _paths(server):
+    return [path for path, _, _ in server.requests]
+
+
+def test_downloads_and_skips_existing(server, tmp_path):
+    with PdfDownloader(str(tmp_path), backoff=0.01) as downloader:
+        assert downloader.download(f'{server.url}/paper.pdf', 'paper.pdf')
+        assert downloader.download(f'{server.url}/paper.pdf', 'paper.pdf')
+
+    assert (tmp_path / 'paper.pdf').read_bytes() == PDF
+    assert not (tmp_path / 'paper.pdf.part').exists()
+    assert _paths(server) == ['/paper.pdf']
+    assert downloader.stats()['downloaded'] == 1 and downloader.stats()['skipped'] == 1
+
+
+def test_interrupted_download_resumes_with_range(server, tmp_path):
+    # Whole chunks reach the part file before the connection breaks
+    with PdfDownloader(str(tmp_path), backoff=0.01, chunk_size=1024) as downloader:
+        assert downloader.download(f'{server.url}/cut.pdf', 'cut.pdf')
+
+    assert (tmp_path / 'cut.pdf').read_bytes() == PDF
+    (_, first_range, _), (_, second_range, _) = server.requests
+    assert first_range is None
+    # Only the missing bytes were requested again
+    assert second_range == f'bytes={CUT}-'
+    stats = downloader.stats()
+    assert stats['resumed'] == 1 and stats['retries'] == 1 and stats['bytes'] == len(PDF)
+
+
+def test_part_file_from_an_earlier_run_is_resumed(server, tmp_path):
+    (tmp_path / 'paper.pdf.part').write_bytes(PDF[:1000])
+    with PdfDownloader(str(tmp_path)) as downloader:
+        assert downloader.download(f'{server.url}/paper.pdf', 'paper.pdf')
+
+    assert (tmp_path / 'paper.pdf').read_bytes() == PDF
+    assert server.requests[0][1] == 'bytes=1000-'
+
+
+def test_html_page_is_rejected_without_retry(server, tmp_path):
+    with PdfDownloader(str(tmp_path), backoff=0.01) as downloader:
+        assert not downloader.download(f'{server.url}/paywall.pdf', 'paywall.pdf')
+
+    assert not os.listdir(tmp_path)
+    assert _paths(server) == ['/paywall.pdf']
+    assert downloader.stats()['failed'] == 1 and downloader.stats()['retries'] == 0
+
+
+def test_client_error_is_not_retried(server, tmp_path):
+    with PdfDownloader(str(tmp_path), backoff=0.01) as downloader:
+        assert not downloader.download(f'{server.url}/missing.pdf', 'missing.pdf')
+    assert _paths(server) == ['/missing.pdf']
+
+
+def test_transient_errors_are_retried_with_exponential_backoff(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_downloader.random, 'uniform', lambda a, b: 0.0)
+    with PdfDownloader(str(tmp_path), backoff=0.1) as downloader:
+        assert downloader.download(f'{server.url}/busy.pdf', 'busy.pdf')
+
+    times = [t for _, _, t in server.requests]
+    assert len(times) == 3
+    # Waits of backoff * 2**attempt: 0.1 s, then 0.2 s
+    assert times[1] - times[0] >= 0.1 and times[2] - times[1] >= 0.2
+    assert downloader.stats()['retries'] == 2
+
+
+def test_retries_give_up_after_max_retries(server, tmp_path):
+    server.busy = 100
+    with PdfDownloader(str(tmp_path), max_retries=2, backoff=0.01) as downloader:
+        assert not downloader.download(f'{server.url}/busy.pdf', 'busy.pdf')
+    assert len(server.requests) == 3
+    assert downloader.stats()['failed'] == 1
+
+
+def test_retry_after_defers_the_host(server, tmp_path):
+    server.busy, server.retry_after = 1, 0.5
+    limiter = RateLimiter(min_interval=0, jitter=0)
+    with PdfDownloader(str(tmp_path), workers=2, rate_limiter=limiter, backoff=0.01) as downloader:
+        busy = downloader.submit(f'{server.url}/busy.pdf', 'busy.pdf')
+        while not server.requests:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        # Another file on the same host also waits out the Retry-After
+        other = downloader.submit(f'{server.url}/paper.pdf', 'paper.pdf')
+        assert busy.result() and other.result()
+
+    first = server.requests[0][2]
+    assert all(t - first >= 0.45 for _, _, t in server.requests[1:])
+
+
+def test_rate_limiter_spaces_requests_per_host(server, tmp_path):
+    limiter = RateLimiter(min_interval=0.2, jitter=0)
+    names = [f'paper{i}.pdf' for i in range(3)]
+    with PdfDownloader(str(tmp_path), workers=3, rate_limiter=limiter) as downloader:
+        futures = [downloader.submit(f'{server.url}/paper.pdf', name) for name in names]
+        assert all(future.result() for future in futures)
+
+    times = sorted(t for _, _, t in server.requests)
+    assert len(times) == 3
+    assert all(later - earlier >= 0.19 for earlier, later in zip(times, times[1:]))
+
+
+def test_rate_limiter_does_not_delay_other_hosts():
+    limiter = RateLimiter(min_interval=0.5, jitter=0)
+    limiter.wait('http://a.example/x.pdf')
+    start = time.monotonic()
+    limiter.wait('http://b.example/x.pdf')
+    assert time.monotonic() - start < 0.1
+
+    limiter.wait('http://a.example/y.pdf')
+    assert time.monotonic() - start >= 0.45
@@ -0,0 +1,162 @@
+"""
+The Ray execution mode against the sequential process pool on a local 2-CPU cluster.
+Every Ray worker process loads the stand-in models of `benchmark.use_stub_models`.
+"""
+import csv
+import os
+import shutil
+
+import pytest
+
+ray = pytest.importorskip('ray')
+
+from conftest import SRC_DIR  # noqa: E402
+from project_function import benchmark, pipeline, ray_pipeline  # noqa: E402
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+CRASHES = 3  # One more than the restarts `map_pdfs` allows, so the worker is lost for good
+
+
+def _setup_worker():
+    """
+    Ray worker setup hook: stand-in models, with TEST_RAY_CRASH_FILE a worker that dies on that file,
+    and with TEST_RAY_RAISE_FILE one that raises on it.
+    """
+    benchmark.use_stub_models(0)
+    process = pipeline._process_pdf_safe
+    raise_file = os.environ.get('TEST_RAY_RAISE_FILE')
+    if raise_file:
+        def raise_on_file(args):
+            if args[0] == raise_file:
+                raise MemoryError('out of memory')
+            return process(args)
+        pipeline._process_pdf_safe = raise_on_file
+    crash_file = os.environ.get('TEST_RAY_CRASH_FILE')
+    if not crash_file:
+        return
+
+    def crash_first_attempts(args):
+        if args[0] == crash_file:
+            for attempt in range(CRASHES):
+                try:
+                    os.close(os.open(os.path.join(os.environ['TEST_RAY_CRASH_DIR'], f'crash-{attempt}'),
+                                     os.O_CREAT | os.O_EXCL))
+                except FileExistsError:
+                    continue
+                os._exit(1)
+        return process(args)
+    pipeline._process_pdf_safe = crash_first_attempts
+
+
+def _settings(pdf_dir, out_dir):
+    output_dirs = {kind: os.path.join(out_dir, kind) for kind in ('pdf_image', 'tem_image', 'description')}
+    return pipeline.PipelineSettings(pdf_path=pdf_dir, output_dirs=output_dirs, zoom_factor=2)
+
+
+def _run(settings, out_dir, **options):
+    csv_path = os.path.join(out_dir, 'rows.csv')
+    options = pipeline.RunOptions(csv_path=csv_path, caption_csv_path=os.path.join(out_dir, 'captions.csv'),
+                                  use_manifest=False, **options)
+    summary = pipeline.run(settings, options)
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        return summary, list(csv.DictReader(f))
+
+
+def _start_ray(env_vars=None):
+    env_vars = {'PYTHONPATH': os.pathsep.join([SRC_DIR, TESTS_DIR]), **(env_vars or {})}
+    ray.init(num_cpus=2, include_dashboard=False,
+             runtime_env={'worker_process_setup_hook': _setup_worker, 'env_vars': env_vars})
+
+
+@pytest.fixture(scope='module')
+def sequential_rows(corpus, tmp_path_factory):
+    """Rows of the process pool with one worker, forked after loading the stand-in models here."""
+    pdf_dir, _ = corpus
+    out_dir = str(tmp_path_factory.mktemp('sequential'))
+    benchmark.use_stub_models(0)
+    summary, rows = _run(_settings(pdf_dir, out_dir), out_dir, workers=1, preload=True)
+    assert not summary['failed'] and rows
+    return rows
+
+
+def test_ray_rows_match_sequential_run(corpus, sequential_rows, tmp_path):
+    pdf_dir, files = corpus
+    _start_ray()
+    summary, rows = _run(_settings(pdf_dir, str(tmp_path)), str(tmp_path), workers=2, ray_address='local')
+
+    assert rows == sequential_rows
+    assert summary['processed'] == len(files) and not summary['failed']
+    assert summary['ray']['workers'] == 2 and summary['ray']['resubmitted'] == 0
+    assert not ray.is_initialized()
+    written = sorted(os.listdir(tmp_path / 'tem_image'))
+    assert written == sorted(row['sub_image'] for row in rows)
+
+
+def test_lost_worker_is_resubmitted(corpus, sequential_rows, tmp_path):
+    pdf_dir, files = corpus
+    crash_dir = tmp_path / 'crashes'
+    crash_dir.mkdir()
+    _start_ray({'TEST_RAY_CRASH_FILE': files[0], 'TEST_RAY_CRASH_DIR': str(crash_dir)})
+    summary, rows = _run(_settings(pdf_dir, str(tmp_path)), str(tmp_path), workers=2, ray_address='local')
+
+    # The worker died on every attempt Ray retried it for; the driver ran the file on the other worker
+    assert len(os.listdir(crash_dir)) == CRASHES
+    assert summary['ray']['resubmitted'] == 1
+    assert not summary['failed']
+    assert rows == sequential_rows
+
+
+def test_error_in_worker_fails_only_that_document(corpus, sequential_rows, tmp_path):
+    pdf_dir, files = corpus
+    _start_ray({'TEST_RAY_RAISE_FILE': files[0]})
+    # One worker: had it been retired, every later file would fail with "No Ray workers left"
+    summary, rows = _run(_settings(pdf_dir, str(tmp_path)), str(tmp_path), workers=1, ray_address='local')
+
+    assert summary['failed'] == [files[0]]
+    assert summary['ray']['resubmitted'] == 0
+    assert summary['processed'] == len(files) - 1
+    prefix = f"PDF{os.path.splitext(files[0])[0]}_"
+    assert rows == [row for row in sequential_rows if not row['parent_image'].startswith(prefix)]
+
+
+def test_shard_by_size_keeps_local_files_on_their_node():
+    sizes = {'a.pdf': 50, 'b.pdf': 40, 'c.pdf': 30, 'd.pdf': 20, 'e.pdf': 10}
+    assert ray_pipeline.shard_by_size(list(sizes), sizes, 2) == [['a.pdf', 'd.pdf', 'e.pdf'], ['b.pdf', 'c.pdf']]
+    # a, b and c are stored on node 0 only; the rest still balances the load
+    local = {'a.pdf': [0], 'b.pdf': [0], 'c.pdf': [0, 1]}
+    assert ray_pipeline.shard_by_size(list(sizes), sizes, 2, local) == [['a.pdf', 'b.pdf'], ['c.pdf', 'd.pdf', 'e.pdf']]
+
+
+def test_local_copies_are_read_on_their_node(corpus, sequential_rows, tmp_path):
+    pdf_dir, files = corpus
+    shared_dir, local_dir = tmp_path / 'shared', tmp_path / 'local'
+    shutil.copytree(pdf_dir, shared_dir)
+    local_dir.mkdir()
+    # Only the node-local copy of the first file can be read
+    shutil.copy(os.path.join(pdf_dir, files[0]), local_dir)
+    (shared_dir / files[0]).write_bytes(b'not a pdf')
+    _start_ray()
+    node = ray.nodes()[0]['NodeManagerAddress']
+    summary, rows = _run(_settings(str(shared_dir), str(tmp_path)), str(tmp_path), workers=2, ray_address='local',
+                         ray_locality={node: str(local_dir), 'no-such-node': str(tmp_path)})
+
+    assert not summary['failed']
+    assert summary['ray']['local_files'] == 1
+    assert rows == sequential_rows
+
+
+def test_closing_early_still_finishes_shards(corpus, tmp_path):
+    pdf_dir, files = corpus
+    settings = _settings(pdf_dir, str(tmp_path))
+    settings.output_mode, settings.shard_path = 'shards', str(tmp_path / 'shards')
+    os.makedirs(settings.shard_path)
+    _start_ray()
+    results = ray_pipeline.map_pdfs(files, settings.resolved(), workers_per_node=2)
+    file, rows, _, stats, error = next(results)
+    results.close()
+
+    assert file == files[0] and error is None and rows
+    assert not ray.is_initialized()
+    # The open shards were finished (renamed from '.tmp') before Ray shut down
+    assert stats['shards'] and all((tmp_path / 'shards' / name).exists() for name in stats['shards'])
+    assert not [name for name in os.listdir(settings.shard_path) if name.endswith('.tmp')]
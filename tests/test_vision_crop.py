@@ -0,0 +1,81 @@
+"""
+`vision_crop.TEM_classifier_batch` against the single-image `TEM_classifier` it replaces:
+same preprocessing, labels and probabilities. Seeded ResNet-18s (every image 'NotNone')
+and the benchmark's input-sensitive stubs (mixed labels) stand in for the weights.
+"""
+import cv2
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torchvision import models
+
+from project_function import benchmark, vision_crop
+
+
+def _images():
+    rng = np.random.default_rng(0)
+    gray = rng.normal(128, 30, (300, 420)).clip(0, 255).astype(np.uint8)
+    fringes = (127 + 100 * np.sin(np.arange(97)[:, None] / 2 + np.arange(61)[None, :] / 3)).astype(np.uint8)
+    return [
+        cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR),                              # Downscaled, non-square
+        cv2.cvtColor(fringes, cv2.COLOR_GRAY2BGR),                           # Upscaled
+        rng.integers(0, 256, (224, 224, 3), dtype=np.uint8),                 # Already 224 × 224
+        rng.integers(0, 256, (1000, 37, 3), dtype=np.uint8),                 # Extreme aspect ratio
+        np.dstack([np.full((150, 200), c, np.uint8) for c in (30, 120, 240)]),  # Colour plot
+    ]
+
+
+def _resnet(num_classes, seed):
+    torch.manual_seed(seed)
+    return models.resnet18(num_classes=num_classes).eval()
+
+
+@pytest.fixture(params=['resnet', 'stub'])
+def classifiers(request, monkeypatch):
+    registry = vision_crop.registry
+    monkeypatch.setattr(registry, '_loaders', dict(registry._loaders))
+    monkeypatch.setattr(registry, '_models', {})
+    if request.param == 'resnet':
+        registry.register('binary_classifier', lambda: _resnet(2, 2))
+        registry.register('five_class_classifier', lambda: _resnet(5, 100))
+    else:
+        registry.register('binary_classifier', lambda: benchmark.StubClassifier(2, 10))
+        registry.register('five_class_classifier', lambda: benchmark.StubClassifier(5, 20))
+    models = vision_crop._load_classifiers()
+    monkeypatch.setattr(vision_crop.TEM_classifier, 'device', torch.device('cpu'))
+    return models
+
+
+def _single_input(image):
+    return vision_crop.TEM_classifier.transform(Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)))
+
+
+def test_batch_preprocessing_equals_the_single_image_transform(classifiers):
+    images = _images()
+    batch = vision_crop._preprocess_batch(images)
+    assert torch.equal(batch, torch.stack([_single_input(image) for image in images]))
+
+
+def test_batch_preprocessing_of_gray_and_bgra_images(classifiers):
+    gray = _images()[1][..., 0]
+    assert torch.equal(vision_crop._preprocess_batch([gray]), vision_crop._preprocess_batch([_images()[1]]))
+    bgra = cv2.cvtColor(_images()[0], cv2.COLOR_BGR2BGRA)
+    assert torch.equal(vision_crop._preprocess_batch([bgra]), vision_crop._preprocess_batch([_images()[0]]))
+
+
+def test_batch_labels_and_probabilities_match_the_single_image_path(classifiers):
+    binary_model, five_model = classifiers
+    images = _images()
+    results = vision_crop._classify_batch(images, batch_size=2)
+    assert any(entry['five_class_probs'] is not None for entry in results)
+
+    for image, entry in zip(images, results):
+        assert entry['label'] == vision_crop._classify_one(image)
+        with torch.no_grad():
+            single = _single_input(image).unsqueeze(0)
+            binary = torch.softmax(binary_model(single), dim=1)[0].numpy()
+            five = torch.softmax(five_model(single), dim=1)[0].numpy()
+        assert list(entry['binary_probs'].values()) == pytest.approx(binary.tolist(), abs=1e-5)
+        if entry['five_class_probs'] is not None:
+            assert list(entry['five_class_probs'].values()) == pytest.approx(five.tolist(), abs=1e-5)